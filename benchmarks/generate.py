@@ -0,0 +1,168 @@
+"""Generates synthetic ETrade-style transaction histories for benchmarks."""
+
+import argparse
+import csv
+import dataclasses
+import datetime as dt
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "capital_gains"))
+
+from const import WASHSALE_PERIOD  # noqa: E402
+
+HEADER = [
+    "Trade Date", "Order Type", "Security", "Cusip", "Transaction Description",
+    "Quantity", "Executed Price", "Commission", "Net Amount",
+]
+
+FEES = ("0", "0", "0", "1", "4.95")
+
+START_DATE = dt.date(2015, 1, 2)
+
+
+@dataclasses.dataclass
+class Parameters:
+    """What the generated history looks like."""
+
+    symbols: int = 10
+    lots_per_symbol: int = 100
+    # Share of sales made at a loss
+    loss_ratio: float = 0.4
+    # Share of sales at a loss followed by a purchase within WASHSALE_PERIOD days
+    wash_sale_ratio: float = 0.3
+    # Share of purchases that are option round trips instead of shares
+    option_ratio: float = 0.1
+    # Share of sales on the same day as the purchase they close, listed first
+    collision_ratio: float = 0.05
+    seed: int = 0
+
+
+def generate(out_file, parameters: Parameters):
+    """Writes a history to `out_file` and returns the number of transactions."""
+    rng = random.Random(parameters.seed)
+
+    rows = []
+    for number in range(parameters.symbols):
+        rows.extend(_symbol_rows(rng, f"SYM{number:04}", parameters))
+
+    # ETrade lists the newest transactions first; sort() is stable, so
+    # same-day sales stay listed before the purchases they close
+    rows.sort(key=lambda row: row[0], reverse=True)
+
+    writer = csv.writer(out_file)
+    writer.writerow(HEADER)
+    for date, order_type, security, quantity, price, fee in rows:
+        writer.writerow([
+            date.strftime("%m/%d/%Y"), order_type, security, "",
+            f"{quantity} {security}", f"{quantity:.1f}", f"{price:.2f}", fee,
+            f"{quantity * price:.2f}",
+        ])
+
+    return len(rows)
+
+
+def _symbol_rows(rng, symbol, parameters):
+    """Returns the rows of one symbol, oldest first within each day."""
+    rows = []
+    date = START_DATE + dt.timedelta(days=rng.randrange(30))
+    price = rng.uniform(10, 500)
+    # (quantity, price) of the open share lots, oldest first
+    open_lots = []
+
+    def buy(date, quantity, price):
+        rows.append((date, "Buy", symbol, quantity, price, rng.choice(FEES)))
+        open_lots.append([quantity, price])
+
+    def sell(date, quantity, price):
+        rows.append((date, "Sell", symbol, quantity, price, rng.choice(FEES)))
+        while quantity:
+            closed = min(quantity, open_lots[0][0])
+            open_lots[0][0] -= closed
+            quantity -= closed
+            if not open_lots[0][0]:
+                open_lots.pop(0)
+
+    for _ in range(parameters.lots_per_symbol):
+        date += dt.timedelta(days=rng.randint(1, 10))
+        price = max(1.0, price * rng.uniform(0.9, 1.1))
+
+        if rng.random() < parameters.option_ratio:
+            rows.extend(_option_rows(rng, symbol, date, price))
+            continue
+
+        if rng.random() < parameters.collision_ratio:
+            # Same-day round trip, listed before the purchase like ETrade does
+            quantity = rng.randint(1, 100)
+            rows.append((date, "Sell", symbol, quantity, price * rng.uniform(0.95, 1.05),
+                         rng.choice(FEES)))
+            rows.append((date, "Buy", symbol, quantity, price, rng.choice(FEES)))
+            continue
+
+        buy(date, rng.randint(1, 100), price)
+
+        if len(open_lots) > 1 and rng.random() < 0.5:
+            date += dt.timedelta(days=rng.randint(1, 10))
+            quantity = rng.randint(1, sum(quantity for quantity, _ in open_lots))
+            is_loss = rng.random() < parameters.loss_ratio
+            basis = open_lots[0][1]
+            sale_price = basis * (rng.uniform(0.7, 0.99) if is_loss else rng.uniform(1.01, 1.3))
+            sell(date, quantity, sale_price)
+
+            if is_loss and rng.random() < parameters.wash_sale_ratio:
+                date += dt.timedelta(days=rng.randint(0, WASHSALE_PERIOD))
+                buy(date, rng.randint(1, 100), sale_price)
+
+    return rows
+
+
+def _option_rows(rng, symbol, date, price):
+    """Returns a round trip in a long or a short option."""
+    expiration = date + dt.timedelta(days=rng.randint(7, 90))
+    strike = round(price)
+    kind = rng.choice(("Call", "Put"))
+    security = f"{symbol} {expiration:%b %d '%y} ${strike} {kind}"
+    contracts = rng.randint(1, 10)
+    premium = rng.uniform(0.1, 10)
+    close_date = date + dt.timedelta(days=rng.randint(0, (expiration - date).days))
+    close_premium = premium * rng.uniform(0.2, 2)
+
+    if rng.random() < 0.5:
+        return [
+            (date, "Buy Open", security, contracts, premium, rng.choice(FEES)),
+            (close_date, "Sell To Close", security, contracts, close_premium, rng.choice(FEES)),
+        ]
+    return [
+        (date, "Sell To Open", security, contracts, premium, rng.choice(FEES)),
+        (close_date, "Buy To Close", security, contracts, close_premium, rng.choice(FEES)),
+    ]
+
+
+def get_parser():
+    """Returns an argparser with an option per Parameters field."""
+    defaults = Parameters()
+    parser = argparse.ArgumentParser(description="Generates a synthetic ETrade history")
+    parser.add_argument("filename", metavar="<output file>")
+    for field in dataclasses.fields(Parameters):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            dest=field.name,
+            type=field.type,
+            default=getattr(defaults, field.name),
+            help="(default: %(default)s)",
+            metavar="<n>",
+        )
+    return parser
+
+
+def main():
+    args = vars(get_parser().parse_args())
+    filename = args.pop("filename")
+    with open(filename, "w", encoding="utf-8", newline="") as out_file:
+        count = generate(out_file, Parameters(**args))
+    print(f"Wrote {count} transactions to {filename}")
+
+
+if __name__ == "__main__":
+    main()
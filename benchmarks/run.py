@@ -0,0 +1,201 @@
+"""Times loading, processing and formatting synthetic histories of several sizes.
+
+Each run appends its timings to a results file, and is compared with the last
+run with the same parameters there, so regressions are visible.
+"""
+
+import argparse
+import collections
+import contextlib
+import dataclasses
+import datetime as dt
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "capital_gains"))
+
+import formatter  # noqa: E402
+import loader  # noqa: E402
+import logic  # noqa: E402
+
+DEFAULT_SCALES = ("10x100", "100x100", "100x1000")
+
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+STAGES = ("load", "process", "format")
+
+
+def run(filename, repeat, wash_sales):
+    """Returns the best time of each stage over `repeat` runs, in seconds."""
+    best = dict.fromkeys(STAGES, float("inf"))
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        open_lots, sales = loader.load_transactions(filename)
+        load_time = time.perf_counter() - start
+
+        closed_lots = collections.defaultdict(list)
+        # Don't time printing "No closable lots" diagnostics
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for symbol, symbol_sales in sales.items():
+                closed_lots[symbol] = logic.process_sales(
+                    open_lots[symbol], symbol_sales, wash_sales)
+            process_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        formatter.format(closed_lots, open_lots, 2, 0, True)
+        format_time = time.perf_counter() - start
+
+        for stage, stage_time in zip(STAGES, (load_time, process_time, format_time)):
+            best[stage] = min(best[stage], stage_time)
+
+    return best
+
+
+def parse_scale(scale: str):
+    """Parses a scale written as <symbols>x<lots per symbol>."""
+    symbols, lots_per_symbol = scale.split("x")
+    return int(symbols), int(lots_per_symbol)
+
+
+def load_results(filename):
+    """Returns the recorded results, oldest first."""
+    if not os.path.exists(filename):
+        return []
+    with open(filename, "r", encoding="utf-8") as in_file:
+        return [json.loads(line) for line in in_file if line.strip()]
+
+
+def git_commit():
+    """Returns the commit being benchmarked, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, check=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_parser():
+    """Returns an argparser."""
+    parser = argparse.ArgumentParser(description="Runs the benchmarks")
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        default=DEFAULT_SCALES,
+        help="history sizes, as <symbols>x<lots per symbol> (default: %(default)s)",
+        metavar="<scale>",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="runs per scale; the best time of each stage is kept (default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "--results",
+        default=DEFAULT_RESULTS,
+        help="file to append results to (default: %(default)s)",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="report stages slower than the last recorded run by more than this ratio (default: %(default)s)",
+        metavar="<ratio>",
+    )
+    parser.add_argument(
+        "-w",
+        "--wash-sales",
+        dest="wash_sales",
+        action=argparse.BooleanOptionalAction,
+        help="identify wash sales and adjust cost basis",
+        default=True,
+    )
+    for field in dataclasses.fields(generate.Parameters):
+        if field.name in ("symbols", "lots_per_symbol"):
+            continue
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            dest=field.name,
+            type=field.type,
+            default=field.default,
+            help="generator parameter (default: %(default)s)",
+            metavar="<n>",
+        )
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    previous_results = load_results(args.results)
+    commit = git_commit()
+
+    regressions = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for scale in args.scales:
+            symbols, lots_per_symbol = parse_scale(scale)
+            parameters = generate.Parameters(
+                symbols=symbols,
+                lots_per_symbol=lots_per_symbol,
+                loss_ratio=args.loss_ratio,
+                wash_sale_ratio=args.wash_sale_ratio,
+                option_ratio=args.option_ratio,
+                collision_ratio=args.collision_ratio,
+                seed=args.seed,
+            )
+
+            filename = os.path.join(temp_dir, f"{scale}.csv")
+            with open(filename, "w", encoding="utf-8", newline="") as out_file:
+                transactions = generate.generate(out_file, parameters)
+
+            times = run(filename, args.repeat, args.wash_sales)
+            result = {
+                "date": dt.datetime.now().isoformat(timespec="seconds"),
+                "commit": commit,
+                "python": platform.python_version(),
+                "parameters": dataclasses.asdict(parameters),
+                "wash_sales": args.wash_sales,
+                "transactions": transactions,
+                "seconds": times,
+            }
+
+            previous = [
+                previous_result for previous_result in previous_results
+                if previous_result["parameters"] == result["parameters"]
+                and previous_result["wash_sales"] == result["wash_sales"]
+            ]
+            line = f"{scale:>10} {transactions:>9} transactions:"
+            for stage in STAGES:
+                line += f" {stage} {times[stage]:8.3f}s"
+                if previous:
+                    previous_time = previous[-1]["seconds"][stage]
+                    change = times[stage] / previous_time - 1 if previous_time else 0
+                    line += f" ({change:+.0%})"
+                    if change > args.threshold:
+                        regressions.append(f"{scale} {stage}: {previous_time:.3f}s -> {times[stage]:.3f}s")
+            print(line)
+
+            with open(args.results, "a", encoding="utf-8") as out_file:
+                out_file.write(json.dumps(result) + "\n")
+
+    if regressions:
+        print("Regressions since the last recorded run:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
 """Calculates capital gains from brokerage transactions."""
 
-import collections
+import contextlib
+import cProfile
 import logging
+import signal
+import sys
 
 import argument_parser
-import formatter
+import cache
+import columnar
+import daemon
+import fixedpoint
 import loader
 import logic
+import lotstore
+import lottrace
+import securities
+import snapshot
+import stats
+import writers
 
 
 def main():
@@ -18,23 +30,265 @@ def main():
         level=logging.DEBUG if args.verbose else logging.WARNING,
     )
 
-    open_lots, sales = loader.load_transactions(
-        args.filename, args.fiscal_year)
-    closed_lots = collections.defaultdict(list)
-
-    for symbol, symbol_sales in sales.items():
-        closed_lots[symbol] = logic.process_sales(
-            open_lots[symbol], symbol_sales, args.wash_sales
-        )
-
-    output = formatter.format(
-        closed_lots,
-        open_lots,
-        args.decimal_places,
-        args.shares_decimal_places,
-        args.totals,
-    )
-    print(output)
+    if not args.filenames and not args.daemon:
+        parser.error("the following arguments are required: <input file>")
+
+    if args.daemon:
+        if (args.arithmetic != "decimal" or args.cache_dir or args.parsed_cache or args.save_snapshot
+                or args.fiscal_year or args.lot_store or args.output_per_year or args.identical
+                or args.option_wash_sales or args.jobs > 1):
+            parser.error("--daemon can't be used with --arithmetic, --cache-dir, --parsed-cache, "
+                         "--save-snapshot, --fiscal-year, --lot-store, --output-per-year, "
+                         "--identical, --option-wash-sales or --jobs")
+        run_daemon(args)
+        return
+    if args.socket or args.checkpoint:
+        parser.error("--socket and --checkpoint require --daemon")
+
+    if args.save_snapshot and args.snapshot_date is None:
+        parser.error("--save-snapshot requires --snapshot-date")
+    if args.save_snapshot and args.fiscal_year:
+        parser.error("--save-snapshot needs every sale, so it can't be used with --fiscal-year")
+
+    if args.identical or args.option_wash_sales:
+        if (args.stream or args.lot_store or args.save_snapshot or args.resume or args.cache_dir
+                or args.output_per_year):
+            parser.error("--identical and --option-wash-sales can't be used with --stream, "
+                         "--lot-store, --save-snapshot, --resume, --cache-dir or --output-per-year")
+
+    if args.lot_store and args.lot_selection != "fifo":
+        parser.error("--lot-store only supports --lot-selection fifo")
+
+    if args.output_per_year:
+        if "{year}" not in args.output_per_year:
+            parser.error("--output-per-year needs a file name pattern with {year}")
+        if args.output or args.fiscal_year or args.save_snapshot or args.resume:
+            parser.error("--output-per-year can't be used with --output, --fiscal-year, "
+                         "--save-snapshot or --resume")
+
+    if args.cache_dir and args.arithmetic != "decimal":
+        parser.error("--cache-dir only caches results of decimal arithmetic")
+
+    # Options that stream transactions, as given
+    streaming = [
+        option for option, value in (
+            ("--stream", args.stream), ("--save-snapshot", args.save_snapshot),
+            ("--resume", args.resume), ("--lot-store", args.lot_store),
+            ("--output-per-year", args.output_per_year))
+        if value]
+    if streaming:
+        if args.arithmetic != "decimal":
+            parser.error(f"--arithmetic is not supported with {streaming[0]}")
+        if args.cache_dir:
+            parser.error(f"--cache-dir is not supported with {streaming[0]}")
+        if args.parsed_cache:
+            parser.error(f"--parsed-cache is not supported with {streaming[0]}")
+        if args.jobs > 1:
+            parser.error(f"--jobs is not supported with {streaming[0]}")
+
+    if args.totals and args.format != "text":
+        parser.error("--totals is only supported with --format text")
+
+    if args.stats:
+        stats.enable()
+
+    with contextlib.ExitStack() as stack:
+        if args.output:
+            out_file = stack.enter_context(
+                open(args.output, "w", encoding="utf-8", newline=""))
+        else:
+            out_file = sys.stdout
+            if args.format != "text":
+                # Keep diagnostics out of machine-readable output
+                stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+
+        if args.output_per_year:
+            writer = writers.YearlyWriter(
+                args.output_per_year, writers.WRITERS[args.format],
+                args.decimal_places, args.shares_decimal_places, args.totals)
+        else:
+            writer = writers.WRITERS[args.format](
+                out_file, args.decimal_places, args.shares_decimal_places, args.totals)
+        if args.trace:
+            trace_file = stack.enter_context(open(args.trace, "w", encoding="utf-8"))
+            lottrace.enable(capacity=0, out_file=trace_file, log=args.verbose)
+        elif args.verbose:
+            lottrace.enable(capacity=0, log=True)
+
+        if args.profile:
+            profiler = cProfile.Profile()
+            # Exit callbacks run last in first out, so this dumps the stats
+            # after profiling stops
+            stack.callback(profiler.dump_stats, args.profile)
+            stack.enter_context(profiler)
+
+        store = stack.enter_context(lotstore.LotStore(args.lot_store)) if args.lot_store else None
+        agree = process(args, writer, store)
+
+    if args.stats:
+        print(stats.disable().format(), file=sys.stderr)
+
+    if not agree:
+        sys.exit(1)
+
+
+def process(args, writer, store=None):
+    """Processes the input file and writes the results with `writer`.
+
+    Lots are kept in `store`, if given (a lotstore.LotStore). Returns whether both engines agree when verifying arithmetic, True otherwise.
+    """
+    agree = True
+
+    if args.output_per_year:
+        process_years(args, writer, store)
+        return agree
+
+    if args.stream or args.save_snapshot or args.resume or store is not None:
+        open_lots, closed_lots = process_stream(args, store, writer)
+    else:
+        parsed_cache = columnar.ParsedCache(args.parsed_cache) if args.parsed_cache else None
+        open_lots, sales = loader.load_transactions(
+            args.filenames, args.fiscal_year, parsed_cache)
+        groups = None
+        if args.identical or args.option_wash_sales:
+            groups = securities.Groups(args.identical, args.option_wash_sales)
+
+        if args.arithmetic == "fixed":
+            closed_lots = fixedpoint.process_all_sales(
+                open_lots, sales, args.wash_sales, args.jobs, args.lot_selection, groups)
+        elif args.arithmetic == "verify":
+            closed_lots, agree = fixedpoint.verify(
+                open_lots, sales, args.wash_sales, args.jobs, args.lot_selection, groups)
+        elif args.cache_dir:
+            closed_lots = cache.process_all_sales(
+                cache.ResultCache(args.cache_dir, args.cache_size * 1024 * 1024),
+                open_lots, sales, args.wash_sales, args.fiscal_year, args.jobs, args.lot_selection)
+        else:
+            closed_lots = logic.process_all_sales(
+                open_lots, sales, args.wash_sales, args.jobs, args.lot_selection, groups)
+
+    with stats.timer("formatting"):
+        writer.write_results(closed_lots, open_lots)
+        writer.close()
+
+    return agree
+
+
+def process_stream(args, store=None, writer=None):
+    """Streams transactions through an IncrementalProcessor.
+
+    Resumes from and saves snapshots as requested, and keeps lots in `store`
+    if given. Returns the open and the closed lots.
+
+    If `writer` is streaming, closed lots are written as soon as they are
+    final instead, and none are returned.
+    """
+    after_date = None
+    if args.resume:
+        processor, after_date = snapshot.load(args.resume, args.wash_sales, store, args.lot_selection)
+    else:
+        processor = logic.IncrementalProcessor(args.wash_sales, store, args.lot_selection)
+
+    write_closed_lot = None
+    if writer is not None and writer.streaming:
+        processor.keep_closed_lots = False
+        write_closed_lot = writer.write_closed_lot
+
+    snapshot_date = args.snapshot_date if args.save_snapshot else None
+    for item in loader.stream_transactions(
+            args.filenames, args.fiscal_year, after_date=after_date, start_index=processor.next_index):
+        if snapshot_date is not None and item.date > snapshot_date:
+            snapshot.save(args.save_snapshot, processor, snapshot_date)
+            snapshot_date = None
+        closed_lots = processor.add(item)
+        if write_closed_lot is not None:
+            _write_closed_lots(write_closed_lot, closed_lots, args.fiscal_year)
+
+    if snapshot_date is not None:
+        snapshot.save(args.save_snapshot, processor, snapshot_date)
+
+    if write_closed_lot is not None:
+        _write_closed_lots(write_closed_lot, processor.flush(), args.fiscal_year)
+    closed_lots = processor.finish()
+
+    if args.fiscal_year:
+        # Sales that were pending in a snapshot can be from an earlier year
+        for symbol, lots in closed_lots.items():
+            closed_lots[symbol] = [
+                lot for lot in lots if lot.sale.date.year == args.fiscal_year]
+
+    return processor.open_lots, closed_lots
+
+
+def _write_closed_lots(write_closed_lot, closed_lots, fiscal_year):
+    # Sales that were pending in a snapshot can be from an earlier year
+    for lot in closed_lots:
+        if not fiscal_year or lot.sale.date.year == fiscal_year:
+            write_closed_lot(lot)
+
+
+def process_years(args, writer, store=None):
+    """Streams transactions through an IncrementalProcessor, writing each year's closed lots.
+
+    `writer` is a writers.YearlyWriter. A year is finished as soon as every
+    sale of that year has been processed, i.e. once transactions more than
+    WASHSALE_PERIOD days past the year end have arrived.
+
+    Every year's sales are processed, so a year's lots are those a run without
+    --fiscal-year closes that year; a --fiscal-year run skips the sales of
+    earlier years, and closes the lots they closed again.
+    """
+    processor = logic.IncrementalProcessor(
+        args.wash_sales, store, args.lot_selection, keep_closed_lots=False)
+
+    for item in loader.stream_transactions(args.filenames):
+        for lot in processor.add(item):
+            writer.write_closed_lot(lot)
+
+        # Pending sales are in date order, so the first is the oldest
+        pending_sales = processor.pending_sales
+        if (writer.year is not None and item.date.year > writer.year
+                and (not pending_sales or pending_sales[0].date.year > writer.year)):
+            writer.finish()
+
+    for lot in processor.flush():
+        writer.write_closed_lot(lot)
+    writer.finish()
+
+
+def run_daemon(args):
+    """Processes the input files, then runs a daemon.Daemon until stopped."""
+    after_date = None
+    if args.resume:
+        processor, after_date = snapshot.load(args.resume, args.wash_sales, lot_selection=args.lot_selection)
+    else:
+        processor = logic.IncrementalProcessor(args.wash_sales, lot_selection=args.lot_selection)
+    # Closed lots are reported by the requests that close them, not kept
+    processor.keep_closed_lots = False
+
+    writer = writers.JsonlWriter(None, args.decimal_places, args.shares_decimal_places, False)
+    server = daemon.Daemon(processor, writer, args.checkpoint, args.checkpoint_every)
+    server.last_date = after_date
+
+    if args.filenames:
+        # Keep diagnostics out of the responses
+        with contextlib.redirect_stdout(sys.stderr):
+            for item in loader.stream_transactions(
+                    args.filenames, after_date=after_date, start_index=processor.next_index):
+                processor.add(item)
+                server.last_date = item.date
+
+    # Stop cleanly, saving the checkpoint, when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        if args.socket:
+            daemon.serve_socket(server, args.socket)
+        else:
+            daemon.serve_stdio(server)
+    finally:
+        if args.checkpoint:
+            server.save_checkpoint()
 
 
 if __name__ == "__main__":
@@ -1,18 +1,21 @@
 """Configures the argparse we use."""
 import argparse
+import datetime as dt
 
+import selection
 from __version__ import __version__
 
 
 def get_parser():
     """Returns an argparser."""
     parser = argparse.ArgumentParser(
-        usage="%(prog)s [<options>] [--] <input file>",
+        usage="%(prog)s [<options>] [--] <input file>...\n       %(prog)s --daemon [<options>] [--] [<input file>...]",
         description="Capital gains calculator",
     )
 
+    # Files or directories of files, one per account
     parser.add_argument(
-        "filename", type=str, help=argparse.SUPPRESS, metavar="<input file>"
+        "filenames", type=str, nargs="*", help=argparse.SUPPRESS, metavar="<input file>"
     )
 
     parser.add_argument(
@@ -25,6 +28,62 @@ def get_parser():
         metavar="<n>",
     )
 
+    parser.add_argument(
+        "-l",
+        "--lot-selection",
+        dest="lot_selection",
+        choices=selection.STRATEGIES,
+        default="fifo",
+        help="which lots sales close first: oldest, newest, highest cost basis per share, or "
+        "least tax; named sales always close lots with their name (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--identical",
+        dest="identical",
+        type=lambda value: value.split(","),
+        action="append",
+        default=[],
+        help="treat the comma-separated tickers %(metavar)s as substantially identical, so wash "
+        "sales match across them; can be repeated",
+        metavar="<tickers>",
+    )
+    parser.add_argument(
+        "--option-wash-sales",
+        dest="option_wash_sales",
+        action="store_true",
+        help="match wash sales between stocks and options on them",
+    )
+    parser.add_argument(
+        "-a",
+        "--arithmetic",
+        dest="arithmetic",
+        choices=("decimal", "fixed", "verify"),
+        default="decimal",
+        help="arithmetic to process sales with: decimal, scaled-integer fixed point, "
+        "or both, reporting differences (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        type=str,
+        help="cache results per symbol in %(metavar)s, and only process symbols whose transactions changed",
+        metavar="<dir>",
+    )
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        type=int,
+        default=100,
+        help="evict least recently used results when the cache exceeds %(metavar)s MB (default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "--parsed-cache",
+        dest="parsed_cache",
+        type=str,
+        help="keep input files parsed in %(metavar)s, and only parse them again when they change",
+        metavar="<dir>",
+    )
     parser.add_argument(
         "-d",
         "--decimal-places",
@@ -44,9 +103,126 @@ def get_parser():
         metavar="<n>",
     )
     parser.add_argument(
-        "-t", "--totals", action="store_true", help="output totals")
+        "-f",
+        "--format",
+        dest="format",
+        choices=("text", "csv", "jsonl", "form8949"),
+        default="text",
+        help="output format: aligned text tables, csv or JSON Lines rows per lot, "
+        "or csv rows for IRS form 8949 (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        type=str,
+        help="write output to %(metavar)s instead of stdout",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "--output-per-year",
+        dest="output_per_year",
+        type=str,
+        help="write the closed lots of each year to %(metavar)s, with {year} replaced by the year, "
+        "processing the history once; implies --stream",
+        metavar="<pattern>",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="process symbols in parallel with %(metavar)s worker processes; not with --stream "
+        "(default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream transactions from the input files instead of loading them in memory",
+    )
+    parser.add_argument(
+        "--lot-store",
+        dest="lot_store",
+        type=str,
+        help="keep lots in the SQLite database %(metavar)s instead of in memory; implies --stream",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "--save-snapshot",
+        dest="save_snapshot",
+        type=str,
+        help="save the open lots as of --snapshot-date to %(metavar)s, to resume from later",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "--snapshot-date",
+        dest="snapshot_date",
+        type=dt.date.fromisoformat,
+        help="date of the snapshot saved by --save-snapshot, e.g. 2023-12-31",
+        metavar="<date>",
+    )
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        type=str,
+        help="resume from a snapshot saved by --save-snapshot, processing only later transactions",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="after the input files, if any, keep running and process transactions sent as JSON "
+        "Lines on stdin or --socket",
+    )
+    parser.add_argument(
+        "--socket",
+        dest="socket",
+        type=str,
+        help="with --daemon, take requests on the Unix socket %(metavar)s instead of stdin",
+        metavar="<path>",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        dest="checkpoint",
+        type=str,
+        help="with --daemon, save snapshots to %(metavar)s on request, on exit and every "
+        "--checkpoint-every transactions",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        dest="checkpoint_every",
+        type=int,
+        default=1000,
+        help="transactions between --checkpoint snapshots, 0 for none (default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="report time spent per stage and counters per symbol on stderr",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        type=str,
+        help="profile the run with cProfile and write the stats to %(metavar)s "
+        "(worker processes are not profiled)",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "--trace",
+        dest="trace",
+        type=str,
+        help="write a JSON Lines trace of how lots are opened, split, closed and adjusted to %(metavar)s",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "-t", "--totals", action="store_true", help="output totals (text format only)")
     parser.add_argument("-v", "--verbose",
-                        action="store_true", help="verbose output")
+                        action="store_true", help="verbose output, including trace events")
     parser.add_argument(
         "-V", "--version", action="version", version="%(prog)s " + __version__
     )
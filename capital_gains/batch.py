@@ -0,0 +1,391 @@
+"""Processes many portfolios in one invocation, on a pool of worker processes.
+
+Each portfolio is an input file, or a directory of account files, listed in a
+manifest or found in a directory. Its output is written next to it, e.g.
+client.csv -> client.gains.txt, and a summary of every portfolio's totals,
+problems and timing is printed.
+
+Workers live for the whole run, so each imports the calculator once, and its
+parse caches (dates, order types, amounts) carry over from one portfolio to
+the next. With --parsed-cache, parsed files are also shared between workers
+and runs; see columnar.py.
+
+    python capital_gains/batch.py -j 8 clients/
+    python capital_gains/batch.py --manifest portfolios.txt --summary summary.csv
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import decimal
+import io
+import os
+import sys
+import time
+from dataclasses import dataclass
+
+import columnar
+import formatter
+import loader
+import logic
+import selection
+import writers
+
+# Output file extension per format
+EXTENSIONS = {
+    "text": ".txt",
+    "csv": ".csv",
+    "jsonl": ".jsonl",
+    "form8949": ".8949.csv",
+}
+
+# What processing prints for a sale it can't match to open lots
+NO_CLOSABLE_LOTS = "No closable lots"
+
+
+@dataclass
+class PortfolioResult(object):
+    """Totals and problems of one portfolio."""
+
+    input: str
+    output: str
+    seconds: float = 0.0
+    closed_lots: int = 0
+    open_lots: int = 0
+    proceeds: decimal.Decimal = decimal.Decimal(0)
+    cost_basis: decimal.Decimal = decimal.Decimal(0)
+    wash_sale: decimal.Decimal = decimal.Decimal(0)
+    gain: decimal.Decimal = decimal.Decimal(0)
+    # Sales (or parts of them) with no open lot to close
+    unmatched_sales: int = 0
+    # Why the portfolio couldn't be processed, if it couldn't
+    error: str = None
+
+    @property
+    def status(self):
+        if self.error is not None:
+            return "error"
+        if self.unmatched_sales:
+            return f"{self.unmatched_sales} unmatched sales"
+        return "ok"
+
+
+@dataclass(frozen=True)
+class Options(object):
+    """The options every portfolio is processed with."""
+
+    format: str = "text"
+    suffix: str = ".gains"
+    decimal_places: int = 0
+    shares_decimal_places: int = 0
+    totals: bool = False
+    fiscal_year: int = 0
+    wash_sales: bool = True
+    lot_selection: str = "fifo"
+    parsed_cache: str = None
+
+
+def output_filename(input_name, options):
+    """Returns the output file of a portfolio, next to its input."""
+    base = input_name.rstrip(os.sep)
+    if not os.path.isdir(base):
+        base = os.path.splitext(base)[0]
+    return base + options.suffix + EXTENSIONS[options.format]
+
+
+def find_portfolios(directory, options):
+    """Returns the portfolios in a directory: its csv files and subdirectories, in name order.
+
+    Outputs of earlier runs are skipped.
+    """
+    outputs = tuple(options.suffix + extension for extension in EXTENSIONS.values())
+    portfolios = []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if entry.is_dir() or (entry.name.endswith(".csv") and not entry.name.endswith(outputs)):
+            portfolios.append(entry.path)
+    return portfolios
+
+
+def read_manifest(filename):
+    """Returns the portfolios listed in a manifest, one per line.
+
+    Blank lines and lines starting with # are skipped; relative paths are
+    relative to the manifest.
+    """
+    directory = os.path.dirname(filename)
+    with open(filename, "r", encoding="utf-8") as in_file:
+        return [
+            os.path.join(directory, line.strip())
+            for line in in_file
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+
+def process_portfolio(input_name, options):
+    """Processes one portfolio, writes its output and returns its PortfolioResult."""
+    result = PortfolioResult(input_name, output_filename(input_name, options))
+    start = time.perf_counter()
+    try:
+        parsed_cache = columnar.ParsedCache(options.parsed_cache) if options.parsed_cache else None
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            open_lots, sales = loader.load_transactions(input_name, options.fiscal_year, parsed_cache)
+            closed_lots = logic.process_all_sales(
+                open_lots, sales, options.wash_sales, lot_selection=options.lot_selection)
+
+        write_output(result.output, closed_lots, open_lots, options)
+    except Exception as e:
+        # Any failure is the portfolio's own; the others still get processed
+        result.error = f"{type(e).__name__}: {e}"
+    else:
+        result.unmatched_sales = sum(
+            line.startswith(NO_CLOSABLE_LOTS) for line in output.getvalue().splitlines())
+        result.open_lots = sum(len(lots) for lots in open_lots.values())
+        for lots in closed_lots.values():
+            for lot in lots:
+                result.closed_lots += 1
+                result.proceeds += lot.proceeds
+                result.cost_basis += lot.cost_basis
+                result.wash_sale += lot.wash_sale
+                result.gain += lot.gain
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def write_output(filename, closed_lots, open_lots, options):
+    """Writes the results of a portfolio to `filename`, replacing it only once complete."""
+    directory, basename = os.path.split(filename)
+    temp_filename = os.path.join(directory, f".{basename}.{os.getpid()}.tmp")
+    try:
+        with open(temp_filename, "w", encoding="utf-8", newline="") as out_file:
+            writer = writers.WRITERS[options.format](
+                out_file, options.decimal_places, options.shares_decimal_places, options.totals)
+            writer.write_results(closed_lots, open_lots)
+            writer.close()
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+def process_portfolios(input_names, options, jobs=1):
+    """Yields the PortfolioResult of each portfolio, in order, processing them on `jobs` workers."""
+    if jobs <= 1:
+        for input_name in input_names:
+            yield process_portfolio(input_name, options)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = [
+            executor.submit(process_portfolio, input_name, options) for input_name in input_names]
+        for input_name, future in zip(input_names, futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # e.g. the worker died, or the result couldn't be sent back
+                yield PortfolioResult(
+                    input_name, output_filename(input_name, options),
+                    error=f"{type(e).__name__}: {e}")
+
+
+def format_summary(results, decimal_places):
+    """Returns a table of results, one row per portfolio, and a total row."""
+    def money(value):
+        return formatter.format_decimal(value, decimal_places)
+
+    header = ["portfolio", "closed lots", "open lots", "proceeds", "cost basis", "wash sale",
+              "gain", "seconds", "status"]
+    table = [header]
+    total = PortfolioResult("total", None)
+    for result in results:
+        table.append(_summary_row(result, money))
+        for attribute in ("seconds", "closed_lots", "open_lots", "proceeds", "cost_basis",
+                          "wash_sale", "gain", "unmatched_sales"):
+            setattr(total, attribute, getattr(total, attribute) + getattr(result, attribute))
+
+    failed = sum(result.status != "ok" for result in results)
+    row = _summary_row(total, money)
+    row[-1] = f"{failed} of {len(results)} failed" if failed else "ok"
+    table.append(row)
+    return formatter.format_table(table)
+
+
+def write_summary(filename, results, decimal_places):
+    """Writes a csv file with one row per portfolio."""
+    with open(filename, "w", encoding="utf-8", newline="") as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(["portfolio", "output", "closed lots", "open lots", "proceeds",
+                         "cost basis", "wash sale", "gain", "unmatched sales", "seconds", "error"])
+        for result in results:
+            writer.writerow([
+                result.input, result.output, result.closed_lots, result.open_lots,
+                *(formatter.format_decimal(value, decimal_places) for value in (
+                    result.proceeds, result.cost_basis, result.wash_sale, result.gain)),
+                result.unmatched_sales, f"{result.seconds:.3f}", result.error or ""])
+
+
+def _summary_row(result, money):
+    return [
+        result.input,
+        str(result.closed_lots),
+        str(result.open_lots),
+        money(result.proceeds),
+        money(result.cost_basis),
+        money(result.wash_sale),
+        money(result.gain),
+        f"{result.seconds:.2f}",
+        result.status,
+    ]
+
+
+def get_parser():
+    """Returns an argparser."""
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [<options>] (--manifest <file> | <dir>...)",
+        description="Calculates capital gains for many portfolios, writing each output next to "
+        "its input",
+    )
+    parser.add_argument(
+        "directories", type=str, nargs="*", help=argparse.SUPPRESS, metavar="<dir>"
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        dest="manifest",
+        type=str,
+        help="process the portfolios listed in %(metavar)s, one input file or directory per line",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "--suffix",
+        dest="suffix",
+        type=str,
+        default=".gains",
+        help="add %(metavar)s to input names to name outputs (default: %(default)s)",
+        metavar="<suffix>",
+    )
+    parser.add_argument(
+        "--summary",
+        dest="summary",
+        type=str,
+        help="also write the summary as csv to %(metavar)s",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        dest="format",
+        choices=tuple(EXTENSIONS),
+        default="text",
+        help="output format; see capital-gains --help (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-y",
+        "--fiscal-year",
+        dest="fiscal_year",
+        type=int,
+        default=0,
+        help="fiscal year to process, if specified transactions from other years will be ignored.",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "-l",
+        "--lot-selection",
+        dest="lot_selection",
+        choices=selection.STRATEGIES,
+        default="fifo",
+        help="which lots sales close first (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--parsed-cache",
+        dest="parsed_cache",
+        type=str,
+        help="keep input files parsed in %(metavar)s, shared by all workers",
+        metavar="<dir>",
+    )
+    parser.add_argument(
+        "-d",
+        "--decimal-places",
+        dest="decimal_places",
+        type=int,
+        default=0,
+        help="round $ to %(metavar)s decimal places (default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "-s",
+        "--shares-decimal-places",
+        dest="shares_decimal_places",
+        type=int,
+        default=0,
+        help="round shares to %(metavar)s decimal places (default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="process portfolios in parallel with %(metavar)s worker processes (default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "-t", "--totals", action="store_true", help="output totals (text format only)")
+    parser.add_argument(
+        "-w",
+        "--wash-sales",
+        dest="wash_sales",
+        action=argparse.BooleanOptionalAction,
+        help="identify wash sales and adjust cost basis",
+        default=True,
+    )
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if args.totals and args.format != "text":
+        parser.error("--totals is only supported with --format text")
+
+    options = Options(
+        format=args.format,
+        suffix=args.suffix,
+        decimal_places=args.decimal_places,
+        shares_decimal_places=args.shares_decimal_places,
+        totals=args.totals,
+        fiscal_year=args.fiscal_year,
+        wash_sales=args.wash_sales,
+        lot_selection=args.lot_selection,
+        parsed_cache=args.parsed_cache,
+    )
+
+    input_names = read_manifest(args.manifest) if args.manifest else []
+    for directory in args.directories:
+        input_names += find_portfolios(directory, options)
+    if args.summary:
+        # Don't process the summary of an earlier run
+        input_names = [
+            name for name in input_names
+            if os.path.abspath(name) != os.path.abspath(args.summary)]
+    if not input_names:
+        parser.error("no portfolios: give a --manifest or directories")
+
+    results = []
+    for result in process_portfolios(input_names, options, max(1, args.jobs)):
+        results.append(result)
+        if result.error is not None:
+            print(f"{result.input}: {result.error}", file=sys.stderr)
+
+    print(format_summary(results, args.decimal_places))
+    if args.summary:
+        write_summary(args.summary, results, args.decimal_places)
+
+    if any(result.status != "ok" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""On-disk cache of the results of processing each symbol.
+
+Entries are keyed by a hash of the symbol's transactions and of the options
+that affect results, so a symbol is only processed again when its own
+transactions change. Transaction indices are global, so they change when rows
+are added for any symbol; entries store each index as its position among the
+symbol's transactions instead, and are mapped back to the current indices.
+"""
+
+import collections
+import dataclasses
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+import logic
+from lotbook import LotBook
+
+CACHE_VERSION = 5
+
+# Default size cap, in bytes
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+
+class ResultCache(object):
+    """Directory of cached results, evicted least recently used first."""
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, symbol, lots, sales, wash_sales, fiscal_year, lot_selection="fifo"):
+        """Returns the key for a symbol's lots and sales and the given options."""
+        digest = hashlib.sha256()
+        digest.update(repr((CACHE_VERSION, symbol, wash_sales, fiscal_year, lot_selection)).encode())
+
+        transactions = sorted(
+            [("lot", lot.purchase, lot.adjustment) for lot in lots]
+            + [("sale", sale, None) for sale in sales],
+            key=lambda item: item[1].index)
+        for kind, transaction, adjustment in transactions:
+            digest.update(repr((
+                kind, transaction.date, transaction.is_short_option, transaction.name, transaction.account,
+                str(transaction.quantity), str(transaction.price), str(transaction.fee),
+                None if adjustment is None else str(adjustment))).encode())
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the entry for a key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as in_file:
+                entry = pickle.load(in_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logging.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+        return entry
+
+    def put(self, key, entry):
+        """Stores an entry; written atomically so readers never see a partial one."""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as out_file:
+            pickle.dump(entry, out_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self._path(key))
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits its size cap."""
+        entries = []
+        for dir_entry in os.scandir(self.directory):
+            if dir_entry.name.endswith(".pickle"):
+                stat = dir_entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            os.remove(path)
+            size -= entry_size
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pickle")
+
+
+def process_all_sales(cache, open_lots, sales, wash_sales, fiscal_year, jobs=1, lot_selection="fifo"):
+    """Like logic.process_all_sales, but reuses the results of unchanged symbols."""
+    keys = {}
+    positions = {}
+    cached = {}
+    for symbol, symbol_sales in sales.items():
+        lots = open_lots[symbol]
+        keys[symbol] = cache.key(symbol, lots, symbol_sales, wash_sales, fiscal_year, lot_selection)
+        positions[symbol] = sorted(
+            [lot.index for lot in lots] + [sale.index for sale in symbol_sales])
+
+        entry = cache.get(keys[symbol])
+        if entry is not None:
+            cached[symbol] = entry
+
+    logging.debug(f"Result cache: {len(cached)} of {len(sales)} symbols cached")
+
+    # Keep the order of `sales`, like logic.process_all_sales
+    closed_lots = collections.defaultdict(list)
+    for symbol in sales:
+        closed_lots[symbol] = []
+
+    misses = {symbol: sales[symbol] for symbol in sales if symbol not in cached}
+    for symbol, symbol_closed_lots, output in logic.process_symbols(
+            open_lots, misses, wash_sales, jobs, lot_selection):
+        closed_lots[symbol] = symbol_closed_lots
+        print(output, end="")
+
+        # Output mentions transaction indices, which may differ next time, so
+        # don't cache symbols that printed anything (e.g. no closable lots)
+        if not output:
+            to_position = {index: position for position,
+                           index in enumerate(positions[symbol])}
+            cache.put(keys[symbol], (
+                [_reindex_lot(lot, to_position) for lot in symbol_closed_lots],
+                [_reindex_lot(lot, to_position) for lot in open_lots[symbol]],
+            ))
+
+    for symbol, (cached_closed_lots, cached_open_lots) in cached.items():
+        to_index = dict(enumerate(positions[symbol]))
+        closed_lots[symbol] = [
+            _reindex_lot(lot, to_index) for lot in cached_closed_lots]
+        open_lots[symbol] = LotBook(
+            _reindex_lot(lot, to_index) for lot in cached_open_lots)
+
+    cache.evict()
+
+    return closed_lots
+
+
+def _reindex_lot(lot, mapping):
+    """Returns a copy of a lot with its transaction indices mapped through `mapping`."""
+    return dataclasses.replace(
+        lot,
+        purchase=dataclasses.replace(lot.purchase, index=mapping[lot.purchase.index]),
+        sale=None if lot.sale is None else dataclasses.replace(
+            lot.sale, index=mapping[lot.sale.index]),
+    )
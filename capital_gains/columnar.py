@@ -0,0 +1,234 @@
+"""Binary columnar cache of parsed transactions.
+
+Parsing a csv file (dates, Decimals, the option multiplier) and sorting it is
+done once; the sorted rows are stored in typed columns and memory-mapped on
+later runs. A cache file is rebuilt when its source changes: if the source's
+modification time or size differ from when it was cached, its contents are
+hashed, and only a different hash means a rebuild.
+
+File layout, little-endian:
+
+    header    magic, row count, trailer length, source mtime (ns), size, sha256
+    columns   each padded to 8 bytes:
+              dates          int32  date ordinals
+              order types    uint8  index in the trailer's order types
+              symbols        int32  index in the trailer's symbols
+              quantities     int64  coefficient, and int8 exponent
+              prices         int64  coefficient, and int8 exponent
+              fees           int64  coefficient, and int8 exponent
+    trailer   JSON with the interned symbols and the order type values
+
+Amounts are Decimals stored as coefficient * 10**exponent, so they round-trip
+exactly, trailing zeros included. Files with an amount that doesn't fit aren't
+cached. Columns only hold what processing uses: the cusip, description and net
+amount of cached rows are None.
+"""
+
+import array
+import datetime as dt
+import decimal
+import hashlib
+import itertools
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+import loader
+
+MAGIC = b"CGCOLS01"
+
+_HEADER = struct.Struct("<8sIIqq32s")
+
+# (typecode, size) of each column, in file order
+_COLUMNS = (
+    ("i", 4),  # dates
+    ("B", 1),  # order types
+    ("i", 4),  # symbols
+    ("q", 8), ("b", 1),  # quantities
+    ("q", 8), ("b", 1),  # prices
+    ("q", 8), ("b", 1),  # fees
+)
+
+_INT64_RANGE = range(-2**63, 2**63)
+_INT8_RANGE = range(-2**7, 2**7)
+
+
+class _Unsupported(Exception):
+    """An amount can't be stored in the columns."""
+
+
+class ParsedCache(object):
+    """Directory of cached parsed files, one per source file."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def rows(self, filename: str, parse):
+        """Returns the parsed and sorted rows of a file.
+
+        They are read from the cache if it's up to date, otherwise `parse`d
+        from the file and cached.
+        """
+        path = self._path(filename)
+        stat = os.stat(filename)
+
+        header = _read_header(path)
+        if header is not None:
+            _, _, _, mtime_ns, size, digest = header
+            if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+                if _hash(filename) == digest:
+                    # Touched but unchanged; remember the new mtime
+                    _write_header(path, header, stat)
+                else:
+                    header = None
+
+        if header is not None:
+            try:
+                return _read(path, loader.account_name(filename))
+            except (OSError, ValueError, KeyError, struct.error) as e:
+                logging.warning(f"Ignoring unreadable parsed cache {path}: {e}")
+
+        rows = parse(filename)
+        try:
+            _write(path, rows, stat, _hash(filename))
+        except _Unsupported as e:
+            logging.debug(f"Not caching {filename}: {e}")
+        return rows
+
+    def _path(self, filename):
+        key = hashlib.sha256(os.path.abspath(filename).encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{key}.cols")
+
+
+def _hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as in_file:
+        while chunk := in_file.read(1 << 20):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _read_header(path):
+    """Returns the header of a cache file, or None if missing or invalid."""
+    try:
+        with open(path, "rb") as in_file:
+            header = _HEADER.unpack(in_file.read(_HEADER.size))
+    except (OSError, struct.error):
+        return None
+    if header[0] != MAGIC:
+        return None
+    return header
+
+
+def _write_header(path, header, stat):
+    with open(path, "r+b") as out_file:
+        out_file.write(_HEADER.pack(
+            MAGIC, header[1], header[2], stat.st_mtime_ns, stat.st_size, header[5]))
+
+
+def _column_offsets(count):
+    """Returns the offset of each column and of the trailer."""
+    offsets = []
+    offset = _HEADER.size
+    for _, size in _COLUMNS:
+        offset += -offset % 8
+        offsets.append(offset)
+        offset += size * count
+    return offsets, offset
+
+
+def _split_decimal(value):
+    """Returns a Decimal as (coefficient, exponent)."""
+    exponent = value.as_tuple().exponent
+    if not isinstance(exponent, int) or exponent not in _INT8_RANGE:
+        raise _Unsupported(f"amount {value}")
+    coefficient = int(value.scaleb(-exponent))
+    if coefficient not in _INT64_RANGE:
+        raise _Unsupported(f"amount {value}")
+    return coefficient, exponent
+
+
+def _join_decimal(coefficient, exponent):
+    return decimal.Decimal(coefficient).scaleb(exponent)
+
+
+def _write(path, rows, stat, digest):
+    """Writes the columns of parsed rows; atomically, so readers never see a partial file."""
+    symbols = {}
+    order_types = list(loader.OrderType)
+    order_type_codes = {order_type: code for code, order_type in enumerate(order_types)}
+
+    columns = [array.array(typecode) for typecode, _ in _COLUMNS]
+    dates, types, symbol_ids, *amounts = columns
+    for date, order_type, symbol, _, _, quantity, price, fee, _, _ in rows:
+        dates.append(date.toordinal())
+        types.append(order_type_codes[order_type])
+        symbol_ids.append(symbols.setdefault(symbol, len(symbols)))
+        for i, value in enumerate((quantity, price, fee)):
+            coefficient, exponent = _split_decimal(value)
+            amounts[2 * i].append(coefficient)
+            amounts[2 * i + 1].append(exponent)
+
+    trailer = json.dumps({
+        "symbols": list(symbols),
+        "order_types": [order_type.value for order_type in order_types],
+    }).encode()
+
+    offsets, _ = _column_offsets(len(rows))
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as out_file:
+        out_file.write(_HEADER.pack(
+            MAGIC, len(rows), len(trailer), stat.st_mtime_ns, stat.st_size, digest))
+        for column, offset in zip(columns, offsets):
+            out_file.write(b"\0" * (offset - out_file.tell()))
+            out_file.write(column.tobytes())
+        out_file.write(trailer)
+    os.replace(temp_path, path)
+
+
+def _read(path, account):
+    """Returns the parsed rows stored in a cache file."""
+    with open(path, "rb") as in_file, \
+            mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        _, count, trailer_length, _, _, _ = _HEADER.unpack_from(mapped)
+        offsets, trailer_offset = _column_offsets(count)
+
+        trailer = json.loads(mapped[trailer_offset:trailer_offset + trailer_length])
+        symbols = trailer["symbols"]
+        order_types = [loader.OrderType(value) for value in trailer["order_types"]]
+
+        view = memoryview(mapped)
+        try:
+            columns = [
+                view[offset:offset + size * count].cast(typecode).tolist()
+                for (typecode, size), offset in zip(_COLUMNS, offsets)
+            ]
+        finally:
+            view.release()
+
+    dates, order_type_codes, symbol_ids, *amounts = columns
+
+    # Decode each distinct value once, then map columns with C loops
+    def decode(values, decode_value):
+        decoded = {value: decode_value(value) for value in set(values)}
+        return map(decoded.__getitem__, values)
+
+    def decode_amounts(coefficients, exponents):
+        return decode(list(zip(coefficients, exponents)), lambda pair: _join_decimal(*pair))
+
+    return list(map(list, zip(
+        decode(dates, dt.date.fromordinal),
+        map(order_types.__getitem__, order_type_codes),
+        map(symbols.__getitem__, symbol_ids),
+        itertools.repeat(None),
+        itertools.repeat(None),
+        decode_amounts(amounts[0], amounts[1]),
+        decode_amounts(amounts[2], amounts[3]),
+        decode_amounts(amounts[4], amounts[5]),
+        itertools.repeat(None),
+        itertools.repeat(account),
+    )))
@@ -1,7 +1,18 @@
-"""Converts a raw transactions file to a format like the one from the ETrade tax center. """
+"""Converts raw transactions files to a format like the one from the ETrade tax center.
 
+Files are converted row by row, in parallel with --jobs. The loader also
+converts raw transactions files as it reads them (see read_rows), so they can
+be given to capital-gains directly.
+"""
+
+import argparse
+import concurrent.futures
 import csv
 import datetime as dt
+import decimal
+import glob
+import os
+import sys
 
 MAP_TRANSACTION_TYPE = {
     "option expiration": "option expire",
@@ -21,40 +32,141 @@ OUT_HEADER = ["Trade Date", "Order Type", "Security", "Cusip",
               "Transaction Description", "Quantity", "Executed Price", "Commission", "Net Amount"]
 
 
-def main():
-    in_filename = "transactions-20220101-20231004.csv"
-    out_filename = "orders-20220101-20231004.csv"
-
-    with open(in_filename, "r", encoding="utf-8") as in_file:
-        reader = csv.DictReader(in_file, delimiter=",")
-
-        next(reader)
-
-        new_file = []
-        for line in reader:
-            if line["TransactionType"].lower() in IGNORE_TRANS:
-                continue
-
-            in_date = dt.datetime.strptime(line["TransactionDate"], "%m/%d/%y")
-            out_date = in_date.strftime("%m/%d/%Y")
-            new_line = (out_date,
-                        MAP_TRANSACTION_TYPE[line["TransactionType"].lower()],
-                        line["Symbol"], "",
-                        line["Description"],
-                        abs(float(line["Quantity"])),
-                        line["Price"],
-                        line["Commission"],
-                        abs(float(line["Amount"]))
-                        )
-            new_file.append(new_line)
-
-    new_file.sort()
-
-    # write to the output file
-    with open(out_filename, 'w', newline='', encoding="utf-8") as csvfile:
-        writer = csv.writer(csvfile)
+def is_raw_header(header: list[str]):
+    """Returns whether a csv header is the one of a raw transactions file."""
+    return "TransactionDate" in header and "TransactionType" in header
+
+
+def convert_row(line: dict):
+    """Returns a raw transaction (a csv.DictReader row) as an output row, or None if ignored."""
+    transaction_type = line["TransactionType"].lower()
+    if transaction_type in IGNORE_TRANS:
+        return None
+    if transaction_type not in MAP_TRANSACTION_TYPE:
+        raise ValueError(f"unknown transaction type {line['TransactionType']!r}")
+
+    in_date = dt.datetime.strptime(line["TransactionDate"], "%m/%d/%y")
+    out_date = in_date.strftime("%m/%d/%Y")
+    return [out_date,
+            MAP_TRANSACTION_TYPE[transaction_type],
+            line["Symbol"], "",
+            line["Description"],
+            # Decimal, unlike float, keeps every digit
+            str(abs(decimal.Decimal(line["Quantity"]))),
+            line["Price"],
+            line["Commission"],
+            str(abs(decimal.Decimal(line["Amount"]))),
+            ]
+
+
+def read_rows(in_file):
+    """Yields the output rows of an open raw transactions file, without header."""
+    reader = csv.DictReader(in_file, delimiter=",")
+
+    next(reader)
+
+    for line in reader:
+        row = convert_row(line)
+        if row is not None:
+            yield row
+
+
+def output_filename(in_filename: str, out_dir: str = None):
+    """Returns where to write the conversion of a file.
+
+    transactions-<dates>.csv becomes orders-<dates>.csv, other files get an
+    -orders suffix. The output goes to `out_dir`, or next to the input.
+    """
+    directory, basename = os.path.split(in_filename)
+    stem, extension = os.path.splitext(basename)
+    if "transactions" in stem:
+        stem = stem.replace("transactions", "orders")
+    else:
+        stem = f"{stem}-orders"
+    return os.path.join(directory if out_dir is None else out_dir, stem + (extension or ".csv"))
+
+
+def convert_file(in_filename: str, out_filename: str):
+    """Converts a file, one row at a time, and returns the number of rows written.
+
+    Rows keep the order of the input; the loader sorts them.
+    """
+    count = 0
+    with open(in_filename, "r", encoding="utf-8", newline="") as in_file, \
+            open(out_filename, "w", encoding="utf-8", newline="") as out_file:
+        writer = csv.writer(out_file)
         writer.writerow(OUT_HEADER)
-        writer.writerows(new_file)
+        for row in read_rows(in_file):
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def input_files(patterns: list[str]):
+    """Returns the files matching file names or glob patterns, without duplicates."""
+    filenames = {}
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        filenames.update(dict.fromkeys(matches))
+    return list(filenames)
+
+
+def get_parser():
+    """Returns an argparser."""
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [<options>] [--] <input file or glob>...",
+        description="Converts raw transactions files to the format of the ETrade tax center",
+    )
+    parser.add_argument(
+        "patterns", type=str, nargs="+", help=argparse.SUPPRESS, metavar="<input file or glob>"
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        dest="output_dir",
+        type=str,
+        help="write converted files to %(metavar)s instead of next to their input",
+        metavar="<dir>",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="convert files in parallel with %(metavar)s worker processes (default: %(default)s)",
+        metavar="<n>",
+    )
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    in_filenames = input_files(args.patterns)
+    if not in_filenames:
+        parser.error("no input files")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    with concurrent.futures.ProcessPoolExecutor(max(1, args.jobs)) as executor:
+        futures = {
+            executor.submit(
+                convert_file, in_filename, output_filename(in_filename, args.output_dir)): in_filename
+            for in_filename in in_filenames
+        }
+        failed = False
+        for future in concurrent.futures.as_completed(futures):
+            in_filename = futures[future]
+            try:
+                print(f"{in_filename}: {future.result()} rows")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"{in_filename}: {type(e).__name__}: {e}", file=sys.stderr)
+                failed = True
+
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,255 @@
+"""Long-running mode that processes transactions as they are made.
+
+Open lots are kept in memory in an IncrementalProcessor, so each transaction
+is processed on its own instead of replaying the whole history. Requests and
+responses are JSON objects, one per line, read from stdin and written to stdout
+or exchanged over a Unix socket. Every request has an "op":
+
+    add          adds a transaction, given as "date" (YYYY-MM-DD), "order_type"
+                 (as in ETrade exports), "symbol", "quantity", "price" and
+                 optionally "fee" and "account". A sale only closes lots of
+                 its "account", that of the input file they were bought in.
+                 "quantity" and "price" must be positive and "fee" must not
+                 be negative.
+                 Transactions must be added in processing order. Returns the lots closed and the wash sale
+                 adjustments made by the sales this let be processed.
+    preview      returns the lots that the pending sales would close if no more
+                 transactions came, without processing them.
+    open_lots    returns the open lots, of "symbol" if given.
+    finish       processes the pending sales, like the end of a file would, and
+                 returns the lots they closed.
+    checkpoint   saves a snapshot, to "filename" if given.
+
+Sales stay pending until a transaction more than WASHSALE_PERIOD days later
+comes in, since a purchase until then could make them wash sales; "preview"
+shows the realized gains they would have right now.
+
+Closed lots are final, and are only reported in the response of the request
+that closed them, not kept, so memory doesn't grow with the history.
+
+Every response has "ok"; failed requests have an "error" instead of results.
+"""
+
+import contextlib
+import copy
+import datetime as dt
+import decimal
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+
+import loader
+import logic
+import lottrace
+import snapshot
+from const import SHARES_PER_CONTRACT
+from model import Lot
+
+
+class Daemon(object):
+    """Handles requests on an IncrementalProcessor.
+
+    The processor shouldn't keep closed lots, which are only reported.
+
+    `writer` is a writers.JsonlWriter, used to make lot records. If
+    `checkpoint` is given, a snapshot is saved there every `checkpoint_every`
+    transactions (if not 0) and on request.
+    """
+
+    def __init__(self, processor, writer, checkpoint=None, checkpoint_every=0):
+        self.processor = processor
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.last_date = None
+        self._added = 0
+        # Socket connections are handled in threads, but one request at a time
+        self._lock = threading.Lock()
+
+    def handle_line(self, line):
+        """Handles a request line and returns the response line."""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            with self._lock, contextlib.redirect_stdout(sys.stderr):
+                response = self.handle(request)
+        except (ValueError, KeyError, TypeError, decimal.InvalidOperation, OSError) as e:
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        return json.dumps(response)
+
+    def handle(self, request):
+        """Handles a request and returns the response."""
+        op = request.get("op")
+        handler = getattr(self, f"_handle_{op}", None) if isinstance(op, str) else None
+        if handler is None:
+            raise ValueError(f"unknown op {op!r}")
+        return {"ok": True, **handler(request)}
+
+    def save_checkpoint(self, filename=None):
+        """Saves a snapshot to `filename`, or to the checkpoint file."""
+        filename = filename or self.checkpoint
+        if not filename:
+            raise ValueError("no checkpoint file")
+        snapshot.save(filename, self.processor, self.last_date or dt.date.min)
+        return filename
+
+    def _handle_add(self, request):
+        row = _row_from_json(request)
+        if self.last_date is not None and row[0] < self.last_date:
+            raise ValueError(
+                f"transactions must be added in date order, but {row[0]} is before {self.last_date}")
+
+        item = next(loader.make_transactions([row], start_index=self.processor.next_index), None)
+        if item is None:
+            # Not a transaction that opens or closes lots
+            return {"added": None, "closed_lots": [], "adjustments": [],
+                    "pending_sales": len(self.processor.pending_sales)}
+
+        # Record the events of this transaction, and pass them on to any trace
+        previous_trace = lottrace.current
+        trace = lottrace.enable()
+        try:
+            closed_lots = self.processor.add(item)
+        finally:
+            lottrace.current = previous_trace
+            if previous_trace is not None:
+                previous_trace.extend(trace.events)
+
+        self.last_date = item.date
+        self._added += 1
+        if self.checkpoint and self.checkpoint_every and self._added % self.checkpoint_every == 0:
+            self.save_checkpoint()
+
+        return {
+            "added": {"type": "lot" if isinstance(item, Lot) else "sale", "index": item.index},
+            "closed_lots": [self.writer.closed_lot_record(lot) for lot in closed_lots],
+            "adjustments": [
+                self._adjustment_record(event) for event in trace.events
+                if event.event == lottrace.WASH_SALE_ADJUSTMENT],
+            "pending_sales": len(self.processor.pending_sales),
+        }
+
+    def _handle_preview(self, request):
+        processor = self.processor
+        preview = logic.IncrementalProcessor(
+            processor.wash_sales, lot_selection=processor.lot_selection)
+        for symbol in {sale.symbol for sale in processor.pending_sales}:
+            if symbol in processor.open_lots:
+                preview.open_lots[symbol] = copy.deepcopy(processor.open_lots[symbol])
+        preview.pending_sales.extend(processor.pending_sales)
+
+        previous_trace = lottrace.disable()
+        try:
+            closed_lots = preview.finish()
+        finally:
+            lottrace.current = previous_trace
+
+        return {"closed_lots": [
+            self.writer.closed_lot_record(lot) for lots in closed_lots.values() for lot in lots]}
+
+    def _handle_open_lots(self, request):
+        return {"open_lots": [
+            self.writer.open_lot_record(lot)
+            for lots in self._by_symbol(self.processor.open_lots, request) for lot in lots]}
+
+    def _handle_finish(self, request):
+        return {"closed_lots": [
+            self.writer.closed_lot_record(lot) for lot in self.processor.flush()]}
+
+    def _handle_checkpoint(self, request):
+        return {"filename": self.save_checkpoint(request.get("filename"))}
+
+    def _adjustment_record(self, event):
+        return {
+            "symbol": event.symbol,
+            "lot": event.lot,
+            "sale": event.sale,
+            "quantity": self.writer.shares(event.quantity),
+            "adjustment": self.writer.money(event.amount),
+        }
+
+    @staticmethod
+    def _by_symbol(lots_by_symbol, request):
+        if "symbol" in request:
+            return [lots_by_symbol.get(request["symbol"], ())]
+        return lots_by_symbol.values()
+
+
+def _row_from_json(request):
+    """Returns a transaction request as a parsed row, like loader.parse_row.
+
+    Raises ValueError or TypeError for a request that isn't a valid
+    transaction, before anything is processed.
+    """
+    order_type = loader.parse_order_type(_string(request, "order_type"))
+    symbol = _string(request, "symbol")
+    account = request.get("account")
+    if account is not None and not isinstance(account, str):
+        raise TypeError(f'"account" must be a string, not {account!r}')
+
+    quantity = _amount(request, "quantity")
+    price = _amount(request, "price")
+    if order_type.is_option:
+        price = price * SHARES_PER_CONTRACT
+    fee = _amount(request, "fee", 0)
+
+    return [dt.date.fromisoformat(_string(request, "date")), order_type, symbol, "", "",
+            quantity, price, fee, None, account]
+
+
+def _string(request, key):
+    value = request[key]
+    if not isinstance(value, str):
+        raise TypeError(f'"{key}" must be a string, not {value!r}')
+    return value
+
+
+def _amount(request, key, default=None):
+    """Returns a number of a request as a Decimal: positive, or non-negative with a default."""
+    value = request[key] if default is None else request.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise TypeError(f'"{key}" must be a number, not {value!r}')
+    # Go through str, so numbers given as JSON floats keep their decimal value
+    amount = decimal.Decimal(str(value))
+    if not amount.is_finite() or amount < 0 or (default is None and amount == 0):
+        kind = "positive" if default is None else "non-negative"
+        raise ValueError(f'"{key}" must be a {kind} number, not {value!r}')
+    return amount
+
+
+def serve_stdio(daemon, in_file=sys.stdin, out_file=sys.stdout):
+    """Answers requests from `in_file` until it ends."""
+    for line in in_file:
+        if line.strip():
+            out_file.write(daemon.handle_line(line) + "\n")
+            out_file.flush()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip():
+                response = self.server.daemon.handle_line(line.decode("utf-8"))
+                self.wfile.write(response.encode("utf-8") + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_socket(daemon, path):
+    """Answers requests from connections to a Unix socket until interrupted."""
+    with _Server(path, _Handler) as server:
+        server.daemon = daemon
+        logging.info(f"Listening on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
@@ -0,0 +1,181 @@
+"""Scaled-integer fixed-point arithmetic, an alternative to decimal.Decimal.
+
+Quantities are stored as integer multiples of 10**-SHARE_PLACES shares and
+prices as multiples of 10**-PRICE_PLACES dollars. All other amounts (fees,
+adjustments, cost basis, proceeds, gains) are multiples of 10**-AMOUNT_PLACES
+dollars, where AMOUNT_PLACES = SHARE_PLACES + PRICE_PLACES, so that
+quantity * price is an amount without any rescaling.
+
+Prorating an amount (splitting fees and adjustments, allocating wash sale
+losses) is done with exact integer arithmetic in model.prorate: the first part
+is rounded half to even to a whole unit and the remainder goes to the second
+part, so splitting never creates or loses a unit.
+"""
+
+import collections
+import contextlib
+import dataclasses
+import decimal
+import io
+import logging
+
+import logic
+from lotbook import LotBook
+from model import Lot, Transaction
+
+SHARE_PLACES = 4
+PRICE_PLACES = 4
+AMOUNT_PLACES = SHARE_PLACES + PRICE_PLACES
+
+# Largest difference between the two engines that `verify` accepts
+VERIFY_TOLERANCE = decimal.Decimal("0.0001")
+
+
+@dataclasses.dataclass(slots=True)
+class FixedLot(Lot):
+    """A Lot whose amounts are scaled integers."""
+
+    adjustment: int = 0
+    sale: Transaction = None
+    wash_sale: int = 0
+
+
+def to_fixed(value, places):
+    """Returns a Decimal as an integer number of 10**-`places` units.
+
+    Values with more decimal places are rounded half to even.
+    """
+    return int(value.scaleb(places).to_integral_value(decimal.ROUND_HALF_EVEN))
+
+
+def to_decimal(value, places):
+    """Returns an integer number of 10**-`places` units as a Decimal."""
+    return decimal.Decimal(value).scaleb(-places)
+
+
+def transaction_to_fixed(transaction):
+    """Returns a copy of a Transaction with scaled integer amounts."""
+    return dataclasses.replace(
+        transaction,
+        quantity=to_fixed(transaction.quantity, SHARE_PLACES),
+        price=to_fixed(transaction.price, PRICE_PLACES),
+        fee=to_fixed(transaction.fee, AMOUNT_PLACES),
+    )
+
+
+def transaction_to_decimal(transaction):
+    """Returns a copy of a scaled integer Transaction with Decimal amounts."""
+    return dataclasses.replace(
+        transaction,
+        quantity=to_decimal(transaction.quantity, SHARE_PLACES),
+        price=to_decimal(transaction.price, PRICE_PLACES),
+        fee=to_decimal(transaction.fee, AMOUNT_PLACES),
+    )
+
+
+def lot_to_fixed(lot):
+    """Returns a FixedLot copy of a Lot."""
+    return FixedLot(
+        purchase=transaction_to_fixed(lot.purchase),
+        adjustment=to_fixed(lot.adjustment, AMOUNT_PLACES),
+        sale=None if lot.sale is None else transaction_to_fixed(lot.sale),
+        wash_sale=to_fixed(lot.wash_sale, AMOUNT_PLACES),
+    )
+
+
+def lot_to_decimal(lot):
+    """Returns a Lot copy of a FixedLot."""
+    return Lot(
+        purchase=transaction_to_decimal(lot.purchase),
+        adjustment=to_decimal(lot.adjustment, AMOUNT_PLACES),
+        sale=None if lot.sale is None else transaction_to_decimal(lot.sale),
+        wash_sale=to_decimal(lot.wash_sale, AMOUNT_PLACES),
+    )
+
+
+def process_all_sales(open_lots, sales, wash_sales, jobs=1, lot_selection="fifo", groups=None):
+    """Like logic.process_all_sales, but in scaled integer arithmetic.
+
+    Takes and returns Decimal lots; only the processing uses integers.
+    """
+    fixed_open_lots = collections.defaultdict(LotBook)
+    for symbol, lots in open_lots.items():
+        fixed_open_lots[symbol] = LotBook(map(lot_to_fixed, lots))
+    fixed_sales = {
+        symbol: [transaction_to_fixed(sale) for sale in symbol_sales]
+        for symbol, symbol_sales in sales.items()
+    }
+
+    fixed_closed_lots = logic.process_all_sales(
+        fixed_open_lots, fixed_sales, wash_sales, jobs, lot_selection, groups)
+
+    for symbol, lots in fixed_open_lots.items():
+        open_lots[symbol] = LotBook(map(lot_to_decimal, lots))
+
+    closed_lots = collections.defaultdict(list)
+    for symbol, lots in fixed_closed_lots.items():
+        closed_lots[symbol] = [lot_to_decimal(lot) for lot in lots]
+
+    return closed_lots
+
+
+def verify(open_lots, sales, wash_sales, jobs=1, lot_selection="fifo", groups=None):
+    """Processes sales with both engines and logs where they disagree.
+
+    Returns the closed lots of the Decimal engine, whose open lots are left in
+    `open_lots` like logic.process_all_sales does, and whether both engines
+    agree within VERIFY_TOLERANCE.
+    """
+    fixed_open_lots = collections.defaultdict(LotBook, open_lots)
+
+    # Anything printed will be printed again by the Decimal run
+    with contextlib.redirect_stdout(io.StringIO()):
+        fixed_closed_lots = process_all_sales(
+            fixed_open_lots, sales, wash_sales, jobs, lot_selection, groups)
+
+    closed_lots = logic.process_all_sales(
+        open_lots, sales, wash_sales, jobs, lot_selection, groups)
+
+    agree = True
+    for kind, lots_by_symbol, fixed_lots_by_symbol in (
+            ("closed", closed_lots, fixed_closed_lots),
+            ("open", open_lots, fixed_open_lots)):
+        for symbol in lots_by_symbol.keys() | fixed_lots_by_symbol.keys():
+            lots = list(lots_by_symbol.get(symbol, ()))
+            fixed_lots = list(fixed_lots_by_symbol.get(symbol, ()))
+
+            if len(lots) != len(fixed_lots):
+                logging.warning(
+                    f"{symbol}: {len(lots)} {kind} lots, but {len(fixed_lots)} with fixed-point arithmetic")
+                agree = False
+                continue
+
+            for lot, fixed_lot in zip(lots, fixed_lots):
+                for attribute in _mismatched_attributes(lot, fixed_lot):
+                    logging.warning(
+                        f"{symbol}: {kind} lot {lot.index} has {attribute} {getattr(lot, attribute)}, "
+                        f"but {getattr(fixed_lot, attribute)} with fixed-point arithmetic")
+                    agree = False
+
+    return closed_lots, agree
+
+
+def _mismatched_attributes(lot, fixed_lot):
+    """Yields the names of the values that differ between two lots."""
+    if lot.index != fixed_lot.index:
+        yield "index"
+    if lot.quantity != fixed_lot.quantity:
+        yield "quantity"
+
+    for attribute in ("adjustment", "wash_sale", "cost_basis", "proceeds", "gain"):
+        # Open short options have no cost basis until they are closed
+        if attribute == "cost_basis" and lot.sale is None and lot.purchase.is_short_option:
+            continue
+
+        value = getattr(lot, attribute)
+        fixed_value = getattr(fixed_lot, attribute)
+        if value is None or fixed_value is None:
+            if value is not fixed_value:
+                yield attribute
+        elif abs(value - fixed_value) > VERIFY_TOLERANCE:
+            yield attribute
@@ -1,37 +1,42 @@
 import decimal
+import functools
 import itertools
+import operator
 
 
 def format(closed_lots, open_lots, decimal_places, shares_decimal_places, totals):
     output = ''
 
     if closed_lots:
-        flattened_closed_lots = list(
-            itertools.chain.from_iterable(closed_lots.values()))
+        # One pass over the lots computes both tables
+        keys = (closed_lot_key, closed_total_key) if totals else (closed_lot_key,)
+        lot_groups, *total_groups = Aggregator(CLOSED_LOT_VALUES, *keys).add_all(
+            itertools.chain.from_iterable(closed_lots.values())).groups()
 
-        table = tabulate_closed_lots(
-            flattened_closed_lots, decimal_places, shares_decimal_places)
+        table = closed_lots_table(
+            lot_groups, decimal_places, shares_decimal_places)
         output += f'# Closed lots\n\n{format_table(table)}'
 
         if totals:
-            table = tabulate_closed_totals(
-                flattened_closed_lots, decimal_places, shares_decimal_places)
+            table = closed_totals_table(
+                total_groups[0], decimal_places, shares_decimal_places)
             output += f'\n\n# Closed totals\n\n{format_table(table)}'
 
     if any(open_lots.values()):
         if closed_lots:
             output += '\n\n'
 
-        flattened_open_lots = list(
-            itertools.chain.from_iterable(open_lots.values()))
+        keys = (open_lot_key, open_total_key) if totals else (open_lot_key,)
+        lot_groups, *total_groups = Aggregator(OPEN_LOT_VALUES, *keys).add_all(
+            itertools.chain.from_iterable(open_lots.values())).groups()
 
-        table = tabulate_open_lots(
-            flattened_open_lots, decimal_places, shares_decimal_places)
+        table = open_lots_table(
+            lot_groups, decimal_places, shares_decimal_places)
         output += f'# Open lots\n\n{format_table(table)}'
 
         if totals:
-            table = tabulate_open_totals(
-                flattened_open_lots, decimal_places, shares_decimal_places)
+            table = open_totals_table(
+                total_groups[0], decimal_places, shares_decimal_places)
             output += f'\n\n# Open totals\n\n{format_table(table)}'
 
     return output
@@ -39,15 +44,95 @@ def format(closed_lots, open_lots, decimal_places, shares_decimal_places, totals
 
 def format_decimal(value, decimal_places):
     return str(value.quantize(
-        decimal.Decimal('0.1') ** decimal_places, rounding=decimal.ROUND_HALF_UP))
+        _quantum(decimal_places), rounding=decimal.ROUND_HALF_UP))
+
+
+@functools.lru_cache(maxsize=None)
+def _quantum(decimal_places):
+    return decimal.Decimal('0.1') ** decimal_places
+
+
+class Group(object):
+    """Lots that share a key: the first and last lot, and the sums of values."""
+
+    __slots__ = ('first', 'last', 'sums')
+
+    def __init__(self, lot, values):
+        self.first = lot
+        self.last = lot
+        self.sums = list(values)
+
+
+class Aggregator(object):
+    """Sums lot values per group, for several groupings at once, in one pass.
+
+    Lots are grouped by hashing their keys, so lots of a group don't need to
+    be adjacent. Groups are kept in order of their first lot.
+    """
+
+    def __init__(self, values, *keys):
+        self._get_values = operator.attrgetter(*values)
+        self._single_value = len(values) == 1
+        self._keys = keys
+        self._groups = [{} for _ in keys]
+
+    def add(self, lot):
+        """Adds a lot to its group for each key."""
+        values = self._get_values(lot)
+        if self._single_value:
+            values = (values,)
+
+        for key, groups in zip(self._keys, self._groups):
+            group_key = key(lot)
+            group = groups.get(group_key)
+            if group is None:
+                groups[group_key] = Group(lot, values)
+            else:
+                group.last = lot
+                sums = group.sums
+                for i, value in enumerate(values):
+                    sums[i] += value
+
+    def add_all(self, lots):
+        """Adds all lots; returns the aggregator, for chaining."""
+        for lot in lots:
+            self.add(lot)
+        return self
+
+    def groups(self):
+        """Returns a list of groups for each key, in the order of the keys."""
+        return [list(groups.values()) for groups in self._groups]
+
+
+CLOSED_LOT_VALUES = ('quantity', 'proceeds', 'cost_basis', 'wash_sale', 'gain')
+OPEN_LOT_VALUES = ('quantity', 'cost_basis')
+
+
+# Group parts of lots that were split (e.g. partially adjusted)
+# Only group if sold on the same day, and keep gains and losses separate
+def closed_lot_key(lot):
+    return (lot.index, lot.sale.date, lot.proceeds > lot.cost_basis)
+
+
+def closed_total_key(lot):
+    return (lot.sale.date.year, lot.symbol)
+
+
+# Group parts of lots that were split (e.g. partially adjusted)
+def open_lot_key(lot):
+    return lot.index
+
+
+def open_total_key(lot):
+    return lot.symbol
 
 
 def tabulate_closed_lots(closed_lots, decimal_places, shares_decimal_places):
-    # Group parts of lots that were split (e.g. partially adjusted)
-    # Only group if sold on the same day, and keep gains and losses separate
-    grouped_lots = [list(group) for _, group in itertools.groupby(
-        closed_lots, lambda lot: (lot.index, lot.sale.date, lot.proceeds > lot.cost_basis))]
+    groups, = Aggregator(CLOSED_LOT_VALUES, closed_lot_key).add_all(closed_lots).groups()
+    return closed_lots_table(groups, decimal_places, shares_decimal_places)
 
+
+def closed_lots_table(groups, decimal_places, shares_decimal_places):
     header = [
         'symbol',
         'name',
@@ -59,76 +144,80 @@ def tabulate_closed_lots(closed_lots, decimal_places, shares_decimal_places):
         'wash sale',
         'gain']
 
-    return [header] + [
-        [
-            lots[0].symbol,
-            lots[0].name or '',
-            format_decimal(sum(lot.quantity for lot in lots),
-                           shares_decimal_places),
-            str(lots[0].purchase.date),
-            str(lots[0].sale.date),
-            format_decimal(sum(lot.proceeds for lot in lots), decimal_places),
-            format_decimal(sum(lot.cost_basis for lot in lots),
-                           decimal_places),
-            format_decimal(sum(lot.wash_sale for lot in lots), decimal_places),
-            format_decimal(sum(lot.gain for lot in lots), decimal_places)]
-        for lots in grouped_lots]
+    table = [header]
+
+    for group in groups:
+        quantity, proceeds, cost_basis, wash_sale, gain = group.sums
+        table += [[
+            group.first.symbol,
+            group.first.name or '',
+            format_decimal(quantity, shares_decimal_places),
+            str(group.first.purchase.date),
+            str(group.first.sale.date),
+            format_decimal(proceeds, decimal_places),
+            format_decimal(cost_basis, decimal_places),
+            format_decimal(wash_sale, decimal_places),
+            format_decimal(gain, decimal_places)]]
+
+    return table
 
 
 def tabulate_closed_totals(closed_lots, decimal_places, shares_decimal_places):
-    grouped_lots = [list(group) for _, group in itertools.groupby(
-        closed_lots, lambda lot: (lot.sale.date.year, lot.symbol))]
+    groups, = Aggregator(CLOSED_LOT_VALUES, closed_total_key).add_all(closed_lots).groups()
+    return closed_totals_table(groups, decimal_places, shares_decimal_places)
+
 
+def closed_totals_table(groups, decimal_places, shares_decimal_places):
     table = [['sold', 'symbol', 'quantity',
               'proceeds', 'cost basis', 'wash sale', 'gain']]
 
-    for lots in grouped_lots:
+    for group in groups:
+        quantity, proceeds, cost_basis, wash_sale, gain = group.sums
         table += [[
-            str(lots[0].sale.date.year),
-            lots[0].symbol,
-            format_decimal(sum(lot.quantity for lot in lots),
-                           shares_decimal_places),
-            format_decimal(sum(lot.proceeds for lot in lots), decimal_places),
-            format_decimal(sum(lot.cost_basis for lot in lots),
-                           decimal_places),
-            format_decimal(sum(lot.wash_sale for lot in lots), decimal_places),
-            format_decimal(sum(lot.gain for lot in lots), decimal_places)]]
+            str(group.first.sale.date.year),
+            group.first.symbol,
+            format_decimal(quantity, shares_decimal_places),
+            format_decimal(proceeds, decimal_places),
+            format_decimal(cost_basis, decimal_places),
+            format_decimal(wash_sale, decimal_places),
+            format_decimal(gain, decimal_places)]]
 
     return table
 
 
 def tabulate_open_lots(open_lots, decimal_places, shares_decimal_places):
-    # Group parts of lots that were split (e.g. partially adjusted)
-    grouped_lots = [list(group) for _, group in itertools.groupby(
-        open_lots, lambda lot: lot.index)]
+    groups, = Aggregator(OPEN_LOT_VALUES, open_lot_key).add_all(open_lots).groups()
+    return open_lots_table(groups, decimal_places, shares_decimal_places)
 
+
+def open_lots_table(groups, decimal_places, shares_decimal_places):
     header = ['symbol', 'name', 'quantity', 'acquired', 'cost basis']
 
     return [header] + [
         [
-            lots[0].symbol,
-            lots[0].name or '',
-            format_decimal(sum(lot.quantity for lot in lots),
-                           shares_decimal_places),
-            str(lots[0].purchase.date),
-            format_decimal(sum(lot.cost_basis for lot in lots), decimal_places)]
-        for lots in grouped_lots]
+            group.first.symbol,
+            group.first.name or '',
+            format_decimal(group.sums[0], shares_decimal_places),
+            str(group.first.purchase.date),
+            format_decimal(group.sums[1], decimal_places)]
+        for group in groups]
 
 
 def tabulate_open_totals(open_lots, decimal_places, shares_decimal_places):
-    grouped_lots = [list(group) for _, group in itertools.groupby(
-        open_lots, lambda lot: lot.symbol)]
+    groups, = Aggregator(OPEN_LOT_VALUES, open_total_key).add_all(open_lots).groups()
+    return open_totals_table(groups, decimal_places, shares_decimal_places)
+
 
+def open_totals_table(groups, decimal_places, shares_decimal_places):
     table = [['symbol', 'quantity', 'estimated proceeds',
               'cost basis', 'estimated gain']]
 
-    for lots in grouped_lots:
-        total_quantity = sum(lot.quantity for lot in lots)
-        estimated_proceeds = total_quantity * lots[-1].purchase.price
-        total_cost_basis = sum(lot.cost_basis for lot in lots)
+    for group in groups:
+        total_quantity, total_cost_basis = group.sums
+        estimated_proceeds = total_quantity * group.last.purchase.price
         estimated_gain = estimated_proceeds - total_cost_basis
         table += [[
-            lots[0].symbol,
+            group.first.symbol,
             format_decimal(total_quantity, shares_decimal_places),
             format_decimal(estimated_proceeds, decimal_places),
             format_decimal(total_cost_basis, decimal_places),
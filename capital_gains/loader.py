@@ -4,10 +4,19 @@ import collections
 import csv
 import datetime as dt
 import decimal
+import enum
 import functools
-import logging
+import heapq
+import itertools
+import os
+import tempfile
+
+import convert
+import lottrace
+import stats
 from model import Transaction, Lot
 from const import SHARES_PER_CONTRACT
+from lotbook import LotBook
 
 OPTION_TRANSACTIONS = (
     "buy open",
@@ -36,24 +45,46 @@ CLOSE_LOT_TRANSACTIONS = (
     "sell to close",
 )
 
+# Rows per sorted run when stream_transactions has to sort a file on disk
+STREAM_CHUNK_SIZE = 100_000
+
+
+class OrderType(enum.Enum):
+    """Order type of a transaction, normalized from the "Order Type" column."""
+
+    BUY = "buy"
+    BUY_OPEN = "buy open"
+    SELL_TO_OPEN = "sell to open"
+    SELL = "sell"
+    OPTION_EXPIRE = "option expire"
+    OPTION_ASSIGNMENT = "option assignment"
+    BUY_TO_CLOSE = "buy to close"
+    SELL_TO_CLOSE = "sell to close"
+    OTHER = "other"
+
+    def __init__(self, value):
+        self.is_option = value in OPTION_TRANSACTIONS
+        self.is_short_option = value in SHORT_OPTION_TRANSACTIONS
+        self.opens_lot = value in OPEN_LOT_TRANSACTIONS
+        self.closes_lot = value in CLOSE_LOT_TRANSACTIONS
+        # if same date, then ensure that transactions that open lots are sorted
+        # before transactions that close them
+        # (they can be out of order if both happen the same day)
+        self.sort_rank = 1 if self.closes_lot else 0
 
-def compare_function(item1: list[any], item2: list[any]):
-    """Compare function to sort the input file."""
 
-    # first sort by date
-    date_comp = item1[0] - item2[0]
-    if date_comp.days != 0:
-        return date_comp.days
+@functools.lru_cache(maxsize=None)
+def parse_order_type(order_type: str):
+    """Returns the OrderType for a value of the "Order Type" column."""
+    try:
+        return OrderType(order_type.lower())
+    except ValueError:
+        return OrderType.OTHER
 
-    # if same date, then ensure that transactions that open lots are sorted
-    # before transactions that close them
-    # (they can be out of order if both happen the same day)
-    comp = 0
-    if (item1[1] in OPEN_LOT_TRANSACTIONS) and (item2[1] in CLOSE_LOT_TRANSACTIONS):
-        comp = -1
-    elif (item1[1] in CLOSE_LOT_TRANSACTIONS) and (item2[1] in OPEN_LOT_TRANSACTIONS):
-        comp = 1
-    return comp
+
+def sort_key(row: list[any]):
+    """Key to sort parsed rows: by date, then opening before closing transactions."""
+    return (row[0], row[1].sort_rank)
 
 
 # Reads transactions from a csv file.
@@ -61,58 +92,314 @@ def compare_function(item1: list[any], item2: list[any]):
 # purchase transactions to the file. Those will get processed and added as Lots
 # alternatively, we can implement changes to have a separate file with the portfolio
 
-def load_transactions(filename: str, fiscal_year: int = 0):
-    """Returns dictionaries with open lots and sales. The dictionary keys are symbols."""
+def load_transactions(filenames, fiscal_year: int = 0, parsed_cache=None):
+    """Returns dictionaries with open lots and sales. The dictionary keys are symbols.
+
+    Open lots are LotBooks; sales are lists of Transactions.
 
-    open_lots = collections.defaultdict(list)
+    `filenames` is a file or directory name, or a list of them; see input_files.
+    Files are sorted one by one, then merged. If `parsed_cache` (a
+    columnar.ParsedCache) is given, sorted rows are read from it instead of
+    parsing files that haven't changed.
+    """
+
+    open_lots = collections.defaultdict(LotBook)
     sales = collections.defaultdict(list)
 
+    files_rows = []
+    for filename in input_files(filenames):
+        if parsed_cache is None:
+            files_rows.append(parse_file(filename))
+        else:
+            files_rows.append(parsed_cache.rows(filename, parse_file))
+
+    rows = files_rows[0] if len(files_rows) == 1 else merge_rows(files_rows)
+
+    for item in make_transactions(rows, fiscal_year):
+        if isinstance(item, Lot):
+            open_lots[item.symbol].append(item)
+        else:
+            sales[item.symbol].append(item)
+
+    return open_lots, sales
+
+
+def stream_transactions(filenames, fiscal_year: int = 0, chunk_size: int = STREAM_CHUNK_SIZE,
+                        after_date: dt.date = None, start_index: int = 0):
+    """Yields Lots and sales (Transactions) from csv files, in processing order.
+
+    `filenames` is a file or directory name, or a list of them; see input_files.
+    Files are never held in memory: each is read lazily, and merged with the
+    others as it is read. A file that is already sorted is streamed as is. A
+    file with its newest transactions first, like ETrade exports, is streamed
+    backwards in chunks of about `chunk_size` rows, through temporary files.
+    Otherwise it is sorted with an external merge sort, in sorted runs of
+    `chunk_size` rows written to temporary files.
+
+    If `after_date` is given, only transactions after it are yielded, numbered
+    from `start_index`; this resumes from a snapshot taken at `after_date`.
+    """
+    rows = merge_rows(
+        [_sorted_file_rows(filename, chunk_size) for filename in input_files(filenames)])
+    yield from make_transactions(_rows_after(rows, after_date), fiscal_year, start_index)
+
+
+def parse_file(filename: str):
+    """Returns the parsed rows of a csv file, in processing order."""
     with open(filename, "r", encoding="utf-8") as in_file:
-        reader = csv.reader(in_file)
+        account = account_name(filename)
+        with stats.timer("parse"):
+            rows = [parse_row(row, account) for row in read_rows(in_file)]
+    with stats.timer("sort"):
+        rows.sort(key=sort_key)
+    return rows
+
+
+def input_files(filenames):
+    """Returns the csv files named by a file or directory name, or a list of them.
+
+    Directories stand for the *.csv files in them, in name order.
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    files = []
+    for filename in filenames:
+        if os.path.isdir(filename):
+            files.extend(sorted(
+                os.path.join(filename, entry) for entry in os.listdir(filename)
+                if entry.lower().endswith(".csv")))
+        else:
+            files.append(filename)
+    return files
+
+
+def account_name(filename: str):
+    """Returns the account of the transactions in a file: its name without extension."""
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def read_rows(in_file):
+    """Returns the rows of an open csv file, without its header.
+
+    Raw transactions files are converted as they are read; see convert.py.
+    """
+    reader = csv.reader(in_file)
+    header = next(reader)
+    if convert.is_raw_header(header):
+        in_file.seek(0)
+        return convert.read_rows(in_file)
+    return reader
+
+
+def merge_rows(files_rows):
+    """Merges the parsed rows of several files, each in processing order.
+
+    This is a k-way merge on a heap, so each file is read as it is merged.
+    Rows with the same sort key keep the order of the files.
+    """
+    return heapq.merge(*files_rows, key=sort_key)
+
+
+def _sorted_file_rows(filename: str, chunk_size: int):
+    """Yields the parsed rows of a csv file in processing order, without loading it."""
+    account = account_name(filename)
+    order = _file_order(filename)
+
+    if order == _IN_ORDER:
+        with open(filename, "r", encoding="utf-8") as in_file:
+            for row in read_rows(in_file):
+                yield parse_row(row, account)
+        return
+
+    with tempfile.TemporaryDirectory() as run_dir:
+        if order == _REVERSED:
+            # The last chunk is kept in memory; it comes first
+            run_filenames, last_chunk = _write_reversed_runs(filename, run_dir, chunk_size)
+            for row in last_chunk:
+                yield parse_row(row, account)
+            for run_filename in reversed(run_filenames):
+                with open(run_filename, "r", encoding="utf-8", newline="") as run_file:
+                    for row in csv.reader(run_file):
+                        yield parse_row(row, account)
+            return
+
+        run_files = [open(run_filename, "r", encoding="utf-8", newline="")
+                     for run_filename in _write_sorted_runs(filename, run_dir, chunk_size)]
+        try:
+            runs = [_read_run(run_file) for run_file in run_files]
+            for _, row in heapq.merge(*runs, key=lambda item: item[0]):
+                yield parse_row(row, account)
+        finally:
+            for run_file in run_files:
+                run_file.close()
 
-        # Skip header
-        next(reader)
 
-        rows = []
-        for (date, order_type, symbol, cusip, desc, quantity, price, fee, net) in reader:
-            date = dt.datetime.strptime(date, "%m/%d/%Y").date()
-            name = None  # specific to Etrade
-            quantity = decimal.Decimal(quantity)
+def parse_row(row: list[str], account: str = None):
+    """Parses a csv row into [date, order_type, symbol, cusip, desc, quantity, price, fee, net, account].
 
-            if price == 0:
-                # specific to ETrade, sometimes price is blank!
-                # however, maybe this is the right way to do it always because net includes
-                # the option fees that are not included in 'fee'
-                price = decimal.Decimal(net) / quantity
-            else:
-                price = decimal.Decimal(price)
-            if fee == "N/A":
-                # specific to ETrade
-                fee = decimal.Decimal(0)
-            else:
-                fee = decimal.Decimal(fee)
+    `order_type` is an OrderType; `account` is the account the row is from.
+    """
+    (date, order_type, symbol, cusip, desc, quantity, price, fee, net) = row
 
-            if order_type.lower() in OPTION_TRANSACTIONS:
-                price = price * SHARES_PER_CONTRACT
+    date = parse_date(date)
+    order_type = parse_order_type(order_type)
+    quantity = _parse_decimal(quantity)
 
-            rows.append([date, order_type, symbol, cusip,
-                        desc, quantity, price, fee, net])
-        rows.sort(key=functools.cmp_to_key(compare_function))
+    if price == 0:
+        # specific to ETrade, sometimes price is blank!
+        # however, maybe this is the right way to do it always because net includes
+        # the option fees that are not included in 'fee'
+        price = decimal.Decimal(net) / quantity
+    else:
+        price = decimal.Decimal(price)
+    if fee == "N/A":
+        # specific to ETrade
+        fee = decimal.Decimal(0)
+    else:
+        fee = _parse_decimal(fee)
 
-    for index, (date, order_type, symbol, cusip, desc, quantity, price, fee, net) in enumerate(rows):
+    if order_type.is_option:
+        price = price * SHARES_PER_CONTRACT
 
-        is_short_option = order_type.lower() in SHORT_OPTION_TRANSACTIONS
+    return [date, order_type, symbol, cusip, desc, quantity, price, fee, net, account]
+
+
+# Many rows share a trade date, so memoize; there are only so many dates
+@functools.lru_cache(maxsize=None)
+def parse_date(date: str):
+    """Parses a date as written by ETrade."""
+    return dt.datetime.strptime(date, "%m/%d/%Y").date()
+
+
+# Quantities and fees repeat a lot; Decimals are immutable so they can be shared
+_parse_decimal = functools.lru_cache(maxsize=4096)(decimal.Decimal)
+
+
+def make_transactions(rows, fiscal_year: int = 0, start_index: int = 0):
+    """Yields a Lot for each row that opens one and a Transaction for each sale.
+
+    `rows` are parsed rows in processing order, numbered from `start_index`.
+    Sales outside `fiscal_year` are skipped, if given.
+    """
+    name = None  # specific to Etrade
+
+    for index, (date, order_type, symbol, cusip, desc, quantity, price, fee, net, account) in enumerate(
+            rows, start_index):
 
         transaction = Transaction(
-            index, date, symbol, is_short_option, name, quantity, price, fee)
+            index, date, symbol, order_type.is_short_option, name, quantity, price, fee, account)
 
-        if order_type.lower() in OPEN_LOT_TRANSACTIONS:
+        if order_type.opens_lot:
             lot = Lot(transaction)
-            open_lots[symbol].append(lot)
-            logging.debug(f"Added lot: {lot}")
-        elif order_type.lower() in CLOSE_LOT_TRANSACTIONS:
+            lottrace.lot_opened(lot)
+            yield lot
+        elif order_type.closes_lot:
             if (fiscal_year == 0) or (fiscal_year == date.year):
-                sales[symbol].append(transaction)
-            logging.debug(f"Added sale: {transaction}")
+                lottrace.sale_added(transaction)
+                yield transaction
 
-    return open_lots, sales
+
+def _rows_after(rows, after_date: dt.date):
+    """Returns the parsed rows dated after `after_date`, or all of them if it's None."""
+    if after_date is None:
+        return rows
+    return (row for row in rows if row[0] > after_date)
+
+
+def _sort_key(row: list[str]):
+    """Like sort_key, but for raw csv rows."""
+    return (parse_date(row[0]), parse_order_type(row[1]).sort_rank)
+
+
+# Orders of csv files that can be streamed without sorting; see _file_order
+_IN_ORDER = "in order"
+_REVERSED = "reversed"
+
+
+def _file_order(filename: str):
+    """Returns how the rows of a csv file are ordered, so it can be streamed without sorting.
+
+    _IN_ORDER if they are in processing order. _REVERSED if their dates never
+    increase, like ETrade exports, which list the newest transactions first;
+    rows of the same date can then be in any order. None otherwise.
+    """
+    in_order = reversed_dates = True
+    with open(filename, "r", encoding="utf-8") as in_file:
+        previous_key = None
+        for row in read_rows(in_file):
+            key = _sort_key(row)
+            if previous_key is not None:
+                in_order = in_order and key >= previous_key
+                reversed_dates = reversed_dates and key[0] <= previous_key[0]
+                if not (in_order or reversed_dates):
+                    return None
+            previous_key = key
+
+    return _IN_ORDER if in_order else _REVERSED
+
+
+def _write_reversed_runs(filename: str, run_dir: str, chunk_size: int):
+    """Writes the rows of a csv file with reversed dates to run files in processing order.
+
+    Chunks of about `chunk_size` rows, cut between dates, are each put in
+    processing order: the order of their dates is reversed, and the rows of a
+    date are sorted stably by open/close rank, like sort_key sorts the whole
+    file. Returns the names of the run files of all chunks but the last, in
+    file order, and the last chunk's rows; read backwards, they are in
+    processing order.
+    """
+    run_filenames = []
+    chunk = []
+
+    def chunk_in_order():
+        dates = [list(date_rows) for _, date_rows in itertools.groupby(
+            chunk, key=lambda row: parse_date(row[0]))]
+        return [
+            row
+            for date_rows in reversed(dates)
+            for row in sorted(date_rows, key=lambda row: parse_order_type(row[1]).sort_rank)
+        ]
+
+    with open(filename, "r", encoding="utf-8") as in_file:
+        for row in read_rows(in_file):
+            if len(chunk) >= chunk_size and parse_date(row[0]) != parse_date(chunk[-1][0]):
+                run_filename = os.path.join(run_dir, f"run-{len(run_filenames)}.csv")
+                with open(run_filename, "w", encoding="utf-8", newline="") as run_file:
+                    csv.writer(run_file).writerows(chunk_in_order())
+                run_filenames.append(run_filename)
+                chunk = []
+            chunk.append(row)
+
+    return run_filenames, chunk_in_order()
+
+
+def _write_sorted_runs(filename: str, run_dir: str, chunk_size: int):
+    """Writes the rows of a csv file to sorted run files and returns their names.
+
+    Each run row is prefixed with its sort key: the date ordinal, the open/close
+    rank and the row's position in the input, which keeps the sort stable.
+    """
+    run_filenames = []
+
+    with open(filename, "r", encoding="utf-8") as in_file:
+        numbered_rows = enumerate(read_rows(in_file))
+        while chunk := list(itertools.islice(numbered_rows, chunk_size)):
+            run = []
+            for position, row in chunk:
+                date, rank = _sort_key(row)
+                run.append([date.toordinal(), rank, position] + row)
+            run.sort(key=lambda run_row: run_row[:3])
+
+            run_filename = os.path.join(run_dir, f"run-{len(run_filenames)}.csv")
+            with open(run_filename, "w", encoding="utf-8", newline="") as run_file:
+                csv.writer(run_file).writerows(run)
+            run_filenames.append(run_filename)
+
+    return run_filenames
+
+
+def _read_run(run_file):
+    """Yields (key, row) pairs from a run file written by _write_sorted_runs."""
+    for run_row in csv.reader(run_file):
+        yield tuple(map(int, run_row[:3])), run_row[3:]
@@ -1,134 +1,349 @@
-import logging
+import collections
+import concurrent.futures
+import contextlib
+import io
+import itertools
 
+import lottrace
+import stats
 from const import WASHSALE_PERIOD
+from lotbook import LotBook, LotGroup
+from model import Lot, prorate
+from securities import parse_security
 
 
-def process_sales(open_lots, sales, wash_sales):
-    """Returns the closed lots resulting from processing all sales of a symbol."""
+def process_all_sales(open_lots, sales, wash_sales, jobs=1, lot_selection="fifo", groups=None):
+    """Returns the closed lots resulting from processing the sales of every symbol.
+
+    Symbols are independent, so with `jobs` > 1 they are processed in a pool of
+    worker processes, largest first. `open_lots` is updated with the lots that
+    remain open either way, and the result is in the same order as `sales`.
+    Sales close lots in the order of `lot_selection`, one of
+    selection.STRATEGIES.
+
+    With `groups` (a securities.Groups), wash sales match across the symbols of
+    a group, which are processed together in a LotGroup.
+    """
+    closed_lots = collections.defaultdict(list)
+    for symbol in sales:
+        closed_lots[symbol] = []
+
+    for symbol, symbol_closed_lots, output in process_symbols(
+            open_lots, sales, wash_sales, jobs, lot_selection, groups):
+        closed_lots[symbol] = symbol_closed_lots
+        print(output, end="")
+
+    return closed_lots
+
+
+def process_symbols(open_lots, sales, wash_sales, jobs=1, lot_selection="fifo", groups=None):
+    """Yields (symbol, closed lots, printed output) for each symbol of `sales`.
+
+    Like process_all_sales, but yields each symbol's results in `sales` order
+    as they are ready, with whatever processing printed instead of printing it.
+    With `groups`, the symbols of a group are yielded together, when the first
+    of them would be, and the group's output comes with that one.
+    """
+    units = _processing_units(open_lots, sales, groups)
+
+    if jobs <= 1:
+        for symbols, book, unit_sales in units:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                unit_closed_lots = process_sales(book, unit_sales, wash_sales, lot_selection)
+            yield from _symbol_results(open_lots, symbols, book, unit_closed_lots, output.getvalue())
+        return
+
+    # Schedule the largest units first so one heavy symbol doesn't run last
+    order = sorted(
+        range(len(units)), key=lambda i: len(units[i][1]) + len(units[i][2]), reverse=True)
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = {
+            i: executor.submit(
+                _process_symbol_sales, units[i][1], units[i][2], wash_sales, lot_selection,
+                stats.current is not None, lottrace.current is not None)
+            for i in order
+        }
+
+        for i, (symbols, _, _) in enumerate(units):
+            unit_closed_lots, book, output, unit_stats, unit_trace = futures[i].result()
+            if unit_stats is not None:
+                stats.current.merge(unit_stats)
+            if unit_trace is not None:
+                lottrace.current.extend(unit_trace.events)
+            yield from _symbol_results(open_lots, symbols, book, unit_closed_lots, output)
+
+
+def _processing_units(open_lots, sales, groups):
+    """Returns (symbols, book, sales) for each set of symbols to process together.
+
+    Without `groups`, each symbol of `sales` is processed on its own, with its
+    LotBook. Otherwise the symbols of a group with more than one symbol are
+    processed together, in a LotGroup of all of its symbols' lots, with their
+    sales in processing order.
+    """
+    if groups is None:
+        return [([symbol], open_lots[symbol], symbol_sales) for symbol, symbol_sales in sales.items()]
+
+    lot_groups = groups.by_group(open_lots)
+    units = []
+    for group, symbols in groups.by_group(sales).items():
+        members = lot_groups.get(group, [])
+        if len(set(members).union(symbols)) == 1:
+            units.append((symbols, open_lots[symbols[0]], sales[symbols[0]]))
+            continue
+
+        book = LotGroup({symbol: open_lots[symbol] for symbol in members})
+        group_sales = sorted(
+            itertools.chain.from_iterable(sales[symbol] for symbol in symbols),
+            key=lambda sale: sale.index)
+        units.append((symbols, book, group_sales))
+    return units
+
+
+def _symbol_results(open_lots, symbols, book, closed_lots, output):
+    """Yields (symbol, closed lots, output) for the symbols of a processing unit.
+
+    Also stores the lots left open in `book` back in `open_lots`.
+    """
+    if not isinstance(book, LotGroup):
+        open_lots[symbols[0]] = book
+        yield symbols[0], closed_lots, output
+        return
+
+    open_lots.update(book.books)
+    closed_lots_by_symbol = {symbol: [] for symbol in symbols}
+    for lot in closed_lots:
+        closed_lots_by_symbol[lot.symbol].append(lot)
+    for symbol in symbols:
+        yield symbol, closed_lots_by_symbol[symbol], output
+        output = ""
+
+
+class IncrementalProcessor(object):
+    """Processes lots and sales one at a time, in processing order.
+
+    A sale can only be processed once every lot that could replace it in a wash
+    sale is known, so sales are held in `pending_sales` until a transaction
+    more than WASHSALE_PERIOD days later arrives. The results are the same as
+    loading everything and calling process_all_sales.
+
+    Lots are kept in memory, or in `store` if given (a lotstore.LotStore).
+    Sales close lots in the order of `lot_selection`; see process_all_sales.
+
+    A processed sale's closed lots are final, since only open lots are ever
+    adjusted. Unless `keep_closed_lots`, they are only returned, not added to
+    `closed_lots`, so memory depends on the open lots and the pending sales
+    of the last WASHSALE_PERIOD days rather than on the length of the history.
+    """
+
+    def __init__(self, wash_sales, store=None, lot_selection="fifo", keep_closed_lots=True):
+        self.wash_sales = wash_sales
+        self.lot_selection = lot_selection
+        self.keep_closed_lots = keep_closed_lots
+        if store is None:
+            self.open_lots = collections.defaultdict(LotBook)
+            self.closed_lots = collections.defaultdict(list)
+        else:
+            self.open_lots = store.open_lots
+            self.closed_lots = store.closed_lots
+        self.pending_sales = collections.deque()
+        # Index for the next transaction, higher than any index seen so far
+        self.next_index = 0
+
+    def add(self, item):
+        """Adds a Lot or a sale (Transaction).
+
+        Returns the lots closed by the pending sales that this could be
+        processed, which are also added to `closed_lots` if kept.
+        """
+        closed_lots = self._process_pending_sales(item.date)
+        if isinstance(item, Lot):
+            self.open_lots[item.symbol].append(item)
+        else:
+            self.pending_sales.append(item)
+        self.next_index = max(self.next_index, item.index + 1)
+        return closed_lots
+
+    def flush(self):
+        """Processes the remaining sales and returns the lots they closed."""
+        return self._process_pending_sales(None)
+
+    def finish(self):
+        """Processes the remaining sales and returns the kept closed lots by symbol."""
+        self.flush()
+        return self.closed_lots
+
+    def _process_pending_sales(self, date):
+        """Processes the pending sales whose wash sale window ended before `date`.
+
+        Returns the lots they closed. A sale stays pending until it is processed,
+        so one that fails is not lost.
+        """
+        closed_lots = []
+        while self.pending_sales and (
+                date is None or (date - self.pending_sales[0].date).days > WASHSALE_PERIOD):
+            sale = self.pending_sales[0]
+            # Don't add a book for a sale without lots, so open lots keep the
+            # order in which their symbols were first bought
+            if sale.symbol in self.open_lots:
+                open_lots = self.open_lots[sale.symbol]
+            else:
+                open_lots = LotBook()
+            sale_closed_lots = process_sales(
+                open_lots, [sale], self.wash_sales, self.lot_selection)
+            self.pending_sales.popleft()
+            if self.keep_closed_lots:
+                self.closed_lots[sale.symbol] += sale_closed_lots
+            closed_lots += sale_closed_lots
+        return closed_lots
+
+
+def _process_symbol_sales(open_lots, sales, wash_sales, lot_selection, collect_stats, collect_trace):
+    """Worker for process_symbols.
+
+    Also returns the lots left open, anything printed so it can be replayed in
+    symbol order, and the stats and trace recorded if `collect_stats` and
+    `collect_trace`, or None.
+    """
+    if collect_stats:
+        stats.enable()
+    if collect_trace:
+        lottrace.enable()
+
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        closed_lots = process_sales(open_lots, sales, wash_sales, lot_selection)
+
+    return closed_lots, open_lots, output.getvalue(), stats.disable(), lottrace.disable()
+
+
+def process_sales(open_lots, sales, wash_sales, lot_selection="fifo"):
+    """Returns the closed lots resulting from processing all sales of a symbol.
+
+    `open_lots` is the symbol's LotBook; closed lots are removed from it.
+    Sales close lots in the order of `lot_selection`; see process_all_sales.
+    """
     closed_lots = []
+    sales = collections.deque(sales)
+    if sales:
+        stats.count(sales[0].symbol, "sales", len(sales))
 
     # One sale at a time: first identify all closing lots, then handle wash sales
     while sales:
-        sale = sales.pop(0)
-
-        logging.debug(f"Processing sale: {sale}")
+        sale = sales.popleft()
 
         # find which lots will be closed to process sale
-        closing_lots = find_closing_lots(open_lots, sales, sale)
+        with stats.timer("lot matching"):
+            closing_lots = find_closing_lots(open_lots, sales, sale, lot_selection)
 
         for closing_lot in closing_lots:
             # Gains can be closed immediately, but check losses for wash sales
             if closing_lot.gain < 0:
-                remaining_quantity = closing_lot.quantity
-                remaining_loss = abs(closing_lot.gain)
-
-                adjustable_lots = [
-                    lot
-                    for lot in open_lots
-                    if (
-                        abs((lot.purchase.date - closing_lot.sale.date).days)
-                        <= WASHSALE_PERIOD
-                        and lot.index != closing_lot.index
-                        and lot.name != closing_lot.name
-                        and lot.adjustment == 0
+                with stats.timer("wash sale adjustment"):
+                    candidates = open_lots.unadjusted_lots_near(
+                        closing_lot.sale.date, WASHSALE_PERIOD)
+                    stats.count(closing_lot.symbol, "candidates scanned", len(candidates))
+                    # Any other lot of the symbol replaces it, but not the rest
+                    # of the closing lot's own purchase. Lots of other symbols
+                    # come from a LotGroup; short options there aren't
+                    # purchases of anything identical
+                    adjustable_lots = collections.deque(
+                        lot
+                        for lot in candidates
+                        if lot.index != closing_lot.index
+                        and (lot.symbol == closing_lot.symbol or not lot.purchase.is_short_option)
                     )
-                ]
-
-                if not adjustable_lots:
-                    logging.debug(f"Loss of {remaining_loss}; no wash sale")
-                else:
-                    if not wash_sales:
-                        logging.debug(
-                            f"Loss of {remaining_loss}; wash sale; not adjusting lots because --no-wash-sales"
-                        )
-                    else:
-                        logging.debug(
-                            f"Loss of {remaining_loss}; wash sale; adjusting lots"
-                        )
-
-                        washsale_adjust_lots(
-                            open_lots, remaining_quantity, remaining_loss, adjustable_lots
-                        )
 
-                    if remaining_quantity:
-                        logging.debug(
-                            f"Finished adjusting; remaining loss of {remaining_loss} is realized"
+                    if adjustable_lots and wash_sales:
+                        _, disallowed_loss = washsale_adjust_lots(
+                            open_lots, closing_lot.quantity, abs(closing_lot.gain),
+                            adjustable_lots, closing_lot.sale
                         )
-
-                closing_lot.wash_sale = (
-                    abs(closing_lot.gain)
-                    * (closing_lot.quantity - remaining_quantity)
-                    / closing_lot.quantity
-                )
+                        # The loss moved to the replacement lots isn't realized
+                        closing_lot.wash_sale = disallowed_loss
 
             closed_lots.append(closing_lot)
-            logging.debug(f"Closed lot: {closing_lot}")
+            lottrace.lot_closed(closing_lot)
 
     return closed_lots
 
 
-def washsale_adjust_lots(open_lots, remaining_quantity, remaining_loss, adjustable_lots):
+def washsale_adjust_lots(open_lots, remaining_quantity, remaining_loss, adjustable_lots, sale=None):
+    """Adjusts the basis of `adjustable_lots` for a loss on `sale`.
+
+    `remaining_quantity` is in units of the sale's security. Lots of a security
+    with other units, e.g. options replacing shares, are matched by shares of
+    the underlying.
+
+    Returns the quantity, in units of the sale's security, and the loss that
+    were moved to the lots' basis.
+    """
+    quantity, loss = remaining_quantity, remaining_loss
+    sale_shares = None if sale is None else parse_security(sale.symbol).shares
     while remaining_quantity and adjustable_lots:
-        logging.debug(f"Remaining quantity to adjust: {remaining_quantity}")
-        adjusting_lot = adjustable_lots.pop(0)
+        adjusting_lot = adjustable_lots.popleft()
+
+        # Remaining quantity in units of the adjusting lot
+        lot_shares = sale_shares if sale is None else parse_security(adjusting_lot.symbol).shares
+        lot_remaining_quantity = remaining_quantity
+        if lot_shares != sale_shares:
+            lot_remaining_quantity = prorate(remaining_quantity, sale_shares, lot_shares)
+            if not lot_remaining_quantity:
+                break
 
         # Split adjustable lot if too large
-        if adjusting_lot.quantity > remaining_quantity:
-            logging.debug(f"Splitting adjustable lot: {adjusting_lot}")
-            open_index = open_lots.index(adjusting_lot)
-            adjusting_lot, remaining_lot = adjusting_lot.split(
-                remaining_quantity)
-            open_lots[open_index: open_index + 1] = [
-                adjusting_lot,
-                remaining_lot,
-            ]
-            adjustable_lots.insert(0, remaining_lot)
-            logging.debug(
-                f"Split adjustable lot into: {adjusting_lot} + {remaining_lot}"
-            )
-
-        adjusting_lot.adjustment = (
-            remaining_loss * adjusting_lot.quantity / remaining_quantity)
-        logging.debug(f"Adjusted lot: {adjusting_lot}")
-
-        remaining_quantity -= adjusting_lot.quantity
+        if adjusting_lot.quantity > lot_remaining_quantity:
+            adjusting_lot, remaining_lot = open_lots.split(
+                adjusting_lot, lot_remaining_quantity)
+            stats.count(adjusting_lot.symbol, "lots split")
+            lottrace.lot_split(adjusting_lot)
+            adjustable_lots.appendleft(remaining_lot)
+
+        # The lot that covers the rest of the quantity takes the rest of the
+        # loss exactly, so the sale's disallowed loss is its whole loss
+        if adjusting_lot.quantity == lot_remaining_quantity:
+            adjustment = remaining_loss
+        else:
+            adjustment = prorate(remaining_loss, adjusting_lot.quantity, lot_remaining_quantity)
+        open_lots.adjust(adjusting_lot, adjustment)
+        stats.count(adjusting_lot.symbol, "wash sale adjustments")
+        lottrace.wash_sale_adjustment(adjusting_lot, sale)
+
+        if lot_shares == sale_shares:
+            remaining_quantity -= adjusting_lot.quantity
+        elif adjusting_lot.quantity == lot_remaining_quantity:
+            remaining_quantity = 0
+        else:
+            remaining_quantity -= prorate(adjusting_lot.quantity, lot_shares, sale_shares)
         remaining_loss -= adjusting_lot.adjustment
 
+    return quantity - remaining_quantity, loss - remaining_loss
+
 
-def find_closing_lots(open_lots, sales, sale):
-    closable_lots = [
-        lot
-        for lot in open_lots
-        if lot.index < sale.index and (sale.name is None or lot.name == sale.name)
-    ]
+def find_closing_lots(open_lots, sales, sale, lot_selection="fifo"):
     closing_lots = []
 
     remaining_quantity = abs(sale.quantity)
     while remaining_quantity:
-        if len(closable_lots) == 0:
+        closing_lot = open_lots.select(sale, lot_selection)
+        if closing_lot is None:
             print("No closable lots while processing", sale)
+            lottrace.no_closable_lots(sale, remaining_quantity)
             return closing_lots
-        else:
-            closing_lot = closable_lots.pop(0)
-            logging.debug(f"Closing lot: {closing_lot}")
 
         # Split sale if lot is too small
         if closing_lot.quantity < remaining_quantity:
-            logging.debug(f"Splitting sale: {sale}")
             sale, remaining_sale = sale.split(closing_lot.quantity)
-            sales.insert(0, remaining_sale)
+            stats.count(sale.symbol, "sales split")
+            lottrace.sale_split(sale)
+            sales.appendleft(remaining_sale)
             remaining_quantity = abs(sale.quantity)
-            logging.debug(f"Split sale into: {sale} + {remaining_sale}")
             # or split the lot if not all shares are sold
         elif closing_lot.quantity > remaining_quantity:
-            logging.debug(f"Splitting closing lot: {closing_lot}")
-            open_index = open_lots.index(closing_lot)
-            closing_lot, remaining_lot = closing_lot.split(remaining_quantity)
-            open_lots[open_index: open_index +
-                      1] = [closing_lot, remaining_lot]
-            closable_lots.insert(0, remaining_lot)
-            logging.debug(
-                f"Split closing lot into: {closing_lot} + {remaining_lot}")
+            closing_lot, remaining_lot = open_lots.split(
+                closing_lot, remaining_quantity)
+            stats.count(closing_lot.symbol, "lots split")
+            lottrace.lot_split(closing_lot)
 
         closing_lot.sale = sale
         open_lots.remove(closing_lot)
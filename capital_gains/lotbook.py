@@ -0,0 +1,512 @@
+"""Defines the LotBook, an indexed collection of the open lots of a symbol.
+
+Also defines the LotGroup, the LotBooks of symbols whose wash sales match
+across them, and the CopyOnWriteBook, which lets lots be processed as if a
+LotBook were changed, without changing it.
+"""
+
+import bisect
+import dataclasses
+import datetime
+import itertools
+
+import selection
+
+
+class _Link(object):
+    """One entry in a _LinkedList."""
+
+    __slots__ = ("lot", "prev", "next")
+
+    def __init__(self, lot):
+        self.lot = lot
+        self.prev = None
+        self.next = None
+
+
+class _LinkedList(object):
+    """Doubly linked list of lots with O(1) append, insertion and removal."""
+
+    __slots__ = ("head", "tail", "size")
+
+    def __init__(self):
+        self.head = None
+        self.tail = None
+        self.size = 0
+
+    def __iter__(self):
+        link = self.head
+        while link is not None:
+            # Read `next` first so the current link can be removed while iterating
+            next_link = link.next
+            yield link.lot
+            link = next_link
+
+    def append(self, lot):
+        """Appends a lot and returns its link."""
+        link = _Link(lot)
+        link.prev = self.tail
+        if self.tail is None:
+            self.head = link
+        else:
+            self.tail.next = link
+        self.tail = link
+        self.size += 1
+        return link
+
+    def insert_after(self, link, lot):
+        """Inserts a lot right after `link` and returns its link."""
+        new_link = _Link(lot)
+        new_link.prev = link
+        new_link.next = link.next
+        if link.next is None:
+            self.tail = new_link
+        else:
+            link.next.prev = new_link
+        link.next = new_link
+        self.size += 1
+        return new_link
+
+    def remove(self, link):
+        """Unlinks `link` from the list."""
+        if link.prev is None:
+            self.head = link.next
+        else:
+            link.prev.next = link.next
+        if link.next is None:
+            self.tail = link.prev
+        else:
+            link.next.prev = link.prev
+        link.prev = link.next = None
+        self.size -= 1
+
+
+class _DateIndex(object):
+    """Lots by purchase date, in insertion order within a date."""
+
+    def __init__(self):
+        self._lots_by_date = {}
+        # The keys of `_lots_by_date`, in order
+        self._dates = []
+
+    def append(self, lot):
+        """Adds a lot after the others of its date and returns its link."""
+        date_lots = self._lots_by_date.get(lot.purchase.date)
+        if date_lots is None:
+            date_lots = self._lots_by_date[lot.purchase.date] = _LinkedList()
+            bisect.insort(self._dates, lot.purchase.date)
+        return date_lots.append(lot)
+
+    def insert_after(self, link, lot):
+        """Inserts a lot of the same date right after `link` and returns its link."""
+        return self._lots_by_date[lot.purchase.date].insert_after(link, lot)
+
+    def remove(self, lot, link):
+        date_lots = self._lots_by_date[lot.purchase.date]
+        date_lots.remove(link)
+        if date_lots.head is None:
+            del self._lots_by_date[lot.purchase.date]
+            del self._dates[bisect.bisect_left(self._dates, lot.purchase.date)]
+
+    def between(self, start_date, end_date):
+        """Returns the lots purchased from `start_date` to `end_date`, in date order."""
+        start = bisect.bisect_left(self._dates, start_date)
+        end = bisect.bisect_right(self._dates, end_date)
+
+        return [
+            lot
+            for date in self._dates[start:end]
+            for lot in self._lots_by_date[date]
+        ]
+
+
+class LotBook(object):
+    """Open lots of one symbol in FIFO order, with secondary indexes.
+
+    Lots must be appended in ascending `index` order, which is the order the
+    loader produces them in. Popping the first lot, removing any lot and
+    splitting a lot in place are all O(1).
+
+    Sales only close lots of their own account, so lots are also indexed by
+    account, and by account and name. Lots that have not been adjusted for a
+    wash sale yet are indexed by purchase date, whatever their account, so the
+    lots in a wash sale window can be found with a bisect instead of a scan.
+    Lot selection strategies other than FIFO get a heap index per account on
+    first use; see selection.
+
+    Books can share `date_index`, so that the unadjusted lots of several
+    symbols are found together; see LotGroup.
+    """
+
+    def __init__(self, lots=(), date_index=None):
+        self._lots = _LinkedList()
+        self._lots_by_account = {}
+        # (account, name) -> lots
+        self._lots_by_name = {}
+        # Unadjusted lots, by purchase date
+        self._unadjusted_lots = _DateIndex() if date_index is None else date_index
+        # id(lot) -> (link in `_lots`, link in `_lots_by_account`,
+        #             link in `_lots_by_name`, link in `_unadjusted_lots` or None)
+        self._links = {}
+        # account -> {lot selection strategy -> selection.HeapSelection}, once used
+        self._selections = {}
+
+        for lot in lots:
+            self.append(lot)
+
+    def __len__(self):
+        return self._lots.size
+
+    def __iter__(self):
+        return iter(self._lots)
+
+    def __contains__(self, lot):
+        return id(lot) in self._links
+
+    def __repr__(self):
+        return f"LotBook({list(self)!r})"
+
+    # Linked lists pickle recursively, so pickle the lots in order instead
+    def __getstate__(self):
+        return list(self)
+
+    def __setstate__(self, lots):
+        self.__init__(lots)
+
+    def append(self, lot):
+        """Adds a lot at the end of the book."""
+        account_lots = self._lots_by_account.get(lot.account)
+        if account_lots is None:
+            account_lots = self._lots_by_account[lot.account] = _LinkedList()
+        name_lots = self._lots_by_name.get((lot.account, lot.name))
+        if name_lots is None:
+            name_lots = self._lots_by_name[lot.account, lot.name] = _LinkedList()
+
+        date_link = None
+        if lot.adjustment == 0:
+            date_link = self._unadjusted_lots.append(lot)
+
+        self._links[id(lot)] = (
+            self._lots.append(lot), account_lots.append(lot), name_lots.append(lot), date_link)
+        for heap_selection in self._selections.get(lot.account, {}).values():
+            heap_selection.add(lot)
+
+    def lots(self, account, name=None):
+        """Iterates over the lots of an account, or its lots named `name` if given, oldest first."""
+        if name is None:
+            return iter(self._lots_by_account.get(account, ()))
+        return iter(self._lots_by_name.get((account, name), ()))
+
+    def is_unadjusted(self, lot):
+        """Returns whether a lot in the book is indexed as not adjusted for a wash sale yet."""
+        return self._links[id(lot)][3] is not None
+
+    def first(self, account, name=None):
+        """Returns the oldest lot of an account, or its oldest lot named `name` if given."""
+        if name is None:
+            lots = self._lots_by_account.get(account)
+        else:
+            lots = self._lots_by_name.get((account, name))
+        if lots is None or lots.head is None:
+            return None
+        return lots.head.lot
+
+    def select(self, sale, lot_selection="fifo"):
+        """Returns the lot for `sale` to close next, or None if no lot older than it is left.
+
+        Only lots of the sale's account are closed. `lot_selection` is one of
+        selection.STRATEGIES; named sales close lots with their name in FIFO
+        order with any of them.
+        """
+        if lot_selection == "fifo" or sale.name is not None:
+            lot = self.first(sale.account, sale.name)
+            return lot if lot is not None and lot.index < sale.index else None
+
+        selections = self._selections.setdefault(sale.account, {})
+        heap_selection = selections.get(lot_selection)
+        if heap_selection is None:
+            heap_selection = selections[lot_selection] = (
+                selection.SELECTIONS[lot_selection](self.lots(sale.account)))
+        return heap_selection.select(sale)
+
+    def popleft(self, account, name=None):
+        """Removes and returns the oldest lot of an account (named `name` if given)."""
+        lot = self.first(account, name)
+        if lot is None:
+            raise IndexError("pop from an empty LotBook")
+        self.remove(lot)
+        return lot
+
+    def remove(self, lot):
+        """Removes a lot from the book."""
+        link, account_link, name_link, date_link = self._links.pop(id(lot))
+        self._lots.remove(link)
+
+        account_lots = self._lots_by_account[lot.account]
+        account_lots.remove(account_link)
+        if account_lots.head is None:
+            del self._lots_by_account[lot.account]
+
+        name_lots = self._lots_by_name[lot.account, lot.name]
+        name_lots.remove(name_link)
+        if name_lots.head is None:
+            del self._lots_by_name[lot.account, lot.name]
+
+        if date_link is not None:
+            self._unadjusted_lots.remove(lot, date_link)
+
+        for heap_selection in self._selections.get(lot.account, {}).values():
+            heap_selection.remove(lot)
+
+    def split(self, lot, quantity):
+        """Splits a lot in place and returns the two resulting lots.
+
+        The first lot takes the position of the original one and the second
+        lot is placed right after it.
+        """
+        link, account_link, name_link, date_link = self._links.pop(id(lot))
+        first_lot, second_lot = lot.split(quantity)
+
+        link.lot = account_link.lot = name_link.lot = first_lot
+        second_date_link = None
+        if date_link is not None:
+            date_link.lot = first_lot
+            second_date_link = self._unadjusted_lots.insert_after(date_link, second_lot)
+
+        self._links[id(first_lot)] = (link, account_link, name_link, date_link)
+        self._links[id(second_lot)] = (
+            self._lots.insert_after(link, second_lot),
+            self._lots_by_account[lot.account].insert_after(account_link, second_lot),
+            self._lots_by_name[lot.account, lot.name].insert_after(name_link, second_lot),
+            second_date_link,
+        )
+
+        for heap_selection in self._selections.get(lot.account, {}).values():
+            heap_selection.split(lot, first_lot, second_lot)
+
+        return first_lot, second_lot
+
+    def adjust(self, lot, adjustment):
+        """Sets the wash sale adjustment of a lot in the book."""
+        link, account_link, name_link, date_link = self._links[id(lot)]
+        lot.adjustment = adjustment
+
+        if date_link is not None and adjustment != 0:
+            self._unadjusted_lots.remove(lot, date_link)
+            self._links[id(lot)] = (link, account_link, name_link, None)
+
+        for heap_selection in self._selections.get(lot.account, {}).values():
+            heap_selection.update(lot)
+
+    def unadjusted_lots_between(self, start_date, end_date):
+        """Returns the unadjusted lots purchased from `start_date` to `end_date`.
+
+        Lots are returned in purchase date order, and in FIFO order within a
+        date. Adjusted lots are not indexed, so they are never visited.
+        With a shared date index, lots of all the books sharing it are returned.
+        """
+        return self._unadjusted_lots.between(start_date, end_date)
+
+    def unadjusted_lots_near(self, date, days):
+        """Returns the unadjusted lots purchased at most `days` from `date`."""
+        delta = datetime.timedelta(days=days)
+        return self.unadjusted_lots_between(date - delta, date + delta)
+
+
+class LotGroup(object):
+    """The open lots of substantially identical symbols, for wash sales across them.
+
+    `books` maps symbols to their lots. Each symbol keeps its own LotBook, so
+    sales only close lots of their symbol, but the books share one index of
+    unadjusted lots, so a wash sale window finds the lots of every symbol in
+    one bisect. It has the interface that logic.process_sales uses.
+    """
+
+    def __init__(self, books):
+        self._unadjusted_lots = _DateIndex()
+        self.books = {symbol: LotBook(date_index=self._unadjusted_lots) for symbol in books}
+        # Lots of the same date must be indexed in processing order across books
+        lots = sorted(
+            itertools.chain.from_iterable(books.values()), key=lambda lot: lot.index)
+        for lot in lots:
+            self.books[lot.symbol].append(lot)
+
+    def __len__(self):
+        return sum(len(book) for book in self.books.values())
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.books.values())
+
+    def __repr__(self):
+        return f"LotGroup({self.books!r})"
+
+    # The books share the date index, so pickle the lots instead
+    def __getstate__(self):
+        return {symbol: list(book) for symbol, book in self.books.items()}
+
+    def __setstate__(self, books):
+        self.__init__(books)
+
+    def book(self, symbol):
+        """Returns the LotBook of a symbol, adding an empty one if needed."""
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = LotBook(date_index=self._unadjusted_lots)
+        return book
+
+    def select(self, sale, lot_selection="fifo"):
+        """Returns the lot of the sale's symbol and account for `sale` to close next, or None."""
+        return self.book(sale.symbol).select(sale, lot_selection)
+
+    def remove(self, lot):
+        """Removes a lot from its book."""
+        self.books[lot.symbol].remove(lot)
+
+    def split(self, lot, quantity):
+        """Splits a lot in place in its book and returns the two resulting lots."""
+        return self.books[lot.symbol].split(lot, quantity)
+
+    def adjust(self, lot, adjustment):
+        """Sets the wash sale adjustment of a lot in its book."""
+        self.books[lot.symbol].adjust(lot, adjustment)
+
+    def unadjusted_lots_between(self, start_date, end_date):
+        """Returns the unadjusted lots of every symbol purchased from `start_date` to `end_date`.
+
+        Lots are returned in purchase date order, and in processing order within
+        a date.
+        """
+        return self._unadjusted_lots.between(start_date, end_date)
+
+    def unadjusted_lots_near(self, date, days):
+        """Returns the unadjusted lots of every symbol purchased at most `days` from `date`."""
+        delta = datetime.timedelta(days=days)
+        return self.unadjusted_lots_between(date - delta, date + delta)
+
+
+class CopyOnWriteBook(object):
+    """A LotBook as changed by processing, leaving the LotBook itself unchanged.
+
+    It has the interface that logic.process_sales uses. A lot of the base book
+    is copied the first time it is returned, and only copies are changed, so
+    processing a few sales copies a few lots, however large the base book is.
+    Lots can't be appended; like a LotBook, a sale only closes lots of its
+    account.
+
+    `adjusted_lots` lists the lots adjusted for a wash sale, in order.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.adjusted_lots = []
+        # id(base lot) of each adjusted lot, in order
+        self._adjusted_origins = {}
+        # id(base lot) -> [lot, unadjusted] entries that replace it, in order;
+        # empty once they are all removed
+        self._overrides = {}
+        # id(copied lot) -> id(base lot) it replaces
+        self._origins = {}
+
+    def __len__(self):
+        replaced = sum(len(entries) - 1 for entries in self._overrides.values())
+        return len(self.base) + replaced
+
+    def __iter__(self):
+        """Iterates over the lots; lots of the base book must not be changed."""
+        for lot in self.base:
+            entries = self._overrides.get(id(lot))
+            if entries is None:
+                yield lot
+            else:
+                for entry_lot, _ in entries:
+                    yield entry_lot
+
+    def __repr__(self):
+        return f"CopyOnWriteBook({list(self)!r})"
+
+    def first(self, account, name=None):
+        """Returns the oldest lot of an account, or its oldest lot named `name` if given."""
+        for lot in self.base.lots(account, name):
+            entries = self._overrides.get(id(lot))
+            if entries is None:
+                entries = self._copy(lot)
+            if entries:
+                return entries[0][0]
+        return None
+
+    def select(self, sale, lot_selection="fifo"):
+        """Returns the lot for `sale` to close next, or None; only FIFO is supported."""
+        if lot_selection != "fifo":
+            raise ValueError(f"CopyOnWriteBook doesn't support {lot_selection} lot selection")
+        lot = self.first(sale.account, sale.name)
+        return lot if lot is not None and lot.index < sale.index else None
+
+    def remove(self, lot):
+        """Removes a lot from the book."""
+        entries = self._overrides[self._origins.pop(id(lot))]
+        del entries[self._position(entries, lot)]
+
+    def split(self, lot, quantity):
+        """Splits a lot in place and returns the two resulting lots."""
+        origin = self._origins.pop(id(lot))
+        entries = self._overrides[origin]
+        position = self._position(entries, lot)
+        unadjusted = entries[position][1]
+
+        first_lot, second_lot = lot.split(quantity)
+        entries[position:position + 1] = [[first_lot, unadjusted], [second_lot, unadjusted]]
+        self._origins[id(first_lot)] = self._origins[id(second_lot)] = origin
+        return first_lot, second_lot
+
+    def adjust(self, lot, adjustment):
+        """Sets the wash sale adjustment of a lot in the book."""
+        lot.adjustment = adjustment
+        self.adjusted_lots.append(lot)
+        if adjustment != 0:
+            origin = self._origins[id(lot)]
+            self._adjusted_origins[origin] = None
+            entries = self._overrides[origin]
+            entries[self._position(entries, lot)][1] = False
+
+    def open_adjusted_lots(self):
+        """Returns the adjusted lots still in the book, including parts split from them, in order.
+
+        Lots of the base book that were adjusted before aren't included.
+        """
+        # Only unadjusted lots are adjusted, so the adjusted entries of their
+        # base lot are all from this book
+        return [
+            lot
+            for origin in self._adjusted_origins
+            for lot, unadjusted in self._overrides[origin]
+            if not unadjusted
+        ]
+
+    def unadjusted_lots_between(self, start_date, end_date):
+        """Returns the unadjusted lots purchased from `start_date` to `end_date`.
+
+        Lots are returned in purchase date order, and in FIFO order within a
+        date; see LotBook.unadjusted_lots_between.
+        """
+        lots = []
+        for lot in self.base.unadjusted_lots_between(start_date, end_date):
+            entries = self._overrides.get(id(lot))
+            if entries is None:
+                entries = self._copy(lot)
+            lots.extend(entry_lot for entry_lot, unadjusted in entries if unadjusted)
+        return lots
+
+    def unadjusted_lots_near(self, date, days):
+        """Returns the unadjusted lots purchased at most `days` from `date`."""
+        delta = datetime.timedelta(days=days)
+        return self.unadjusted_lots_between(date - delta, date + delta)
+
+    def _copy(self, lot):
+        copied_lot = dataclasses.replace(lot)
+        entries = self._overrides[id(lot)] = [[copied_lot, self.base.is_unadjusted(lot)]]
+        self._origins[id(copied_lot)] = id(lot)
+        return entries
+
+    @staticmethod
+    def _position(entries, lot):
+        return next(position for position, (entry_lot, _) in enumerate(entries) if entry_lot is lot)
@@ -0,0 +1,342 @@
+"""Keeps open and closed lots in a SQLite database instead of in memory.
+
+A LotStore has the same shape as the in-memory state of an
+IncrementalProcessor: `open_lots` maps symbols to books with the interface of
+a LotBook, and `closed_lots` maps symbols to lists that lots are added to.
+Only the lots in use are in memory; the rest are rows, and the lookups that
+processing makes are indexed queries:
+
+    open_lots_fifo        (symbol, lot index, part)   lots in order
+    open_lots_by_account  (symbol, account, ...)      oldest lot of an account
+    open_lots_by_name     (symbol, account, name, ...)  oldest lot of a name
+    open_lots_unadjusted  (symbol, adjusted, date, ...)  wash sale window
+
+`part` orders the lots split from one purchase, which share its index. Writes
+are committed in batches of BATCH_SIZE. The database is a scratch file: its
+tables are recreated when it is opened.
+"""
+
+import datetime as dt
+import decimal
+import itertools
+import sqlite3
+
+from model import Lot, Transaction
+
+# Writes per transaction
+BATCH_SIZE = 10_000
+
+_SCHEMA = """
+DROP TABLE IF EXISTS open_lots;
+DROP TABLE IF EXISTS closed_lots;
+
+CREATE TABLE open_lots (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    lot_index INTEGER NOT NULL,
+    part INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    is_short_option INTEGER NOT NULL,
+    name TEXT,
+    quantity TEXT NOT NULL,
+    price TEXT NOT NULL,
+    fee TEXT NOT NULL,
+    account TEXT,
+    adjustment TEXT NOT NULL,
+    adjusted INTEGER NOT NULL
+);
+CREATE INDEX open_lots_fifo ON open_lots (symbol, lot_index, part);
+CREATE INDEX open_lots_by_account ON open_lots (symbol, account, lot_index, part);
+CREATE INDEX open_lots_by_name ON open_lots (symbol, account, name, lot_index, part);
+CREATE INDEX open_lots_unadjusted ON open_lots (symbol, adjusted, date, lot_index, part);
+
+CREATE TABLE closed_lots (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    lot_index INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    is_short_option INTEGER NOT NULL,
+    name TEXT,
+    quantity TEXT NOT NULL,
+    price TEXT NOT NULL,
+    fee TEXT NOT NULL,
+    account TEXT,
+    adjustment TEXT NOT NULL,
+    wash_sale TEXT NOT NULL,
+    sale_index INTEGER NOT NULL,
+    sale_date INTEGER NOT NULL,
+    sale_is_short_option INTEGER NOT NULL,
+    sale_name TEXT,
+    sale_quantity TEXT NOT NULL,
+    sale_price TEXT NOT NULL,
+    sale_fee TEXT NOT NULL,
+    sale_account TEXT
+);
+CREATE INDEX closed_lots_by_symbol ON closed_lots (symbol, id);
+"""
+
+_OPEN_LOT_COLUMNS = (
+    "id, lot_index, date, is_short_option, name, quantity, price, fee, account, adjustment")
+_FIFO_ORDER = "ORDER BY lot_index, part"
+
+
+class _StoredLot(Lot):
+    """An open Lot read from a LotStore, which knows its row."""
+
+    __slots__ = ("row_id",)
+
+
+class LotStore(object):
+    """SQLite database of the open and closed lots of every symbol."""
+
+    def __init__(self, filename: str):
+        self.connection = sqlite3.connect(filename)
+        # A scratch database: durability is not worth a sync per batch
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("PRAGMA journal_mode = MEMORY")
+        self.connection.executescript(_SCHEMA)
+
+        self.open_lots = _Books(self, StoredLotBook)
+        self.closed_lots = _Books(self, StoredClosedLots)
+        # Appended lots are numbered in order, which splits renumber as needed
+        self._parts = itertools.count()
+        self._writes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Commits pending writes and closes the database."""
+        self.connection.commit()
+        self.connection.close()
+
+    def execute(self, sql, parameters=()):
+        return self.connection.execute(sql, parameters)
+
+    def write(self, sql, parameters=()):
+        """Executes a statement that writes, committing every BATCH_SIZE of them."""
+        cursor = self.connection.execute(sql, parameters)
+        self._writes += 1
+        if self._writes >= BATCH_SIZE:
+            self.connection.commit()
+            self._writes = 0
+        return cursor
+
+    def next_part(self):
+        return next(self._parts)
+
+
+class _Books(dict):
+    """Maps symbols to the store's books, made on first use like a defaultdict."""
+
+    def __init__(self, store, book_type):
+        super().__init__()
+        self._store = store
+        self._book_type = book_type
+
+    def __missing__(self, symbol):
+        book = self[symbol] = self._book_type(self._store, symbol)
+        return book
+
+
+class StoredLotBook(object):
+    """The open lots of one symbol in a LotStore; see lotbook.LotBook."""
+
+    def __init__(self, store, symbol):
+        self._store = store
+        self.symbol = symbol
+
+    def __len__(self):
+        return self._store.execute(
+            "SELECT COUNT(*) FROM open_lots WHERE symbol = ?", (self.symbol,)).fetchone()[0]
+
+    def __iter__(self):
+        cursor = self._store.execute(
+            f"SELECT {_OPEN_LOT_COLUMNS} FROM open_lots WHERE symbol = ? {_FIFO_ORDER}",
+            (self.symbol,))
+        return (self._lot(row) for row in cursor)
+
+    def __contains__(self, lot):
+        return isinstance(lot, _StoredLot) and self._store.execute(
+            "SELECT 1 FROM open_lots WHERE id = ? AND symbol = ?",
+            (lot.row_id, self.symbol)).fetchone() is not None
+
+    def __repr__(self):
+        return f"StoredLotBook({self.symbol!r})"
+
+    def append(self, lot):
+        """Adds a lot at the end of the book.
+
+        The book stores a copy: use the lots it returns to change it.
+        """
+        self._insert(lot, self._store.next_part(), lot.adjustment != 0)
+
+    def first(self, account, name=None):
+        """Returns the oldest lot of an account, or its oldest lot named `name` if given."""
+        # IS matches a NULL account too
+        if name is None:
+            row = self._store.execute(
+                f"SELECT {_OPEN_LOT_COLUMNS} FROM open_lots WHERE symbol = ? AND account IS ? "
+                f"{_FIFO_ORDER} LIMIT 1",
+                (self.symbol, account)).fetchone()
+        else:
+            row = self._store.execute(
+                f"SELECT {_OPEN_LOT_COLUMNS} FROM open_lots "
+                f"WHERE symbol = ? AND account IS ? AND name = ? {_FIFO_ORDER} LIMIT 1",
+                (self.symbol, account, name)).fetchone()
+        return None if row is None else self._lot(row)
+
+    def select(self, sale, lot_selection="fifo"):
+        """Returns the lot of the sale's account for `sale` to close next, or None.
+
+        Only FIFO is supported.
+        """
+        if lot_selection != "fifo":
+            raise ValueError(f"StoredLotBook doesn't support {lot_selection} lot selection")
+        lot = self.first(sale.account, sale.name)
+        return lot if lot is not None and lot.index < sale.index else None
+
+    def popleft(self, account, name=None):
+        """Removes and returns the oldest lot of an account (named `name` if given)."""
+        lot = self.first(account, name)
+        if lot is None:
+            raise IndexError("pop from an empty StoredLotBook")
+        self.remove(lot)
+        return lot
+
+    def remove(self, lot):
+        """Removes a lot from the book."""
+        self._store.write("DELETE FROM open_lots WHERE id = ?", (lot.row_id,))
+
+    def split(self, lot, quantity):
+        """Splits a lot in place and returns the two resulting lots.
+
+        The first lot keeps the row of the original one and the second lot is
+        placed right after it.
+        """
+        first_lot, second_lot = lot.split(quantity)
+        part, adjusted = self._store.execute(
+            "SELECT part, adjusted FROM open_lots WHERE id = ?", (lot.row_id,)).fetchone()
+
+        self._store.write(
+            "UPDATE open_lots SET quantity = ?, fee = ?, adjustment = ? WHERE id = ?",
+            (str(first_lot.quantity), str(first_lot.purchase.fee), str(first_lot.adjustment),
+             lot.row_id))
+        first_lot.row_id = lot.row_id
+
+        # Make room for the second lot; only lots split from the same purchase move
+        self._store.write(
+            "UPDATE open_lots SET part = part + 1 WHERE symbol = ? AND lot_index = ? AND part > ?",
+            (self.symbol, lot.index, part))
+        second_lot.row_id = self._insert(second_lot, part + 1, adjusted)
+
+        return first_lot, second_lot
+
+    def adjust(self, lot, adjustment):
+        """Sets the wash sale adjustment of a lot in the book."""
+        lot.adjustment = adjustment
+        self._store.write(
+            "UPDATE open_lots SET adjustment = ?, adjusted = adjusted OR ? WHERE id = ?",
+            (str(adjustment), adjustment != 0, lot.row_id))
+
+    def unadjusted_lots_between(self, start_date, end_date):
+        """Returns the unadjusted lots purchased from `start_date` to `end_date`.
+
+        Lots are returned in purchase date order, and in FIFO order within a
+        date.
+        """
+        cursor = self._store.execute(
+            f"SELECT {_OPEN_LOT_COLUMNS} FROM open_lots "
+            "WHERE symbol = ? AND adjusted = 0 AND date BETWEEN ? AND ? "
+            "ORDER BY date, lot_index, part",
+            (self.symbol, start_date.toordinal(), end_date.toordinal()))
+        return [self._lot(row) for row in cursor]
+
+    def unadjusted_lots_near(self, date, days):
+        """Returns the unadjusted lots purchased at most `days` from `date`."""
+        delta = dt.timedelta(days=days)
+        return self.unadjusted_lots_between(date - delta, date + delta)
+
+    def _insert(self, lot, part, adjusted):
+        """Inserts a lot and returns its row id."""
+        purchase = lot.purchase
+        return self._store.write(
+            "INSERT INTO open_lots (symbol, lot_index, part, date, is_short_option, name, "
+            "quantity, price, fee, account, adjustment, adjusted) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.symbol, purchase.index, part, purchase.date.toordinal(),
+             purchase.is_short_option, purchase.name, str(purchase.quantity),
+             str(purchase.price), str(purchase.fee), purchase.account,
+             str(lot.adjustment), adjusted)).lastrowid
+
+    def _lot(self, row):
+        lot = _StoredLot(
+            purchase=_transaction(self.symbol, row[1:9]), adjustment=decimal.Decimal(row[9]))
+        lot.row_id = row[0]
+        return lot
+
+
+class StoredClosedLots(object):
+    """The closed lots of one symbol in a LotStore, in the order they were added."""
+
+    def __init__(self, store, symbol):
+        self._store = store
+        self.symbol = symbol
+
+    def __len__(self):
+        return self._store.execute(
+            "SELECT COUNT(*) FROM closed_lots WHERE symbol = ?", (self.symbol,)).fetchone()[0]
+
+    def __iter__(self):
+        cursor = self._store.execute(
+            "SELECT lot_index, date, is_short_option, name, quantity, price, fee, account, "
+            "adjustment, wash_sale, sale_index, sale_date, sale_is_short_option, sale_name, "
+            "sale_quantity, sale_price, sale_fee, sale_account "
+            "FROM closed_lots WHERE symbol = ? ORDER BY id",
+            (self.symbol,))
+        return (self._lot(row) for row in cursor)
+
+    def __iadd__(self, lots):
+        self.extend(lots)
+        return self
+
+    def __repr__(self):
+        return f"StoredClosedLots({self.symbol!r})"
+
+    def append(self, lot):
+        self.extend([lot])
+
+    def extend(self, lots):
+        for lot in lots:
+            self._store.write(
+                "INSERT INTO closed_lots (symbol, lot_index, date, is_short_option, name, "
+                "quantity, price, fee, account, adjustment, wash_sale, sale_index, sale_date, "
+                "sale_is_short_option, sale_name, sale_quantity, sale_price, sale_fee, "
+                "sale_account) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.symbol, *_transaction_columns(lot.purchase), str(lot.adjustment),
+                 str(lot.wash_sale), *_transaction_columns(lot.sale)))
+
+    def _lot(self, row):
+        return Lot(
+            purchase=_transaction(self.symbol, row[:8]),
+            adjustment=decimal.Decimal(row[8]),
+            sale=_transaction(self.symbol, row[10:]),
+            wash_sale=decimal.Decimal(row[9]),
+        )
+
+
+def _transaction_columns(transaction):
+    """Returns the columns of a Transaction, other than its symbol."""
+    return (transaction.index, transaction.date.toordinal(), transaction.is_short_option,
+            transaction.name, str(transaction.quantity), str(transaction.price),
+            str(transaction.fee), transaction.account)
+
+
+def _transaction(symbol, columns):
+    index, date, is_short_option, name, quantity, price, fee, account = columns
+    return Transaction(
+        index, dt.date.fromordinal(date), symbol, bool(is_short_option), name,
+        decimal.Decimal(quantity), decimal.Decimal(price), decimal.Decimal(fee), account)
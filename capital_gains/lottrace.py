@@ -0,0 +1,155 @@
+"""Structured trace of how lots are opened, matched to sales and adjusted.
+
+Tracing is off unless enable() is called; until then the event functions
+return right away, without formatting anything. Each event is an Event:
+
+    event                 lot       sale      quantity            amount
+    lot opened            lot       -         lot quantity        purchase price
+    sale added            -         sale      sale quantity       sale price
+    sale split            -         sale      quantity closed now -
+    lot split             lot       -         quantity kept       -
+    lot closed            lot       sale      closed quantity     gain
+    wash sale adjustment  lot       sale      adjusted quantity   basis adjustment
+    no closable lots      -         sale      unclosed quantity   -
+
+`lot` and `sale` are transaction indices. Splitting keeps indices, so all the
+events of a lot, including those of the lots split from it, share its index;
+lot_events() returns them, to see how a lot got its basis.
+
+Run this module to print the events of a lot from a trace file:
+
+    python lottrace.py <trace file> <lot index>
+"""
+
+import argparse
+import collections
+import json
+import logging
+
+LOT_OPENED = "lot opened"
+SALE_ADDED = "sale added"
+SALE_SPLIT = "sale split"
+LOT_SPLIT = "lot split"
+LOT_CLOSED = "lot closed"
+WASH_SALE_ADJUSTMENT = "wash sale adjustment"
+NO_CLOSABLE_LOTS = "no closable lots"
+
+Event = collections.namedtuple(
+    "Event", ("event", "symbol", "lot", "sale", "quantity", "amount"))
+
+
+class Trace(object):
+    """Keeps events in memory, up to `capacity` of the latest ones if given.
+
+    Events are also written to `out_file` as JSON Lines if given, and logged
+    at debug level if `log`.
+    """
+
+    def __init__(self, capacity=None, out_file=None, log=False):
+        self.events = collections.deque(maxlen=capacity)
+        self.out_file = out_file
+        self.log = log
+
+    def add(self, *fields):
+        event = Event(*fields)
+        self.events.append(event)
+        if self.out_file is not None:
+            self.out_file.write(json.dumps(_event_to_json(event)) + "\n")
+        if self.log:
+            logging.debug("%s", event)
+
+    def extend(self, events):
+        """Adds events recorded elsewhere, e.g. by a worker process."""
+        for event in events:
+            self.add(*event)
+
+
+# The Trace being recorded, or None while disabled
+current = None
+
+
+def enable(capacity=None, out_file=None, log=False):
+    """Starts recording into a new Trace and returns it."""
+    global current
+    current = Trace(capacity, out_file, log)
+    return current
+
+
+def disable():
+    """Stops recording and returns the Trace, if any."""
+    global current
+    recorded, current = current, None
+    return recorded
+
+
+def lot_opened(lot):
+    if current is not None:
+        current.add(LOT_OPENED, lot.symbol, lot.index, None, lot.quantity, lot.purchase.price)
+
+
+def sale_added(sale):
+    if current is not None:
+        current.add(SALE_ADDED, sale.symbol, None, sale.index, sale.quantity, sale.price)
+
+
+def sale_split(sale):
+    """`sale` is the part closed now."""
+    if current is not None:
+        current.add(SALE_SPLIT, sale.symbol, None, sale.index, sale.quantity, None)
+
+
+def lot_split(lot):
+    """`lot` is the part kept for the operation at hand."""
+    if current is not None:
+        current.add(LOT_SPLIT, lot.symbol, lot.index, None, lot.quantity, None)
+
+
+def lot_closed(lot):
+    if current is not None:
+        current.add(LOT_CLOSED, lot.symbol, lot.index, lot.sale.index, lot.quantity, lot.gain)
+
+
+def wash_sale_adjustment(lot, sale):
+    """`lot` was adjusted for a loss on `sale`."""
+    if current is not None:
+        current.add(
+            WASH_SALE_ADJUSTMENT, lot.symbol, lot.index,
+            None if sale is None else sale.index, lot.quantity, lot.adjustment)
+
+
+def no_closable_lots(sale, quantity):
+    if current is not None:
+        current.add(NO_CLOSABLE_LOTS, sale.symbol, None, sale.index, quantity, None)
+
+
+def lot_events(events, index):
+    """Returns the events of the lot with transaction index `index`."""
+    return [event for event in events if event.lot == index]
+
+
+def read(filename):
+    """Returns the events of a trace file."""
+    with open(filename, "r", encoding="utf-8") as in_file:
+        return [Event(**json.loads(line)) for line in in_file]
+
+
+def _event_to_json(event):
+    state = event._asdict()
+    for field in ("quantity", "amount"):
+        if state[field] is not None:
+            state[field] = str(state[field])
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prints the events of a lot")
+    parser.add_argument("filename", metavar="<trace file>")
+    parser.add_argument("index", type=int, metavar="<lot index>")
+    args = parser.parse_args()
+
+    for event in lot_events(read(args.filename), args.index):
+        print(json.dumps(_event_to_json(event)))
+
+
+if __name__ == "__main__":
+    main()
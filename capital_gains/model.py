@@ -1,12 +1,43 @@
 """Defines Transactions and Lots"""
 
 from dataclasses import dataclass
+from dataclasses import field
 from dataclasses import replace
 import datetime
 import decimal
 
 
-@dataclass(frozen=True)
+def prorate(amount, part, whole):
+    """Returns the share of `amount` that corresponds to `part` out of `whole`.
+
+    Decimals are computed as amount * part / whole. Scaled integers (see
+    fixedpoint) are divided exactly and rounded half to even to a whole unit;
+    callers assign the remainder to the other part by subtraction.
+    """
+    if isinstance(amount, int):
+        numerator = amount * part
+        if whole < 0:
+            numerator, whole = -numerator, -whole
+
+        quotient, remainder = divmod(numerator, whole)
+        if 2 * remainder > whole or (2 * remainder == whole and quotient % 2):
+            quotient += 1
+        return quotient
+
+    return amount * part / whole
+
+
+def is_long_term(acquired: datetime.date, sold: datetime.date):
+    """Returns whether a lot was held for more than one year."""
+    try:
+        anniversary = acquired.replace(year=acquired.year + 1)
+    except ValueError:
+        # Acquired on February 29
+        anniversary = datetime.date(acquired.year + 1, 3, 1)
+    return sold > anniversary
+
+
+@dataclass(frozen=True, slots=True)
 class Transaction(object):
     """Represents one transaction."""
 
@@ -18,11 +49,13 @@ class Transaction(object):
     quantity: decimal.Decimal
     price: decimal.Decimal
     fee: decimal.Decimal
+    # Account the transaction was made in, if known
+    account: str = None
 
     def split(self, quantity):
         """Splits the transaction in two."""
         first = replace(self, quantity=quantity,
-                        fee=self.fee * quantity / self.quantity)
+                        fee=prorate(self.fee, quantity, self.quantity))
 
         second = replace(
             self, quantity=self.quantity - first.quantity, fee=self.fee - first.fee
@@ -31,21 +64,49 @@ class Transaction(object):
         return first, second
 
 
+# Assigning any of these invalidates the cached values of a Lot
+_LOT_INPUTS = frozenset(("adjustment", "sale", "wash_sale"))
+
+
 # Mutable! `adjustment`, `sale`, and `wash_sale` are assigned in main logic
-@dataclass
+@dataclass(slots=True)
 class Lot(object):
-    """Represents a taxable lot."""
+    """Represents a taxable lot.
+
+    `cost_basis`, `proceeds` and `gain` are computed on first use and cached
+    until `adjustment`, `sale` or `wash_sale` is assigned.
+    """
 
     purchase: Transaction
     adjustment: decimal.Decimal = decimal.Decimal(0)
     sale: Transaction = None
     wash_sale: decimal.Decimal = decimal.Decimal(0)
 
+    # Caches of the derived values; None when not computed
+    _cost_basis: decimal.Decimal = field(
+        default=None, init=False, repr=False, compare=False)
+    _proceeds: decimal.Decimal = field(
+        default=None, init=False, repr=False, compare=False)
+    _gain: decimal.Decimal = field(
+        default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in _LOT_INPUTS:
+            object.__setattr__(self, "_cost_basis", None)
+            object.__setattr__(self, "_proceeds", None)
+            object.__setattr__(self, "_gain", None)
+
     @property
     def index(self):
         """Returns index."""
         return self.purchase.index
 
+    @property
+    def date(self):
+        """Returns the purchase date."""
+        return self.purchase.date
+
     @property
     def symbol(self):
         """Returns symbol."""
@@ -56,6 +117,11 @@ class Lot(object):
         """Returns the lot's name."""
         return self.purchase.name
 
+    @property
+    def account(self):
+        """Returns the account the lot was bought in."""
+        return self.purchase.account
+
     @property
     def quantity(self):
         """Returns the number of securities transacted."""
@@ -64,41 +130,54 @@ class Lot(object):
     @property
     def cost_basis(self):
         """Returns the cost basis."""
+        if self._cost_basis is not None:
+            return self._cost_basis
+
         if self.purchase.is_short_option:
             c = self.quantity * self.sale.price + self.sale.fee  # adjustent??
         else:
             c = self.quantity * self.purchase.price + self.purchase.fee + self.adjustment
 
+        object.__setattr__(self, "_cost_basis", c)
         return c
 
     @property
     def proceeds(self):
         """Returns the proceeds from the sale."""
+        if self._proceeds is not None:
+            return self._proceeds
         if self.sale is None:
             return None
         if self.purchase.is_short_option:
             p = self.quantity * self.purchase.price - self.purchase.fee + self.adjustment
         else:
             p = self.quantity * self.sale.price - self.sale.fee
+
+        object.__setattr__(self, "_proceeds", p)
         return p
 
     @property
     def gain(self):
         """Returns the gain"""
+        if self._gain is not None:
+            return self._gain
         if self.proceeds is None:
             return None
 
-        return self.proceeds - self.cost_basis + self.wash_sale
+        g = self.proceeds - self.cost_basis + self.wash_sale
+
+        object.__setattr__(self, "_gain", g)
+        return g
 
     def split(self, quantity):
         """Splits the Lot into two Lots."""
         first_purchase, second_purchase = self.purchase.split(quantity)
 
-        first_lot = Lot(
-            purchase=first_purchase, adjustment=self.adjustment * quantity / self.quantity
+        first_lot = type(self)(
+            purchase=first_purchase, adjustment=prorate(self.adjustment, quantity, self.quantity)
         )
 
-        second_lot = Lot(
+        second_lot = type(self)(
             purchase=second_purchase, adjustment=self.adjustment - first_lot.adjustment
         )
 
@@ -0,0 +1,107 @@
+"""Parses securities and groups the substantially identical ones for wash sales.
+
+Option symbols are like ETrade's, e.g. "Z OCT 29 '21 $80 PUT"; any other
+symbol is a stock (or fund) ticker. Parsing is cached per distinct symbol.
+"""
+
+import datetime as dt
+import decimal
+import functools
+import re
+from dataclasses import dataclass
+
+from const import SHARES_PER_CONTRACT
+
+_OPTION_RE = re.compile(
+    r"(?P<underlying>\S+)\s+(?P<month>[A-Za-z]{3})\s+(?P<day>\d{1,2})\s+'(?P<year>\d{2})"
+    r"\s+\$(?P<strike>[\d.]+)\s+(?P<kind>call|put)",
+    re.IGNORECASE)
+
+
+@dataclass(frozen=True, slots=True)
+class Security(object):
+    """A stock, or an option contract on one."""
+
+    symbol: str
+    underlying: str
+    # Contract terms; None for stocks
+    expiration: dt.date = None
+    strike: decimal.Decimal = None
+    # "call" or "put"
+    kind: str = None
+
+    @property
+    def is_option(self):
+        return self.kind is not None
+
+    @property
+    def shares(self):
+        """Returns the number of shares of the underlying that one unit stands for."""
+        return SHARES_PER_CONTRACT if self.is_option else 1
+
+
+@functools.lru_cache(maxsize=None)
+def parse_security(symbol: str):
+    """Returns the Security of a symbol."""
+    match = _OPTION_RE.fullmatch(symbol.strip())
+    if match is None:
+        return Security(symbol, symbol)
+
+    try:
+        expiration = dt.datetime.strptime(
+            f"{match['month']} {match['day']} {match['year']}", "%b %d %y").date()
+    except ValueError:
+        return Security(symbol, symbol)
+
+    return Security(
+        symbol,
+        match["underlying"],
+        expiration,
+        decimal.Decimal(match["strike"]),
+        match["kind"].lower(),
+    )
+
+
+class Groups(object):
+    """Groups of substantially identical symbols, whose wash sales match across them.
+
+    `identical` lists sets of tickers to treat as identical, e.g. funds that
+    track the same index. With `options`, options are identical to their
+    underlying, and so to its whole set; otherwise each contract is its own
+    group.
+    """
+
+    def __init__(self, identical=(), options=False):
+        self.options = options
+        # ticker -> the ticker that names its group
+        self._canonical = {}
+        for tickers in identical:
+            tickers = list(tickers)
+            # Join sets that share a ticker
+            names = {self._canonical.get(ticker, ticker) for ticker in tickers}
+            name = min(names)
+            for ticker, canonical in list(self._canonical.items()):
+                if canonical in names:
+                    self._canonical[ticker] = name
+            for ticker in tickers:
+                self._canonical[ticker] = name
+        self._groups = {}
+
+    def group(self, symbol):
+        """Returns the name of the group of a symbol."""
+        group = self._groups.get(symbol)
+        if group is None:
+            security = parse_security(symbol)
+            if security.is_option and not self.options:
+                group = symbol
+            else:
+                group = self._canonical.get(security.underlying, security.underlying)
+            self._groups[symbol] = group
+        return group
+
+    def by_group(self, symbols):
+        """Returns the symbols by group, both in the order of `symbols`."""
+        groups = {}
+        for symbol in symbols:
+            groups.setdefault(self.group(symbol), []).append(symbol)
+        return groups
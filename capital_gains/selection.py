@@ -0,0 +1,225 @@
+"""Lot selection strategies: which open lot a sale closes next.
+
+FIFO is the order of the LotBook itself. The other strategies keep heaps over
+the lots of a book, which the book creates on first use and updates as lots
+are appended, removed, split and adjusted, so a sale never sorts the lots:
+
+- lifo: newest lot first
+- hifo: highest cost basis per share first
+- min-tax: the lot whose sale owes the least tax per share, comparing the
+  highest-basis short-term lot with the highest-basis long-term lot
+
+A sale with a name always closes the lots with that name, oldest first
+(specific identification).
+
+Heaps are lazy: removed and changed lots are only dropped from a heap when
+they reach its top, or when stale entries outnumber live ones and the heaps
+are rebuilt, so the heaps stay proportional to the open lots. A lot is only
+selectable once it is older than the sale; lots wait in a heap by index until
+then. Sales must be selected for in processing order.
+
+Ties, e.g. between the parts of a split lot, are broken by position in the
+book, so the same book selects the same lot however long its heaps have
+existed.
+"""
+
+import abc
+import fractions
+import heapq
+import itertools
+
+from model import is_long_term
+
+STRATEGIES = ("fifo", "lifo", "hifo", "min-tax")
+
+# Stale heap entries tolerated regardless of the number of lots, so small
+# books aren't rebuilt on every removal
+MIN_STALE_ENTRIES = 64
+
+# Tax rates that min-tax weighs short- and long-term gains and losses with
+SHORT_TERM_TAX_RATE = fractions.Fraction(37, 100)
+LONG_TERM_TAX_RATE = fractions.Fraction(20, 100)
+
+
+def basis_per_share(lot):
+    """Returns the exact cost basis per share of an open lot, adjustment included."""
+    purchase = lot.purchase
+    return (fractions.Fraction(purchase.quantity * purchase.price + purchase.fee + lot.adjustment)
+            / fractions.Fraction(purchase.quantity))
+
+
+class HeapSelection(abc.ABC):
+    """Base class: selects the lot with the lowest `key` among the selectable lots.
+
+    Lots must be added in book order.
+    """
+
+    # Most heap entries a live lot can have at once
+    ENTRIES_PER_LOT = 1
+
+    def __init__(self, lots=()):
+        # Lots not selectable yet, by index: (index, position, seq, lot)
+        self._waiting = []
+        # Selectable lots: (key, index, position, seq, lot)
+        self._selectable = []
+        # id(lot) -> seq of its current heap entries; other entries are stale
+        self._live = {}
+        self._seqs = itertools.count()
+        # id(lot) -> its position among the lots of its index, in book order:
+        # (n,) for the nth lot added, and the position of a split lot
+        # extended with 0 for its first part and 1 for its second
+        self._positions = {}
+        # index -> number of lots added with it
+        self._added = {}
+
+        for lot in lots:
+            self.add(lot)
+
+    def add(self, lot):
+        """Adds a lot after the others in the book."""
+        count = self._added.get(lot.index, 0)
+        self._added[lot.index] = count + 1
+        self._push(lot, (count,))
+
+    def remove(self, lot):
+        del self._live[id(lot)]
+        del self._positions[id(lot)]
+        heaps = self._heaps()
+        entries = sum(len(heap) for heap in heaps)
+        if entries > 2 * self.ENTRIES_PER_LOT * len(self._live) + MIN_STALE_ENTRIES:
+            self._compact(heaps)
+
+    def split(self, lot, first_lot, second_lot):
+        """Replaces a lot with its two parts, in its position."""
+        position = self._positions[id(lot)]
+        self.remove(lot)
+        self._push(first_lot, position + (0,))
+        self._push(second_lot, position + (1,))
+
+    def update(self, lot):
+        """Re-indexes a lot whose adjustment changed."""
+        position = self._positions[id(lot)]
+        self.remove(lot)
+        self._push(lot, position)
+
+    def select(self, sale):
+        """Returns the lot for `sale` to close next, or None."""
+        waiting = self._waiting
+        while waiting and waiting[0][0] < sale.index:
+            _, _, seq, lot = heapq.heappop(waiting)
+            if self._is_live(lot, seq):
+                self._make_selectable(lot, seq, sale)
+        return self._best(sale)
+
+    @abc.abstractmethod
+    def key(self, lot):
+        """Returns the sort key of a selectable lot; the lowest is selected first."""
+
+    def _heaps(self):
+        """Returns the heaps, whose entries all end with (seq, lot)."""
+        return [self._waiting, self._selectable]
+
+    def _compact(self, heaps):
+        """Drops the stale entries of every heap."""
+        for heap in heaps:
+            heap[:] = [entry for entry in heap if self._is_live(entry[-1], entry[-2])]
+            heapq.heapify(heap)
+
+    def _push(self, lot, position):
+        seq = next(self._seqs)
+        self._live[id(lot)] = seq
+        self._positions[id(lot)] = position
+        heapq.heappush(self._waiting, (lot.index, position, seq, lot))
+
+    def _make_selectable(self, lot, seq, sale):
+        heapq.heappush(
+            self._selectable, (self.key(lot), lot.index, self._positions[id(lot)], seq, lot))
+
+    def _best(self, sale):
+        return self._top(self._selectable)
+
+    def _top(self, heap):
+        """Drops stale entries from the top of `heap` and returns its lot, or None."""
+        while heap and not self._is_live(heap[0][-1], heap[0][-2]):
+            heapq.heappop(heap)
+        return heap[0][-1] if heap else None
+
+    def _is_live(self, lot, seq):
+        return self._live.get(id(lot)) == seq
+
+
+class LifoSelection(HeapSelection):
+    """Newest lot first."""
+
+    def key(self, lot):
+        return -lot.index
+
+
+class HifoSelection(HeapSelection):
+    """Highest cost basis per share first."""
+
+    def key(self, lot):
+        return -basis_per_share(lot)
+
+
+class MinTaxSelection(HeapSelection):
+    """Lowest tax per share first, weighing gains by holding period.
+
+    Within a holding period the highest basis owes the least, so short- and
+    long-term lots each have a heap by basis, and the two tops are compared.
+    Short-term lots are also kept by purchase date, to move them to the
+    long-term heap once sales are more than a year after their purchase.
+    """
+
+    # A short-term lot is in the selectable heap and in the heap by date
+    ENTRIES_PER_LOT = 2
+
+    def __init__(self, lots=()):
+        # Short-term lots by purchase date: (date, index, position, seq, lot)
+        self._short_term_by_date = []
+        self._long_term = []
+        super().__init__(lots)
+
+    def key(self, lot):
+        return -basis_per_share(lot)
+
+    def _heaps(self):
+        return super()._heaps() + [self._short_term_by_date, self._long_term]
+
+    def _make_selectable(self, lot, seq, sale):
+        position = self._positions[id(lot)]
+        if is_long_term(lot.purchase.date, sale.date):
+            heapq.heappush(self._long_term, (self.key(lot), lot.index, position, seq, lot))
+        else:
+            super()._make_selectable(lot, seq, sale)
+            heapq.heappush(
+                self._short_term_by_date, (lot.purchase.date, lot.index, position, seq, lot))
+
+    def _best(self, sale):
+        by_date = self._short_term_by_date
+        while by_date and is_long_term(by_date[0][0], sale.date):
+            _, _, _, seq, lot = heapq.heappop(by_date)
+            if self._is_live(lot, seq):
+                # Give the lot a new entry so its short-term one goes stale
+                seq = self._live[id(lot)] = next(self._seqs)
+                self._make_selectable(lot, seq, sale)
+
+        short_term_lot = self._top(self._selectable)
+        long_term_lot = self._top(self._long_term)
+        if short_term_lot is None or long_term_lot is None:
+            return short_term_lot or long_term_lot
+
+        price = fractions.Fraction(sale.price)
+        short_term_tax = SHORT_TERM_TAX_RATE * (price - basis_per_share(short_term_lot))
+        long_term_tax = LONG_TERM_TAX_RATE * (price - basis_per_share(long_term_lot))
+        if ((long_term_tax, long_term_lot.index, self._positions[id(long_term_lot)])
+                < (short_term_tax, short_term_lot.index, self._positions[id(short_term_lot)])):
+            return long_term_lot
+        return short_term_lot
+
+
+SELECTIONS = {
+    "lifo": LifoSelection,
+    "hifo": HifoSelection,
+    "min-tax": MinTaxSelection,
+}
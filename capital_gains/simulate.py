@@ -0,0 +1,301 @@
+"""What-if analysis: the results of hypothetical sales on top of processed lots.
+
+Each scenario is processed with logic.process_sales on a CopyOnWriteBook of the
+open lots of its symbol. A scenario only copies the lots its sale closes,
+splits or adjusts; every scenario shares all other lots, which are never
+changed. Scenarios are independent of each other, so they can be run in
+parallel and ranked, e.g. by how much loss selling would harvest.
+
+    python capital_gains/simulate.py --sell X 10 95 --sell Y 5 40 history.csv
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import datetime as dt
+import decimal
+import io
+import sys
+from dataclasses import dataclass, field
+
+import formatter
+import loader
+import logic
+import lottrace
+import stats
+from lotbook import CopyOnWriteBook, LotBook
+from model import Transaction
+
+
+@dataclass(frozen=True)
+class Scenario(object):
+    """A hypothetical sale."""
+
+    symbol: str
+    quantity: decimal.Decimal
+    price: decimal.Decimal
+    date: dt.date = field(default_factory=dt.date.today)
+    fee: decimal.Decimal = decimal.Decimal(0)
+    # Only close lots of this name, like ETrade's named lots
+    name: str = None
+    # Account of the sale; by default, that of the symbol's oldest open lot
+    account: str = None
+
+
+@dataclass
+class Result(object):
+    """What a scenario's sale would do."""
+
+    scenario: Scenario
+    closed_lots: list
+    # Lots whose cost basis the sale's wash sales would adjust and leave open,
+    # as adjusted
+    replacement_lots: list
+    # Shares with no open lot to close
+    unmatched_quantity: decimal.Decimal
+
+    @property
+    def realized_gain(self):
+        """Returns the gain of the closed lots, net of the loss that wash sales disallow."""
+        return sum((lot.gain for lot in self.closed_lots), decimal.Decimal(0))
+
+    @property
+    def disallowed_loss(self):
+        """Returns the loss disallowed by wash sales, deferred to the replacement lots' basis."""
+        return sum((lot.adjustment for lot in self.replacement_lots), decimal.Decimal(0))
+
+
+class Simulator(object):
+    """Runs scenarios on `open_lots`, a dictionary of LotBooks keyed by symbol.
+
+    The books must not change while scenarios run. Sales are numbered from
+    `next_index`, which must be higher than the index of any lot; by default
+    it is one more than the highest.
+    """
+
+    def __init__(self, open_lots, wash_sales=True, next_index=None):
+        self.open_lots = open_lots
+        self.wash_sales = wash_sales
+        if next_index is None:
+            next_index = 1 + max(
+                (lot.index for lots in open_lots.values() for lot in lots), default=-1)
+        self.next_index = next_index
+
+    def run(self, scenario):
+        """Returns the Result of a scenario."""
+        base = self.open_lots.get(scenario.symbol) or LotBook()
+        account = scenario.account
+        if account is None:
+            # Sales only close lots of their account
+            account = next((lot.account for lot in base), None)
+        book = CopyOnWriteBook(base)
+        sale = Transaction(
+            self.next_index, scenario.date, scenario.symbol, False, scenario.name,
+            scenario.quantity, scenario.price, scenario.fee, account)
+
+        # Hypothetical sales aren't part of the run's trace or stats
+        previous_trace, previous_stats = lottrace.disable(), stats.disable()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                closed_lots = logic.process_sales(book, [sale], self.wash_sales)
+        finally:
+            lottrace.current, stats.current = previous_trace, previous_stats
+
+        return Result(
+            scenario, closed_lots, book.open_adjusted_lots(),
+            scenario.quantity - sum(lot.quantity for lot in closed_lots))
+
+    def run_all(self, scenarios, jobs=1):
+        """Returns the Results of scenarios, in order.
+
+        With `jobs` > 1 they are run in a pool of worker processes, each of
+        which gets a copy of the open lots once.
+        """
+        if jobs <= 1:
+            return [self.run(scenario) for scenario in scenarios]
+
+        scenarios = list(scenarios)
+        with concurrent.futures.ProcessPoolExecutor(
+                jobs, initializer=_init_worker, initargs=(self,)) as executor:
+            return list(executor.map(
+                _run, scenarios, chunksize=max(1, len(scenarios) // (4 * jobs))))
+
+    def rank(self, scenarios, jobs=1, key=None):
+        """Returns the Results of scenarios, from the lowest realized gain, or by `key`."""
+        return sorted(
+            self.run_all(scenarios, jobs),
+            key=key or (lambda result: result.realized_gain))
+
+
+# The Simulator of a worker process
+_simulator = None
+
+
+def _init_worker(simulator):
+    global _simulator
+    _simulator = simulator
+
+
+def _run(scenario):
+    return _simulator.run(scenario)
+
+
+def read_scenarios(filename, date=None):
+    """Reads scenarios from a csv file with columns symbol, quantity and price.
+
+    Optional columns are date (YYYY-MM-DD, `date` or today by default), fee,
+    name and account.
+    """
+    date = date or dt.date.today()
+    with open(filename, "r", encoding="utf-8", newline="") as in_file:
+        return [
+            Scenario(
+                symbol=row["symbol"],
+                quantity=decimal.Decimal(row["quantity"]),
+                price=decimal.Decimal(row["price"]),
+                date=dt.date.fromisoformat(row["date"]) if row.get("date") else date,
+                fee=decimal.Decimal(row.get("fee") or 0),
+                name=row.get("name") or None,
+                account=row.get("account") or None,
+            )
+            for row in csv.DictReader(in_file)
+        ]
+
+
+def format_results(results, decimal_places, shares_decimal_places):
+    """Returns a table of results, one row per scenario."""
+    def money(value):
+        return formatter.format_decimal(value, decimal_places)
+
+    def shares(value):
+        return formatter.format_decimal(value, shares_decimal_places)
+
+    table = [["symbol", "quantity", "price", "date", "realized gain", "wash sale",
+              "replacement lots", "unmatched"]]
+    for result in results:
+        scenario = result.scenario
+        # A replacement lot split after its adjustment is listed once
+        replacement_indexes = sorted({lot.index for lot in result.replacement_lots})
+        table.append([
+            scenario.symbol,
+            shares(scenario.quantity),
+            money(scenario.price),
+            scenario.date.isoformat(),
+            money(result.realized_gain),
+            money(result.disallowed_loss),
+            " ".join(str(index) for index in replacement_indexes) or "-",
+            shares(result.unmatched_quantity),
+        ])
+    return formatter.format_table(table)
+
+
+def get_parser():
+    """Returns an argparser."""
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [<options>] (--sell <symbol> <quantity> <price> | --scenarios <file>)... "
+        "[--] <input file>...",
+        description="Ranks hypothetical sales by realized gain, lowest first",
+    )
+    parser.add_argument(
+        "filenames", type=str, nargs="+", help=argparse.SUPPRESS, metavar="<input file>"
+    )
+    parser.add_argument(
+        "--sell",
+        dest="sales",
+        nargs=3,
+        action="append",
+        default=[],
+        help="a hypothetical sale",
+        metavar=("<symbol>", "<quantity>", "<price>"),
+    )
+    parser.add_argument(
+        "--scenarios",
+        dest="scenarios",
+        type=str,
+        help="read hypothetical sales from the csv file %(metavar)s, with columns symbol, "
+        "quantity, price and optionally date, fee, name and account",
+        metavar="<file>",
+    )
+    parser.add_argument(
+        "--date",
+        dest="date",
+        type=dt.date.fromisoformat,
+        default=dt.date.today(),
+        help="date of the sales, unless given in --scenarios (default: today)",
+        metavar="<date>",
+    )
+    parser.add_argument(
+        "--account",
+        dest="account",
+        type=str,
+        help="account of the --sell sales (default: the account of the symbol's oldest open lot)",
+        metavar="<account>",
+    )
+    parser.add_argument(
+        "-d",
+        "--decimal-places",
+        dest="decimal_places",
+        type=int,
+        default=0,
+        help="round $ to %(metavar)s decimal places (default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "-s",
+        "--shares-decimal-places",
+        dest="shares_decimal_places",
+        type=int,
+        default=0,
+        help="round shares to %(metavar)s decimal places (default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="run scenarios in parallel with %(metavar)s worker processes (default: %(default)s)",
+        metavar="<n>",
+    )
+    parser.add_argument(
+        "-w",
+        "--wash-sales",
+        dest="wash_sales",
+        action=argparse.BooleanOptionalAction,
+        help="identify wash sales and adjust cost basis",
+        default=True,
+    )
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    try:
+        scenarios = [
+            Scenario(symbol, decimal.Decimal(quantity), decimal.Decimal(price), args.date,
+                     account=args.account)
+            for symbol, quantity, price in args.sales
+        ]
+    except decimal.InvalidOperation:
+        parser.error("--sell takes a symbol, a quantity and a price")
+    if args.scenarios:
+        scenarios += read_scenarios(args.scenarios, args.date)
+    if not scenarios:
+        parser.error("no scenarios: use --sell or --scenarios")
+
+    # Processing the history prints what it can't match; keep that apart
+    with contextlib.redirect_stdout(sys.stderr):
+        open_lots, sales = loader.load_transactions(args.filenames)
+        logic.process_all_sales(open_lots, sales, args.wash_sales)
+
+    simulator = Simulator(open_lots, args.wash_sales)
+    results = simulator.rank(scenarios, args.jobs)
+    print(format_results(results, args.decimal_places, args.shares_decimal_places))
+
+
+if __name__ == "__main__":
+    main()
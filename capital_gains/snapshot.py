@@ -0,0 +1,98 @@
+"""Saves and restores the state of an IncrementalProcessor at a cutoff date.
+
+A snapshot holds the open lots, including their wash sale adjustments, and the
+sales that are still pending because lots bought up to WASHSALE_PERIOD days
+after them (so after the cutoff) could still make them wash sales. Resuming
+from a snapshot and processing the transactions after the cutoff gives the same
+results as processing the whole history.
+"""
+
+import datetime as dt
+import decimal
+import json
+import os
+
+from logic import IncrementalProcessor
+from model import Lot, Transaction
+
+SNAPSHOT_VERSION = 1
+
+
+def save(filename: str, processor: IncrementalProcessor, cutoff: dt.date):
+    """Writes the state of `processor`, which has seen everything up to `cutoff`."""
+    state = {
+        "version": SNAPSHOT_VERSION,
+        "cutoff": cutoff.isoformat(),
+        "next_index": processor.next_index,
+        "open_lots": [
+            {"purchase": _transaction_to_json(lot.purchase),
+             "adjustment": str(lot.adjustment)}
+            for lots in processor.open_lots.values()
+            for lot in lots
+        ],
+        "pending_sales": [_transaction_to_json(sale) for sale in processor.pending_sales],
+    }
+
+    # Write atomically, so a crash never leaves a partial snapshot behind
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "w", encoding="utf-8") as out_file:
+        json.dump(state, out_file, indent=1)
+    os.replace(temp_filename, filename)
+
+
+def load(filename: str, wash_sales: bool, store=None, lot_selection: str = "fifo"):
+    """Returns an IncrementalProcessor restored from a snapshot, and its cutoff.
+
+    The processor keeps its lots in `store`, if given, and selects them with
+    `lot_selection`; see IncrementalProcessor.
+    """
+    with open(filename, "r", encoding="utf-8") as in_file:
+        state = json.load(in_file)
+
+    if state.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(
+            f"{filename}: unsupported snapshot version {state.get('version')}")
+
+    processor = IncrementalProcessor(wash_sales, store, lot_selection)
+    processor.next_index = state["next_index"]
+
+    for lot_state in state["open_lots"]:
+        lot = Lot(
+            purchase=_transaction_from_json(lot_state["purchase"]),
+            adjustment=decimal.Decimal(lot_state["adjustment"]),
+        )
+        # Lots were saved in book order, so this keeps each book's order
+        processor.open_lots[lot.symbol].append(lot)
+
+    processor.pending_sales.extend(
+        _transaction_from_json(sale) for sale in state["pending_sales"])
+
+    return processor, dt.date.fromisoformat(state["cutoff"])
+
+
+def _transaction_to_json(transaction: Transaction):
+    return {
+        "index": transaction.index,
+        "date": transaction.date.isoformat(),
+        "symbol": transaction.symbol,
+        "is_short_option": transaction.is_short_option,
+        "name": transaction.name,
+        "quantity": str(transaction.quantity),
+        "price": str(transaction.price),
+        "fee": str(transaction.fee),
+        "account": transaction.account,
+    }
+
+
+def _transaction_from_json(state: dict):
+    return Transaction(
+        index=state["index"],
+        date=dt.date.fromisoformat(state["date"]),
+        symbol=state["symbol"],
+        is_short_option=state["is_short_option"],
+        name=state["name"],
+        quantity=decimal.Decimal(state["quantity"]),
+        price=decimal.Decimal(state["price"]),
+        fee=decimal.Decimal(state["fee"]),
+        account=state.get("account"),
+    )
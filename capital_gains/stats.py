@@ -0,0 +1,132 @@
+"""Wall time per stage and counters per symbol, collected for --stats.
+
+Collection is off unless enable() is called; until then timer() and count()
+do nothing.
+
+Times merged from worker processes are kept apart from the wall time of this
+process: they are summed over the workers, which run at the same time, so
+they add up processing time rather than elapsed time.
+"""
+
+import collections
+import time
+
+import formatter
+
+STAGES = ("parse", "sort", "lot matching", "wash sale adjustment", "formatting")
+
+COUNTERS = (
+    "sales",
+    "sales split",
+    "lots split",
+    "candidates scanned",
+    "wash sale adjustments",
+)
+
+
+class Stats(object):
+    """Seconds spent per stage, and counters by symbol."""
+
+    def __init__(self):
+        self.times = collections.defaultdict(float)
+        # Seconds spent per stage in worker processes, summed over the workers
+        self.worker_times = collections.defaultdict(float)
+        self.counters = collections.defaultdict(collections.Counter)
+
+    def merge(self, other):
+        """Adds the times and counters of a worker's Stats.
+
+        Its times are added to `worker_times`, not to `times`.
+        """
+        for times in (other.times, other.worker_times):
+            for stage, seconds in times.items():
+                self.worker_times[stage] += seconds
+        for symbol, counters in other.counters.items():
+            self.counters[symbol].update(counters)
+
+    def format(self):
+        """Returns the stats as text tables."""
+        if self.worker_times:
+            table = [['stage', 'seconds', 'worker seconds (summed)']]
+            for stage in STAGES:
+                table.append(
+                    [stage, f'{self.times[stage]:.3f}', f'{self.worker_times[stage]:.3f}'])
+            output = (f'# Stages\n\n{formatter.format_table(table)}\n\n'
+                      'Worker seconds are summed over worker processes running in parallel, so '
+                      'they can exceed the elapsed time.')
+        else:
+            table = [['stage', 'seconds']]
+            for stage in STAGES:
+                table.append([stage, f'{self.times[stage]:.3f}'])
+            output = f'# Stages\n\n{formatter.format_table(table)}'
+
+        table = [['symbol', *COUNTERS]]
+        totals = collections.Counter()
+        for symbol, counters in self.counters.items():
+            table.append([symbol, *(str(counters[counter]) for counter in COUNTERS)])
+            totals.update(counters)
+        table.append(['total', *(str(totals[counter]) for counter in COUNTERS)])
+        output += f'\n\n# Counters\n\n{formatter.format_table(table)}'
+
+        return output
+
+
+class _Timer(object):
+    """Adds the time spent in a with block to a stage."""
+
+    __slots__ = ("stats", "stage", "start")
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stats.times[self.stage] += time.perf_counter() - self.start
+
+
+class _NullTimer(object):
+    """Timer used while stats are disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+# The Stats being collected, or None while disabled
+current = None
+
+
+def enable():
+    """Starts collecting into a new Stats and returns it."""
+    global current
+    current = Stats()
+    return current
+
+
+def disable():
+    """Stops collecting and returns what was collected, if anything."""
+    global current
+    collected, current = current, None
+    return collected
+
+
+def timer(stage):
+    """Returns a context manager that times its block as part of `stage`."""
+    if current is None:
+        return _NULL_TIMER
+    return _Timer(current, stage)
+
+
+def count(symbol, counter, n=1):
+    """Adds `n` to a counter of a symbol."""
+    if current is not None:
+        current.counters[symbol][counter] += n
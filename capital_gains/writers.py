@@ -0,0 +1,253 @@
+"""Writers that output closed and open lots in several formats.
+
+Writers take lots one at a time and, except for the aligned text tables, write
+each one right away, so output doesn't have to be held in memory.
+"""
+
+import collections
+import csv
+import json
+
+import formatter
+from model import is_long_term
+
+
+class Writer(object):
+    """Base class: writes lots to `out_file`, rounding as requested."""
+
+    # Whether lots are written as they come, so callers don't need to keep them
+    streaming = True
+
+    def __init__(self, out_file, decimal_places, shares_decimal_places, totals):
+        self.out_file = out_file
+        self.decimal_places = decimal_places
+        self.shares_decimal_places = shares_decimal_places
+        self.totals = totals
+
+    def write_closed_lot(self, lot):
+        pass
+
+    def write_open_lot(self, lot):
+        pass
+
+    def write_results(self, closed_lots, open_lots):
+        """Writes all closed lots, then all open lots, both keyed by symbol."""
+        for lots in closed_lots.values():
+            for lot in lots:
+                self.write_closed_lot(lot)
+        for lots in open_lots.values():
+            for lot in lots:
+                self.write_open_lot(lot)
+
+    def close(self):
+        """Writes anything still buffered; doesn't close `out_file`."""
+        pass
+
+    def money(self, value):
+        """Returns a $ amount rounded as requested."""
+        return formatter.format_decimal(value, self.decimal_places)
+
+    def shares(self, value):
+        """Returns a number of shares rounded as requested."""
+        return formatter.format_decimal(value, self.shares_decimal_places)
+
+    def _cost_basis(self, lot):
+        # Open short options have no cost basis until they are closed
+        if lot.sale is None and lot.purchase.is_short_option:
+            return ''
+        return self.money(lot.cost_basis)
+
+
+class TextWriter(Writer):
+    """Aligned text tables, as made by formatter.format.
+
+    Column widths depend on every row, so lots are buffered until close().
+    """
+
+    streaming = False
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._closed_lots = collections.defaultdict(list)
+        self._open_lots = collections.defaultdict(list)
+
+    def write_closed_lot(self, lot):
+        self._closed_lots[lot.symbol].append(lot)
+
+    def write_open_lot(self, lot):
+        self._open_lots[lot.symbol].append(lot)
+
+    def write_results(self, closed_lots, open_lots):
+        self._closed_lots = closed_lots
+        self._open_lots = open_lots
+
+    def close(self):
+        output = formatter.format(
+            self._closed_lots,
+            self._open_lots,
+            self.decimal_places,
+            self.shares_decimal_places,
+            self.totals,
+        )
+        self.out_file.write(f'{output}\n')
+
+
+class CsvWriter(Writer):
+    """One csv row per lot; open lots have no sale columns."""
+
+    HEADER = ['status', 'index', 'account', 'symbol', 'name', 'quantity', 'acquired',
+              'sold', 'proceeds', 'cost basis', 'adjustment', 'wash sale', 'gain']
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._writer = csv.writer(self.out_file)
+        self._writer.writerow(self.HEADER)
+
+    def write_closed_lot(self, lot):
+        self._writer.writerow([
+            'closed',
+            lot.index,
+            lot.purchase.account or '',
+            lot.symbol,
+            lot.name or '',
+            self.shares(lot.quantity),
+            lot.purchase.date.isoformat(),
+            lot.sale.date.isoformat(),
+            self.money(lot.proceeds),
+            self.money(lot.cost_basis),
+            self.money(lot.adjustment),
+            self.money(lot.wash_sale),
+            self.money(lot.gain)])
+
+    def write_open_lot(self, lot):
+        self._writer.writerow([
+            'open',
+            lot.index,
+            lot.purchase.account or '',
+            lot.symbol,
+            lot.name or '',
+            self.shares(lot.quantity),
+            lot.purchase.date.isoformat(),
+            '',
+            '',
+            self._cost_basis(lot),
+            self.money(lot.adjustment),
+            '',
+            ''])
+
+
+class JsonlWriter(Writer):
+    """One JSON object per line and lot. Amounts are strings, to keep them exact."""
+
+    def write_closed_lot(self, lot):
+        self._write(self.closed_lot_record(lot))
+
+    def write_open_lot(self, lot):
+        self._write(self.open_lot_record(lot))
+
+    def closed_lot_record(self, lot):
+        return {
+            'status': 'closed',
+            'index': lot.index,
+            'account': lot.purchase.account,
+            'symbol': lot.symbol,
+            'name': lot.name,
+            'quantity': self.shares(lot.quantity),
+            'acquired': lot.purchase.date.isoformat(),
+            'sold': lot.sale.date.isoformat(),
+            'proceeds': self.money(lot.proceeds),
+            'cost_basis': self.money(lot.cost_basis),
+            'adjustment': self.money(lot.adjustment),
+            'wash_sale': self.money(lot.wash_sale),
+            'gain': self.money(lot.gain),
+        }
+
+    def open_lot_record(self, lot):
+        return {
+            'status': 'open',
+            'index': lot.index,
+            'account': lot.purchase.account,
+            'symbol': lot.symbol,
+            'name': lot.name,
+            'quantity': self.shares(lot.quantity),
+            'acquired': lot.purchase.date.isoformat(),
+            'cost_basis': self._cost_basis(lot) or None,
+            'adjustment': self.money(lot.adjustment),
+        }
+
+    def _write(self, record):
+        self.out_file.write(json.dumps(record) + '\n')
+
+
+class Form8949Writer(Writer):
+    """Rows for IRS form 8949, columns (a) through (h); closed lots only.
+
+    `term` tells whether the row goes in part I (short-term) or part II
+    (long-term). Holding periods don't include those of wash sale lots.
+    """
+
+    HEADER = ['term', 'description', 'date acquired', 'date sold', 'proceeds',
+              'cost basis', 'code', 'adjustment', 'gain or loss']
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._writer = csv.writer(self.out_file)
+        self._writer.writerow(self.HEADER)
+
+    def write_closed_lot(self, lot):
+        self._writer.writerow([
+            'long' if is_long_term(lot.purchase.date, lot.sale.date) else 'short',
+            f'{self.shares(lot.quantity)} {lot.symbol}',
+            lot.purchase.date.strftime('%m/%d/%Y'),
+            lot.sale.date.strftime('%m/%d/%Y'),
+            self.money(lot.proceeds),
+            self.money(lot.cost_basis),
+            'W' if lot.wash_sale else '',
+            self.money(lot.wash_sale) if lot.wash_sale else '',
+            self.money(lot.gain)])
+
+
+class YearlyWriter(object):
+    """Writes the closed lots of each year to their own file, one year at a time.
+
+    Files are named by `pattern`, with `{year}` replaced by the year of sale,
+    and written by a `writer_class` Writer. Lots must come in sale date order;
+    a year's file is finished when a later year's lot comes, or by finish().
+    """
+
+    def __init__(self, pattern, writer_class, decimal_places, shares_decimal_places, totals):
+        self.pattern = pattern
+        self.writer_class = writer_class
+        self.decimal_places = decimal_places
+        self.shares_decimal_places = shares_decimal_places
+        self.totals = totals
+        # Year being written, or None
+        self.year = None
+        self._file = None
+        self._writer = None
+
+    def write_closed_lot(self, lot):
+        year = lot.sale.date.year
+        if year != self.year:
+            self.finish()
+            self.year = year
+            self._file = open(self.pattern.format(year=year), 'w', encoding='utf-8', newline='')
+            self._writer = self.writer_class(
+                self._file, self.decimal_places, self.shares_decimal_places, self.totals)
+        self._writer.write_closed_lot(lot)
+
+    def finish(self):
+        """Finishes and closes the file of the year being written, if any."""
+        if self.year is None:
+            return
+        self._writer.close()
+        self._file.close()
+        self.year = self._file = self._writer = None
+
+
+WRITERS = {
+    'text': TextWriter,
+    'csv': CsvWriter,
+    'jsonl': JsonlWriter,
+    'form8949': Form8949Writer,
+}
@@ -19,6 +19,7 @@ setup(
     author_email='nkouevda@gmail.com',
     license='MIT',
     packages=['capital_gains'],
+    python_requires='>=3.10',
     entry_points={
         'console_scripts': [
             'capital-gains=capital_gains.__main__:main',
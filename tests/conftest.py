@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# The modules of capital_gains import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "capital_gains"))
+
+HEADER = ("Trade Date,Order Type,Security,Cusip,Transaction Description,Quantity,"
+          "Executed Price,Commission,Net Amount")
+
+
+@pytest.fixture
+def history(tmp_path):
+    """Returns a function that writes an ETrade history and returns its file name.
+
+    Transactions are (date, order type, symbol, quantity, price), oldest first;
+    they are written newest first, like ETrade exports.
+    """
+    def write(transactions, name="history.csv"):
+        filename = tmp_path / name
+        lines = [HEADER]
+        for date, order_type, symbol, quantity, price in reversed(transactions):
+            lines.append(
+                f"{date},{order_type},{symbol},,{quantity} {symbol},{quantity},{price},0,"
+                f"{quantity * price}")
+        filename.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        return str(filename)
+
+    return write
@@ -0,0 +1,66 @@
+import contextlib
+import decimal
+import io
+
+import pytest
+
+import loader
+import logic
+import lotstore
+import selection
+from simulate import Scenario, Simulator
+
+# Account B sells its own lot, although account A holds an older one
+A = [("01/02/2023", "Buy", "ABC", 10, 100)]
+B = [
+    ("02/05/2023", "Buy", "ABC", 10, 110),
+    ("03/01/2023", "Sell", "ABC", 10, 120),
+]
+
+
+def accounts(lots_by_symbol):
+    return sorted(
+        (lot.account, lot.index, lot.sale and lot.sale.account)
+        for lots in lots_by_symbol.values() for lot in lots)
+
+
+@pytest.mark.parametrize("strategy", selection.STRATEGIES)
+def test_sales_only_close_lots_of_their_account(history, strategy):
+    filenames = [history(A, "A.csv"), history(B, "B.csv")]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        open_lots, sales = loader.load_transactions(filenames)
+        closed_lots = logic.process_all_sales(open_lots, sales, True, lot_selection=strategy)
+
+    assert accounts(closed_lots) == [("B", 1, "B")]
+    assert accounts(open_lots) == [("A", 0, None)]
+
+
+def test_stored_lots_only_close_lots_of_their_account(history, tmp_path):
+    filenames = [history(A, "A.csv"), history(B, "B.csv")]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        store = lotstore.LotStore(str(tmp_path / "lots.db"))
+        processor = logic.IncrementalProcessor(True, store)
+        for item in loader.stream_transactions(filenames):
+            processor.add(item)
+        closed_lots = processor.finish()
+
+    assert accounts(closed_lots) == [("B", 1, "B")]
+    assert accounts(processor.open_lots) == [("A", 0, None)]
+
+
+def test_simulated_sales_only_close_lots_of_their_account(history):
+    filenames = [history(A, "A.csv"), history([("02/05/2023", "Buy", "ABC", 10, 110)], "B.csv")]
+    with contextlib.redirect_stdout(io.StringIO()):
+        open_lots, sales = loader.load_transactions(filenames)
+        logic.process_all_sales(open_lots, sales, True)
+    simulator = Simulator(open_lots)
+
+    def sell(account):
+        scenario = Scenario("ABC", decimal.Decimal(10), decimal.Decimal(120), account=account)
+        return [lot.index for lot in simulator.run(scenario).closed_lots]
+
+    assert sell("B") == [1]
+    # By default, the account of the oldest lot
+    assert sell(None) == [0]
@@ -0,0 +1,21 @@
+import batch
+
+
+def test_failing_portfolio_is_isolated_and_leaves_its_output_alone(history, tmp_path):
+    good = history([
+        ("01/02/2024", "Buy", "ABC", 10, 100),
+        ("02/01/2024", "Sell", "ABC", 10, 120),
+    ], name="good.csv")
+    # An open short option can't be formatted as text
+    bad = history([("10/18/2021", "Sell To Open", "Z OCT 29 '21 $80 PUT", 10, 1)], name="bad.csv")
+    (tmp_path / "bad.gains.txt").write_text("previous\n")
+
+    results = list(batch.process_portfolios([good, bad], batch.Options(), jobs=2))
+
+    assert [result.status for result in results] == ["ok", "error"]
+    assert results[0].gain == 200
+    assert "AttributeError" in results[1].error
+    assert (tmp_path / "good.gains.txt").exists()
+    assert (tmp_path / "bad.gains.txt").read_text() == "previous\n"
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "bad.csv", "bad.gains.txt", "good.csv", "good.gains.txt"]
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import os
+
+import cache
+import loader
+import logic
+
+# Losses with replacement lots in and out of the wash sale window, and a
+# sale that splits lots
+TRANSACTIONS = [
+    ("01/03/2023", "Buy", "ABC", 10, 100),
+    ("01/03/2023", "Buy", "XYZ", 5, 50),
+    ("02/01/2023", "Sell", "ABC", 6, 80),
+    ("02/10/2023", "Buy", "ABC", 4, 85),
+    ("03/01/2023", "Sell", "XYZ", 5, 40),
+    ("03/20/2023", "Buy", "XYZ", 3, 45),
+    ("06/01/2023", "Sell", "ABC", 5, 90),
+    ("06/15/2023", "Buy", "ABC", 2, 92),
+    ("09/01/2023", "Sell", "XYZ", 2, 60),
+]
+
+
+def keys(lots_by_symbol):
+    return sorted(
+        (lot.symbol, lot.index, lot.quantity, lot.adjustment, lot.wash_sale, lot.gain,
+         lot.sale and lot.sale.index)
+        for lots in lots_by_symbol.values() for lot in lots)
+
+
+def process(filename, result_cache=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        open_lots, sales = loader.load_transactions(filename)
+        if result_cache is None:
+            closed_lots = logic.process_all_sales(open_lots, sales, True)
+        else:
+            closed_lots = cache.process_all_sales(result_cache, open_lots, sales, True, 0)
+    return keys(closed_lots), keys(open_lots)
+
+
+def test_cached_results_are_the_same(history, tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path / "cache"))
+    filename = history(TRANSACTIONS)
+    expected = process(filename)
+
+    # Processed and cached, then read from the cache
+    assert process(filename, result_cache) == expected
+    assert len(os.listdir(result_cache.directory)) == 2
+    assert process(filename, result_cache) == expected
+
+    # Another XYZ purchase shifts the indices of later ABC transactions, whose
+    # results are still reused
+    filename = history(TRANSACTIONS[:4] + [("02/20/2023", "Buy", "XYZ", 1, 42)] + TRANSACTIONS[4:])
+    assert process(filename, result_cache) == process(filename)
+    assert len(os.listdir(result_cache.directory)) == 3
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import os
+
+import columnar
+import loader
+import logic
+
+# Losses with replacement lots in and out of the wash sale window, and a
+# sale that splits lots
+TRANSACTIONS = [
+    ("01/03/2023", "Buy", "ABC", 10, 100),
+    ("01/03/2023", "Buy", "XYZ", 5, 50),
+    ("02/01/2023", "Sell", "ABC", 6, 80),
+    ("02/10/2023", "Buy", "ABC", 4, 85.5),
+    ("03/01/2023", "Sell", "XYZ", 5, 40),
+    ("03/20/2023", "Buy", "XYZ", 3, 45),
+    ("06/01/2023", "Sell", "ABC", 5, 90),
+    ("06/15/2023", "Buy", "ABC", 2, 92),
+    ("09/01/2023", "Sell", "XYZ", 2, 60),
+]
+
+
+def keys(lots_by_symbol):
+    return sorted(
+        (lot.symbol, lot.index, lot.account, lot.quantity, lot.adjustment, lot.wash_sale,
+         lot.gain, lot.sale and lot.sale.index)
+        for lots in lots_by_symbol.values() for lot in lots)
+
+
+def process(filenames, parsed_cache=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        open_lots, sales = loader.load_transactions(filenames, parsed_cache=parsed_cache)
+        closed_lots = logic.process_all_sales(open_lots, sales, True)
+    return keys(closed_lots), keys(open_lots)
+
+
+def test_cached_parse_gives_the_same_results(history, tmp_path):
+    filenames = [history(TRANSACTIONS[:5], "brokerage.csv"), history(TRANSACTIONS[5:], "ira.csv")]
+    parsed_cache = columnar.ParsedCache(str(tmp_path / "parsed"))
+    expected = process(filenames)
+
+    # Parsed and cached, then read from the cache
+    assert process(filenames, parsed_cache) == expected
+    assert len(os.listdir(parsed_cache.directory)) == 2
+    assert process(filenames, parsed_cache) == expected
+    # Only the columns that processing uses are cached
+    for filename in filenames:
+        assert ([used_columns(row) for row in parsed_cache.rows(filename, loader.parse_file)]
+                == [used_columns(row) for row in loader.parse_file(filename)])
+
+
+def used_columns(row):
+    date, order_type, symbol, _, _, quantity, price, fee, _, account = row
+    return date, order_type, symbol, quantity, price, fee, account
@@ -0,0 +1,75 @@
+import dataclasses
+import decimal
+import json
+
+import daemon
+import logic
+import writers
+
+
+def add(date, order_type, symbol, quantity, price):
+    return {"op": "add", "date": date, "order_type": order_type, "symbol": symbol,
+            "quantity": quantity, "price": price}
+
+
+def test_wash_sale_is_reported_once_and_not_kept():
+    processor = logic.IncrementalProcessor(True, keep_closed_lots=False)
+    server = daemon.Daemon(processor, writers.JsonlWriter(None, 2, 0, False))
+
+    responses = [json.loads(server.handle_line(json.dumps(request))) for request in [
+        add("2024-01-02", "buy", "ABC", 10, 100),
+        add("2024-02-01", "sell", "ABC", 10, 80),
+        add("2024-02-10", "buy", "ABC", 10, 85),
+        add("2024-04-10", "buy", "XYZ", 1, 1),
+        {"op": "finish"},
+    ]]
+
+    [closed_lot] = responses[3]["closed_lots"]
+    assert (closed_lot["wash_sale"], closed_lot["gain"]) == ("200.00", "0.00")
+    [adjustment] = responses[3]["adjustments"]
+    assert (adjustment["lot"], adjustment["adjustment"]) == (2, "200.00")
+    assert responses[4]["closed_lots"] == []
+    assert not any(processor.closed_lots.values())
+
+
+def test_invalid_transactions_are_rejected_without_losing_pending_sales():
+    processor = logic.IncrementalProcessor(True, keep_closed_lots=False)
+    server = daemon.Daemon(processor, writers.JsonlWriter(None, 2, 0, False))
+
+    def handle(request):
+        return json.loads(server.handle_line(json.dumps(request)))
+
+    assert handle(add("2024-01-02", "buy", "ABC", 10, 100))["ok"]
+    assert handle(add("2024-02-01", "sell", "ABC", 10, 120))["ok"]
+    for request in [
+        add("2024-04-01", "buy", "ABC", float("nan"), 100),
+        add("2024-04-01", "buy", "ABC", 10, "Infinity"),
+        add("2024-04-01", "buy", "ABC", -10, 100),
+        add("2024-04-01", "buy", "ABC", 10, 0),
+        {**add("2024-04-01", "buy", "ABC", 10, 100), "fee": -1},
+        add("2024-04-01", "buy", ["ABC"], 10, 100),
+        add("2024-04-01", "buy", "ABC", True, 100),
+    ]:
+        response = handle(request)
+        assert not response["ok"], request
+        assert response["error"].startswith(("ValueError", "TypeError")), response
+
+    assert len(processor.pending_sales) == 1
+    assert processor.next_index == 2
+    [closed_lot] = handle(add("2024-04-01", "buy", "XYZ", 1, 1))["closed_lots"]
+    assert closed_lot["gain"] == "200.00"
+
+
+def test_failed_sale_stays_pending():
+    processor = logic.IncrementalProcessor(True, keep_closed_lots=False)
+    server = daemon.Daemon(processor, writers.JsonlWriter(None, 2, 0, False))
+    server.handle_line(json.dumps(add("2024-01-02", "buy", "ABC", 10, 100)))
+    server.handle_line(json.dumps(add("2024-02-01", "sell", "ABC", 10, 120)))
+    # A sale that can't be processed, added behind the validation of requests
+    processor.pending_sales[0] = dataclasses.replace(
+        processor.pending_sales[0], quantity=decimal.Decimal("NaN"))
+
+    response = json.loads(server.handle_line(json.dumps({"op": "finish"})))
+
+    assert not response["ok"]
+    assert len(processor.pending_sales) == 1
@@ -0,0 +1,21 @@
+import pytest
+
+import loader
+
+TRANSACTIONS = [
+    ("01/02/2024", "Buy", "ABC", 10, 100),
+    ("01/02/2024", "Buy", "XYZ", 5, 20),
+    ("01/03/2024", "Sell", "ABC", 4, 110),
+    ("01/03/2024", "Buy", "ABC", 2, 105),
+    ("01/03/2024", "Sell", "XYZ", 5, 25),
+    ("01/09/2024", "Buy", "XYZ", 1, 22),
+    ("02/01/2024", "Sell", "ABC", 8, 90),
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+def test_newest_first_export_streams_like_it_loads(history, chunk_size):
+    filename = history(TRANSACTIONS)
+
+    assert loader._file_order(filename) == loader._REVERSED
+    assert list(loader._sorted_file_rows(filename, chunk_size)) == loader.parse_file(filename)
@@ -0,0 +1,63 @@
+import decimal
+
+import loader
+import logic
+from securities import Groups
+
+LOSS_THEN_REBUY = [
+    ("01/02/2024", "Buy", "ABC", 10, 100),
+    ("02/01/2024", "Sell", "ABC", 10, 80),
+]
+
+
+def process(filename, groups=None):
+    open_lots, sales = loader.load_transactions(filename)
+    closed_lots = logic.process_all_sales(open_lots, sales, True, groups=groups)
+    return closed_lots, open_lots
+
+
+def test_rebuying_the_same_ticker_is_a_wash_sale(history):
+    closed_lots, open_lots = process(
+        history(LOSS_THEN_REBUY + [("02/10/2024", "Buy", "ABC", 10, 85)]))
+
+    [closed_lot] = closed_lots["ABC"]
+    assert closed_lot.wash_sale == 200
+    assert closed_lot.gain == 0
+    [replacement] = open_lots["ABC"]
+    assert replacement.cost_basis == 1050
+
+
+def test_identical_ticker_wash_sale_disallows_the_loss_once(history):
+    closed_lots, open_lots = process(
+        history(LOSS_THEN_REBUY + [("02/10/2024", "Buy", "XYZ", 10, 85)]),
+        Groups([["ABC", "XYZ"]]))
+
+    [closed_lot] = closed_lots["ABC"]
+    [replacement] = open_lots["XYZ"]
+    assert replacement.cost_basis == 1050
+    assert closed_lot.wash_sale == replacement.adjustment == 200
+    assert closed_lot.gain == 0
+
+
+def test_partial_replacement_only_disallows_its_share(history):
+    closed_lots, open_lots = process(
+        history(LOSS_THEN_REBUY + [("02/10/2024", "Buy", "ABC", 4, 85)]))
+
+    [closed_lot] = closed_lots["ABC"]
+    assert closed_lot.wash_sale == 80
+    assert closed_lot.gain == -120
+    [replacement] = open_lots["ABC"]
+    assert replacement.adjustment == 80
+
+
+def test_rest_of_the_same_purchase_is_not_a_replacement(history):
+    closed_lots, open_lots = process(history([
+        ("01/02/2024", "Buy", "ABC", 10, 100),
+        ("02/01/2024", "Sell", "ABC", 4, 80),
+    ]))
+
+    [closed_lot] = closed_lots["ABC"]
+    assert closed_lot.wash_sale == 0
+    assert closed_lot.gain == -80
+    [rest] = open_lots["ABC"]
+    assert rest.adjustment == decimal.Decimal(0)
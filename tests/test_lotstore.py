@@ -0,0 +1,46 @@
+import contextlib
+import io
+
+import loader
+import logic
+import lotstore
+
+# Losses with replacement lots in and out of the wash sale window, and a
+# sale that splits lots
+TRANSACTIONS = [
+    ("01/03/2023", "Buy", "ABC", 10, 100),
+    ("01/03/2023", "Buy", "XYZ", 5, 50),
+    ("02/01/2023", "Sell", "ABC", 6, 80),
+    ("02/10/2023", "Buy", "ABC", 4, 85),
+    ("03/01/2023", "Sell", "XYZ", 5, 40),
+    ("03/20/2023", "Buy", "XYZ", 3, 45),
+    ("06/01/2023", "Sell", "ABC", 5, 90),
+    ("06/15/2023", "Buy", "ABC", 2, 92),
+    ("09/01/2023", "Sell", "XYZ", 2, 60),
+]
+
+
+def keys(lots_by_symbol):
+    return sorted(
+        (lot.symbol, lot.index, lot.quantity, lot.adjustment, lot.wash_sale, lot.gain,
+         lot.sale and lot.sale.index)
+        for lots in lots_by_symbol.values() for lot in lots)
+
+
+def test_stored_lots_give_the_same_results(history, tmp_path):
+    filename = history(TRANSACTIONS)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        open_lots, sales = loader.load_transactions(filename)
+        closed_lots = logic.process_all_sales(open_lots, sales, True)
+
+        with lotstore.LotStore(str(tmp_path / "lots.db")) as store:
+            processor = logic.IncrementalProcessor(True, store)
+            for item in loader.stream_transactions(filename):
+                processor.add(item)
+            stored_closed_lots = keys(processor.finish())
+            stored_open_lots = keys(processor.open_lots)
+
+    assert stored_closed_lots == keys(closed_lots)
+    assert stored_open_lots == keys(open_lots)
+    assert any(lot.wash_sale for lots in closed_lots.values() for lot in lots)
@@ -0,0 +1,105 @@
+import contextlib
+import datetime as dt
+import decimal
+import io
+import os
+import sys
+
+import pytest
+
+import loader
+import logic
+import selection
+from lotbook import LotBook
+from model import Lot, Transaction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks"))
+import generate  # noqa: E402
+
+
+def transaction(index, quantity, price, day=1):
+    return Transaction(
+        index, dt.date(2024, 1, day), "ABC", False, None, decimal.Decimal(quantity),
+        decimal.Decimal(price), decimal.Decimal(0))
+
+
+def split_and_adjust(book):
+    """Splits the newest lot as a wash sale would, adjusting its first part."""
+    lot = list(book)[-1]
+    first_lot, _ = book.split(lot, decimal.Decimal(4))
+    book.adjust(first_lot, decimal.Decimal(0))
+    return first_lot
+
+
+@pytest.mark.parametrize("strategy", ["lifo", "hifo", "min-tax"])
+def test_ties_between_parts_do_not_depend_on_heap_history(strategy):
+    sale = transaction(5, -1, 100, day=20)
+
+    def book():
+        return LotBook([Lot(transaction(0, 10, 90)), Lot(transaction(1, 10, 100))])
+
+    # Heaps built before the split, then updated
+    early = book()
+    early.select(sale, strategy)
+    early_first_lot = split_and_adjust(early)
+
+    # Heaps built after the split
+    late = book()
+    late_first_lot = split_and_adjust(late)
+
+    assert early.select(sale, strategy) is early_first_lot
+    assert late.select(sale, strategy) is late_first_lot
+
+
+@pytest.mark.parametrize("strategy", ["lifo", "hifo", "min-tax"])
+def test_heaps_drop_stale_entries_of_closed_lots(strategy):
+    book = LotBook([Lot(transaction(i, 10, 100 + i % 7, day=1 + i % 28)) for i in range(500)])
+    sale = transaction(1000, -1, 100, day=28)
+
+    while len(book):
+        lot = book.select(sale, strategy)
+        expected = min(book, key=lambda other: (
+            -other.index if strategy == "lifo" else -selection.basis_per_share(other),
+            other.index))
+        assert lot is expected
+        # Adjust another lot, which leaves a stale entry too
+        for other in book.lots(None):
+            if other is not lot:
+                book.adjust(other, other.adjustment + 1)
+                break
+        book.remove(lot)
+
+        heap_selection = book._selections[None][strategy]
+        entries = sum(len(heap) for heap in heap_selection._heaps())
+        assert entries <= (2 * heap_selection.ENTRIES_PER_LOT * len(book)
+                           + selection.MIN_STALE_ENTRIES + 1)
+
+
+def lot_key(lot):
+    return (lot.symbol, lot.index, lot.quantity, lot.adjustment, lot.wash_sale,
+            lot.sale and lot.sale.index)
+
+
+@pytest.mark.parametrize("strategy", selection.STRATEGIES)
+@pytest.mark.parametrize("seed", range(5))
+def test_stream_and_batch_processing_agree(strategy, seed, tmp_path):
+    filename = tmp_path / "history.csv"
+    with open(filename, "w", encoding="utf-8", newline="") as out_file:
+        generate.generate(out_file, generate.Parameters(
+            symbols=3, lots_per_symbol=50, wash_sale_ratio=0.8, seed=seed))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        open_lots, sales = loader.load_transactions(str(filename))
+        closed_lots = logic.process_all_sales(open_lots, sales, True, lot_selection=strategy)
+
+        processor = logic.IncrementalProcessor(True, lot_selection=strategy)
+        for item in loader.stream_transactions(str(filename)):
+            processor.add(item)
+        stream_closed_lots = processor.finish()
+
+    def keys(lots_by_symbol):
+        return sorted(lot_key(lot) for lots in lots_by_symbol.values() for lot in lots)
+
+    assert keys(stream_closed_lots) == keys(closed_lots)
+    assert keys(processor.open_lots) == keys(open_lots)
+    assert any(lot.wash_sale for lots in closed_lots.values() for lot in lots)
@@ -0,0 +1,56 @@
+import datetime as dt
+import decimal
+
+import loader
+import logic
+from simulate import Scenario, Simulator
+
+HISTORY = [
+    ("01/02/2024", "Buy", "ABC", 10, 100),
+    ("02/20/2024", "Buy", "ABC", 10, 90),
+]
+
+
+def simulator(filename):
+    open_lots, sales = loader.load_transactions(filename)
+    logic.process_all_sales(open_lots, sales, True)
+    return Simulator(open_lots)
+
+
+def sell(quantity):
+    return Scenario("ABC", decimal.Decimal(quantity), decimal.Decimal(80), dt.date(2024, 3, 1))
+
+
+def test_wash_sale_defers_the_loss_to_the_replacement_lot(history):
+    result = simulator(history(HISTORY)).run(sell(10))
+
+    assert result.realized_gain == 0
+    assert result.disallowed_loss == 200
+    [replacement] = result.replacement_lots
+    assert replacement.date == dt.date(2024, 2, 20)
+    assert replacement.cost_basis == 1100
+
+
+def test_selling_the_replacement_lot_realizes_the_loss(history):
+    result = simulator(history(HISTORY)).run(sell(15))
+
+    assert result.realized_gain == -150
+    assert result.disallowed_loss == 100
+    [replacement] = result.replacement_lots
+    assert replacement.quantity == 5
+
+
+def test_rank_by_realized_gain_net_of_wash_sales(history):
+    results = simulator(history(HISTORY)).rank([sell(10), sell(20)])
+
+    assert [result.scenario.quantity for result in results] == [20, 10]
+    assert [result.realized_gain for result in results] == [-300, 0]
+    assert results[0].disallowed_loss == 0
+    assert results[0].replacement_lots == []
+
+
+def test_scenarios_leave_the_open_lots_unchanged(history):
+    sim = simulator(history(HISTORY))
+    sim.run(sell(15))
+
+    assert [lot.adjustment for lot in sim.open_lots["ABC"]] == [0, 0]
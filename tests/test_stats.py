@@ -0,0 +1,16 @@
+import stats
+
+
+def test_worker_times_are_kept_apart_from_wall_time():
+    parent = stats.Stats()
+    parent.times["parse"] = 1.0
+    for _ in range(4):
+        worker = stats.Stats()
+        worker.times["lot matching"] = 2.0
+        worker.counters["ABC"]["sales"] = 3
+        parent.merge(worker)
+
+    assert parent.times["lot matching"] == 0
+    assert parent.worker_times["lot matching"] == 8.0
+    assert parent.counters["ABC"]["sales"] == 12
+    assert "worker seconds (summed)" in parent.format()
@@ -0,0 +1,47 @@
+import csv
+import io
+import os
+import subprocess
+import sys
+
+CAPITAL_GAINS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "capital_gains")
+
+# The 2023 sale closes the lot bought after the 2022 sale, since that sale
+# closed the first lot; without the 2022 sale, it closes the first lot
+TRANSACTIONS = [
+    ("01/03/2022", "Buy", "ABC", 10, 100),
+    ("06/01/2022", "Sell", "ABC", 10, 120),
+    ("07/01/2022", "Buy", "ABC", 10, 130),
+    ("03/01/2023", "Sell", "ABC", 10, 110),
+    ("03/15/2023", "Buy", "XYZ", 1, 10),
+]
+
+
+def run(*args):
+    result = subprocess.run(
+        [sys.executable, CAPITAL_GAINS, "-f", "csv", *args],
+        capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def closed_lots(output, year):
+    return [
+        row for row in csv.DictReader(io.StringIO(output))
+        if row["status"] == "closed" and row["sold"].startswith(str(year))]
+
+
+def test_year_files_match_the_whole_history_not_fiscal_year(history, tmp_path):
+    filename = history(TRANSACTIONS)
+    pattern = str(tmp_path / "gains-{year}.csv")
+
+    run("--output-per-year", pattern, filename)
+    with open(pattern.format(year=2023), encoding="utf-8") as in_file:
+        year_file = in_file.read()
+
+    assert closed_lots(year_file, 2023) == closed_lots(run(filename), 2023)
+    [lot] = closed_lots(year_file, 2023)
+    assert (lot["acquired"], lot["gain"]) == ("2022-07-01", "-200")
+
+    # Without the 2022 sale, the 2023 sale closes the first lot instead
+    [fiscal_year_lot] = closed_lots(run("-y", "2023", filename), 2023)
+    assert (fiscal_year_lot["acquired"], fiscal_year_lot["gain"]) == ("2022-01-03", "100")